@@ -0,0 +1,423 @@
+"""
+Benchmarks. They are not part of the test suite and are run on demand:
+
+    python manage.py test Post.benchmarks -v 2
+
+Each one prints its measurements and asserts only what does not depend on the
+machine it runs on. They need the same Redis (and, where noted, PostgreSQL) as the
+tests.
+"""
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.backends.postgresql.base import DatabaseWrapper
+from django.test import AsyncClient, Client, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django_redis import get_redis_connection
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from Post import view_counter, views
+from Post.models import Answer, Question
+from Post.serializers import QuestionSerializer
+from Post.tests import RedisTestCase, make_question, make_user
+from Post.utils import get_or_create_tags
+from StackOverflowCopy import cache as cache_ns
+from StackOverflowCopy.renderers import FastJSONParser, FastJSONRenderer
+from User import views as user_views
+from User.models import CustomUser
+from User.serializers import UserSerializer
+
+
+def report(title, header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    print(f'\n{title}')
+    for row in (header, *rows):
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def per_call(run, number):
+    """Best of three average seconds per run() call, over `number` calls."""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def percentile(samples, fraction):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def measure(run):
+    """Wall and CPU seconds taken by run()."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    run()
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+# the read endpoints as the WSGI deployment routed them, to the sync views
+urlpatterns = [
+    path('api/questions/', views.questions_list_and_create),
+    path('api/questions/<int:id>/', views.question_details_edit_delete),
+    path('api/answers/', views.answer_list_create),
+    path('api/tags/', views.tags_list),
+    path('api/users/<int:id>/', user_views.user_details),
+]
+
+
+class ViewTrackingLatencyBenchmark(RedisTestCase):
+    """
+    Latency of the question detail GET with view tracking off and on, through the ASGI
+    front (the deployed route) and the sync view. Every request comes from a new viewer,
+    so each one is counted. Requests of the two settings alternate, so drift in the
+    machine's speed affects both alike. Tracking must not add a database query.
+    """
+    REQUESTS = 300
+
+    def setUp(self):
+        super().setUp()
+        author, _ = make_user('author')
+        self.question = make_question(author, tags=['python', 'django'])
+        for i in range(5):
+            Answer.objects.create(question=self.question, author=author, content=f'Answer number {i}.')
+
+    def get(self, client, urlconf, viewer):
+        with override_settings(ROOT_URLCONF=urlconf):
+            return client.get(f'/api/questions/{self.question.id}/', REMOTE_ADDR=f'10.0.{viewer // 256}.{viewer % 256}')
+
+    def pending_views(self):
+        return int(get_redis_connection('default').hget(view_counter.PENDING_KEY, self.question.id) or 0)
+
+    def test_detail_latency(self):
+        client = Client()
+        rows = []
+        for name, urlconf in (('ASGI front', 'StackOverflowCopy.urls'), ('sync view', __name__)):
+            cache.clear()
+            latencies = {False: [], True: []}
+            queries = {}
+            for tracking in (False, True):
+                with self.settings(VIEW_TRACKING_ENABLED=tracking), CaptureQueriesContext(connection) as captured:
+                    self.assertEqual(self.get(client, urlconf, viewer=0).status_code, 200)
+                queries[tracking] = len(captured)
+            for viewer in range(1, self.REQUESTS + 1):
+                for tracking in (False, True):
+                    with self.settings(VIEW_TRACKING_ENABLED=tracking):
+                        start = time.perf_counter()
+                        response = self.get(client, urlconf, viewer)
+                        latencies[tracking].append(time.perf_counter() - start)
+                    self.assertEqual(response.status_code, 200)
+            self.assertEqual(queries[True], queries[False])
+            # the warm-up viewer plus one per tracked request
+            self.assertEqual(self.pending_views(), self.REQUESTS + 1)
+            for tracking in (False, True):
+                rows.append((
+                    name, 'on' if tracking else 'off', queries[tracking],
+                    f'{percentile(latencies[tracking], 0.5) * 1000:.2f}',
+                    f'{percentile(latencies[tracking], 0.95) * 1000:.2f}',
+                ))
+        report('Question detail GET', ('route', 'tracking', 'queries', 'p50 ms', 'p95 ms'), rows)
+
+
+class AsyncReadThroughputBenchmark(TransactionTestCase):
+    """
+    Requests per second per core of the hot read endpoints: the sync views served one
+    request at a time, as a sync gunicorn worker does, against the ASGI fronts served
+    CONCURRENCY at a time on one event loop. Both run in this process, so CPU seconds
+    are what a single worker core spends on them.
+
+    The ASGI handler runs each request's sync code in a thread of its own, so the data
+    is committed rather than kept in a test transaction. The test client leaves
+    connections open at the end of a request, so both runs close them as
+    request_finished would.
+    """
+    ROUNDS = 20
+    CONCURRENCY = 50
+
+    def setUp(self):
+        cache.clear()
+        self.author, _ = make_user('author')
+        questions = [make_question(self.author, title=f'Question number {i}', tags=['python']) for i in range(10)]
+        for question in questions:
+            for i in range(5):
+                Answer.objects.create(question=question, author=self.author, content=f'Answer number {i}.')
+        self.urls = [
+            '/api/questions/',
+            '/api/tags/',
+            f'/api/users/{self.author.id}/',
+            *(f'/api/questions/{question.id}/' for question in questions),
+            *(f'/api/answers/?question_id={question.id}' for question in questions),
+        ]
+
+    def wsgi_run(self):
+        client = Client()
+        responses = []
+        with override_settings(ROOT_URLCONF=__name__):
+            for url in self.urls * self.ROUNDS:
+                responses.append(client.get(url))
+                connections.close_all()
+        return responses
+
+    async def asgi_run(self):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+
+        async def get(url):
+            # a thread for the request's sync code, as ASGIHandler gives it
+            async with semaphore, ThreadSensitiveContext():
+                response = await client.get(url)
+                await sync_to_async(connections.close_all)()
+            return response
+        return await asyncio.gather(*(get(url) for url in self.urls * self.ROUNDS))
+
+    def asgi_serve(self):
+        # an event loop in a thread of its own, as the ASGI server runs it, so nothing
+        # the test client left in this thread's context is inherited
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.asgi_run()).result()
+
+    def test_requests_per_second(self):
+        runs = {
+            'WSGI, sync views': self.wsgi_run,
+            'ASGI, async fronts': self.asgi_serve,
+        }
+        # warm the caches both deployments read from
+        for run in runs.values():
+            run()
+        results = {}
+        rows = []
+        for name, run in runs.items():
+            responses = []
+            wall, cpu = measure(lambda: responses.extend(run()))
+            results[name] = responses
+            rows.append((name, len(responses), f'{len(responses) / wall:.0f}', f'{len(responses) / cpu:.0f}'))
+        report('Read endpoints', ('deployment', 'requests', 'req/s', 'req/s per core'), rows)
+
+        wsgi, asgi = results.values()
+        self.assertTrue(all(response.status_code == 200 for response in wsgi + asgi))
+        self.assertEqual([response.json() for response in wsgi], [response.json() for response in asgi])
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class StampedeBenchmark(TransactionTestCase):
+    """
+    REQUESTS concurrent GETs of the front page right after its cache entry expired, once
+    per expiry. Each recompute of the page runs QuestionSerializer.setup_eager_loading
+    once, so its calls count the recomputes. Within a worker, the requests share one
+    compute() through the in-process single flight; with that disabled every request
+    stands for a worker of its own and only the Redis recompute lock coalesces them.
+    """
+    REQUESTS = 500
+    EXPIRIES = 3
+
+    def setUp(self):
+        cache.clear()
+        author, _ = make_user('author')
+        for i in range(20):
+            make_question(author, title=f'Question number {i}', tags=['python'])
+
+    def burst(self):
+        """Latencies of REQUESTS GETs released at once."""
+        barrier = threading.Barrier(self.REQUESTS)
+        latencies = []
+
+        def get():
+            client = Client()
+            barrier.wait()
+            start = time.perf_counter()
+            response = client.get('/api/questions/')
+            latencies.append(time.perf_counter() - start)
+            connections.close_all()
+            self.assertEqual(response.status_code, 200)
+        threads = [threading.Thread(target=get) for _ in range(self.REQUESTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(latencies)
+
+    def recomputes(self, across_workers):
+        rows = []
+        counter = mock.patch.object(
+            QuestionSerializer, 'setup_eager_loading', wraps=QuestionSerializer.setup_eager_loading,
+        )
+        single_flight = mock.patch.object(
+            cache_ns, '_single_flight', side_effect=lambda key, fn: fn(),
+        ) if across_workers else mock.MagicMock()
+        with counter as setup_eager_loading, single_flight:
+            for expiry in range(self.EXPIRIES):
+                # the entry expires: Redis drops the key
+                cache.delete_pattern('*question_list*')
+                setup_eager_loading.reset_mock()
+                latencies = self.burst()
+                rows.append((
+                    'across workers' if across_workers else 'one worker', expiry + 1,
+                    setup_eager_loading.call_count,
+                    f'{latencies[len(latencies) // 2] * 1000:.0f}', f'{latencies[-1] * 1000:.0f}',
+                ))
+        return rows
+
+    def test_one_recompute_per_expiry(self):
+        rows = self.recomputes(across_workers=False) + self.recomputes(across_workers=True)
+        report(
+            f'{self.REQUESTS} concurrent requests per expiry',
+            ('coalesced', 'expiry', 'recomputes', 'p50 ms', 'max ms'), rows,
+        )
+        self.assertEqual([row[2] for row in rows], [1] * len(rows))
+
+
+# a question body the way the editor sends it: markdown, code, quotes, non-ASCII text
+CONTENT = (
+    'Как отсортировать "словарь" по значению?\n\n```python\nd = {"b": 2, "a": 1}\n'
+    'print(sorted(d.items(), key=lambda kv: kv[1]))\n```\n\nTried `dict(sorted(...))` '
+    'but the order is lost \u2014 why? Emoji \U0001f914, tab\t and a line separator \u2028.\n'
+) * 10
+
+
+class RendererBenchmark(RedisTestCase):
+    """
+    FastJSONRenderer/FastJSONParser against DRF's JSONRenderer/JSONParser on 100-item
+    pages of QuestionSerializer (with full content bodies) and UserSerializer. The
+    rendered bytes and the parsed data must be identical.
+    """
+    PAGE_SIZE = 100
+    NUMBER = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        author = CustomUser.objects.create_user(email='author@example.com', username='author', password='pw')
+        tags = get_or_create_tags(['python', 'django', 'словари'])
+        for i in range(cls.PAGE_SIZE):
+            question = Question.objects.create(author=author, title=f'Question number {i}', content=CONTENT)
+            question.tags.set(tags)
+        users = CustomUser.objects.bulk_create([
+            CustomUser(
+                email=f'user{i}@example.com', username=f'user{i}', password='!',
+                displayName=f'Пользователь {i}', location='Алматы', reputation=i * 37,
+            ) for i in range(cls.PAGE_SIZE)
+        ])
+        for user in users:
+            user.top_tags.set(tags)
+
+    def page(self, serializer_class, model):
+        queryset = serializer_class.setup_eager_loading(model.objects.order_by('id'))[:self.PAGE_SIZE]
+        results = serializer_class(queryset, many=True).data
+        return {'count': self.PAGE_SIZE, 'next': None, 'previous': None, 'results': results}
+
+    def test_byte_compatible_and_faster(self):
+        rows = []
+        for name, data in (
+            ('questions', self.page(QuestionSerializer, Question)),
+            ('users', self.page(UserSerializer, CustomUser)),
+        ):
+            stdlib, fast = JSONRenderer().render(data), FastJSONRenderer().render(data)
+            self.assertEqual(fast, stdlib)
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(stdlib)), JSONParser().parse(io.BytesIO(stdlib)))
+            render = (
+                per_call(lambda: JSONRenderer().render(data), self.NUMBER),
+                per_call(lambda: FastJSONRenderer().render(data), self.NUMBER),
+            )
+            parse = (
+                per_call(lambda: JSONParser().parse(io.BytesIO(stdlib)), self.NUMBER),
+                per_call(lambda: FastJSONParser().parse(io.BytesIO(stdlib)), self.NUMBER),
+            )
+            for step, (before, after) in (('render', render), ('parse', parse)):
+                rows.append((
+                    name, step, len(stdlib), f'{before * 1e6:.0f}', f'{after * 1e6:.0f}', f'{before / after:.1f}x',
+                ))
+        report(
+            f'{self.PAGE_SIZE}-item pages',
+            ('page', 'step', 'bytes', 'DRF us', 'fast us', 'speedup'), rows,
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'connection pooling is PostgreSQL only')
+class ConnectionSetupBenchmark(TransactionTestCase):
+    """
+    Connection setup time per request for each DATABASES mode of settings.py: a new
+    connection per request (no pool, CONN_MAX_AGE=0, as before), persistent connections
+    with health checks, and the psycopg pool. A request is what Django does around a
+    view: close_if_unusable_or_obsolete() on request_started and request_finished, with
+    one query in between. Setup is the time a request takes beyond that query on an open
+    connection. Against a local server a connection is cheap; against Supabase it adds
+    the network round trips and the TLS handshake.
+    """
+    REQUESTS = 200
+    MODES = {
+        'new connection per request': {'CONN_MAX_AGE': 0},
+        'persistent, health checks': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+        # as settings.py configures it by default
+        'pool': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True, 'OPTIONS': {'pool': {
+            'min_size': 1, 'max_size': 10, 'timeout': 10,
+        }}},
+    }
+
+    def wrapper(self, mode, overrides):
+        settings_dict = {**connection.settings_dict, 'CONN_HEALTH_CHECKS': False, **overrides}
+        wrapper = DatabaseWrapper(settings_dict, alias=f'benchmark {mode}')
+        self.addCleanup(wrapper.close_pool)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def request(self, wrapper):
+        """Seconds the request took and the server process that served its query."""
+        start = time.perf_counter()
+        wrapper.close_if_unusable_or_obsolete()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            pid = cursor.fetchone()[0]
+        wrapper.close_if_unusable_or_obsolete()
+        return time.perf_counter() - start, pid
+
+    def query_time(self):
+        """Seconds of the request's query alone, on a connection that stays open."""
+        wrapper = self.wrapper('query', {'CONN_MAX_AGE': None})
+        wrapper.ensure_connection()
+        timings = []
+        for _ in range(self.REQUESTS):
+            start = time.perf_counter()
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                cursor.fetchone()
+            timings.append(time.perf_counter() - start)
+        return percentile(timings, 0.5)
+
+    def test_connection_setup_per_request(self):
+        query = self.query_time()
+        rows = []
+        connections_opened = {}
+        for mode, overrides in self.MODES.items():
+            wrapper = self.wrapper(mode, overrides)
+            # the first request of a persistent connection or a pool opens it
+            self.request(wrapper)
+            timings, pids = [], set()
+            for _ in range(self.REQUESTS):
+                elapsed, pid = self.request(wrapper)
+                timings.append(elapsed)
+                pids.add(pid)
+            connections_opened[mode] = len(pids)
+            rows.append((
+                mode, len(pids),
+                f'{percentile(timings, 0.5) * 1000:.2f}',
+                f'{max(percentile(timings, 0.5) - query, 0) * 1000:.2f}',
+                f'{percentile(timings, 0.95) * 1000:.2f}',
+            ))
+        report(
+            f'{self.REQUESTS} requests of one query (query alone: {query * 1000:.2f} ms)',
+            ('mode', 'connections', 'p50 ms', 'setup p50 ms', 'p95 ms'), rows,
+        )
+        self.assertEqual(connections_opened['new connection per request'], self.REQUESTS)
+        self.assertEqual(connections_opened['persistent, health checks'], 1)
+        # the pool may open its min_size connection alongside the one the first request waited for
+        self.assertLessEqual(connections_opened['pool'], self.MODES['pool']['OPTIONS']['pool']['max_size'])
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from Post import stats
+from Post.models import Question, Answer
+from User import profile_cache
+from User.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized counters Question.answer_count, "
+        "CustomUser.question_count and CustomUser.answer_count in chunks, "
+        "and rebuild TagStats, UserTagStats and CustomUser.top_tags."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        counters = [
+            (Question, 'answer_count', Answer, 'question_id'),
+            (CustomUser, 'question_count', Question, 'author_id'),
+            (CustomUser, 'answer_count', Answer, 'author_id'),
+        ]
+        for model, field, child_model, foreign_key in counters:
+            fixed = self.recount(model, field, child_model, foreign_key, chunk_size)
+            self.stdout.write(f"{model.__name__}.{field}: {fixed} row(s) fixed")
+        stats.rebuild_tag_stats()
+        self.stdout.write("TagStats rebuilt")
+        user_ids = list(CustomUser.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            stats.rebuild_user_tag_stats(chunk)
+            stats.rebuild_top_tags(chunk)
+        self.stdout.write("UserTagStats and top_tags rebuilt")
+
+    def recount(self, model, field, child_model, foreign_key, chunk_size):
+        fixed = 0
+        last_pk = 0
+        while True:
+            current = dict(
+                model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', field)[:chunk_size]
+            )
+            if not current:
+                return fixed
+            # one GROUP BY per chunk
+            actual = dict(
+                child_model.objects.filter(**{f"{foreign_key}__in": list(current)})
+                .values_list(foreign_key).annotate(total=Count('pk')).order_by()
+            )
+            stale = {pk: actual.get(pk, 0) for pk, value in current.items() if value != actual.get(pk, 0)}
+            if stale:
+                model.objects.filter(pk__in=list(stale)).update(**{field: Case(
+                    *[When(pk=pk, then=Value(value)) for pk, value in stale.items()],
+                    output_field=IntegerField(),
+                )})
+                fixed += len(stale)
+                if model is CustomUser:
+                    profile_cache.refresh(stale)
+            last_pk = max(current)
@@ -0,0 +1,42 @@
+# Full-text search column for Post.search.PostgresSearchBackend.
+#
+# The column is a stored generated tsvector, so PostgreSQL keeps it in sync on every
+# insert/update without any application code. It is not declared on the Question model:
+# other databases (SQLite in tests) use the pure-Python search backend instead.
+
+from django.db import migrations
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        '''
+        ALTER TABLE "Post_question" ADD COLUMN "search_vector" tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce("title", '')), 'A') ||
+            setweight(to_tsvector('english', coalesce("content", '')), 'B')
+        ) STORED
+        '''
+    )
+    schema_editor.execute(
+        'CREATE INDEX "question_search_vector_idx" ON "Post_question" USING GIN ("search_vector")'
+    )
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS "question_search_vector_idx"')
+    schema_editor.execute('ALTER TABLE "Post_question" DROP COLUMN IF EXISTS "search_vector"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Post', '0012_answer_answer_question_votes_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:19
+#
+# The old unique_together included the NULL foreign key of the other kind of vote, so it
+# never fired and concurrent votes could leave duplicates behind. They are removed before
+# the partial unique constraints are added: the latest vote of each user on a post is
+# kept, the post's vote_count is recomputed from the votes left and the reputation the
+# removed votes gave the author is taken back, with a Reputation row recording it.
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Q
+
+# reputation the author got for one vote of each type
+REPUTATION_POINTS = {
+    'question': {'upvote': 10, 'downvote': -10},
+    'answer': {'upvote': 20, 'downvote': -20},
+}
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    Vote = apps.get_model('Post', 'Vote')
+    CustomUser = apps.get_model('User', 'CustomUser')
+    Reputation = apps.get_model('User', 'Reputation')
+
+    for kind, other in (('question', 'answer'), ('answer', 'question')):
+        Post = apps.get_model('Post', kind.capitalize())
+        votes = Vote.objects.filter(**{f"{kind}__isnull": False, f"{other}__isnull": True})
+        duplicated = (
+            votes.values('user_id', f"{kind}_id")
+            .annotate(total=Count('id'), keep=Max('id'))
+            .filter(total__gt=1)
+            .order_by()
+        )
+        post_ids = set()
+        taken_back = {}
+        for row in duplicated.iterator():
+            post_id = row[f"{kind}_id"]
+            removed = votes.filter(user_id=row['user_id'], **{f"{kind}_id": post_id}).exclude(id=row['keep'])
+            author_id = Post.objects.filter(pk=post_id).values_list('author_id', flat=True).first()
+            if author_id != row['user_id']:
+                points = sum(
+                    REPUTATION_POINTS[kind][vote_type] for vote_type in removed.values_list('vote_type', flat=True)
+                )
+                taken_back[author_id] = taken_back.get(author_id, 0) + points
+            removed.delete()
+            post_ids.add(post_id)
+
+        for post_id in post_ids:
+            tally = votes.filter(**{f"{kind}_id": post_id}).aggregate(
+                up=Count('id', filter=Q(vote_type='upvote')),
+                down=Count('id', filter=Q(vote_type='downvote')),
+            )
+            Post.objects.filter(pk=post_id).update(vote_count=tally['up'] - tally['down'])
+        for author_id, points in taken_back.items():
+            if points:
+                CustomUser.objects.filter(pk=author_id).update(reputation=F('reputation') - points)
+                Reputation.objects.create(
+                    user_id=author_id,
+                    type=f"{kind}_{'downvote' if points > 0 else 'upvote'}",
+                    change=-points,
+                    description=f"Duplicate {kind} votes removed",
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Post', '0013_question_search_vector'),
+        ('User', '0010_reputation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set(),
+        ),
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(condition=models.Q(('answer__isnull', True)), fields=('user', 'question'), name='unique_question_vote'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(condition=models.Q(('question__isnull', True)), fields=('user', 'answer'), name='unique_answer_vote'),
+        ),
+    ]
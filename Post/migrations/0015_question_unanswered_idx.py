@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Post', '0014_vote_unique_constraints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('answer_count', 0)), fields=['-created_at', '-id'], name='question_unanswered_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:22
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+
+def populate_tag_stats(apps, schema_editor):
+    Tag = apps.get_model('Post', 'Tag')
+    TagStats = apps.get_model('Post', 'TagStats')
+    now = timezone.now()
+    tags = Tag.objects.annotate(
+        total=Count('questions'),
+        week=Count('questions', filter=Q(questions__created_at__gte=now - datetime.timedelta(days=7))),
+        month=Count('questions', filter=Q(questions__created_at__gte=now - datetime.timedelta(days=30))),
+        last_activity=Max('questions__created_at'),
+    )
+    TagStats.objects.bulk_create([
+        TagStats(tag_id=tag.id, question_count=tag.total, questions_this_week=tag.week,
+                 questions_this_month=tag.month, last_activity_at=tag.last_activity)
+        for tag in tags
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Post', '0015_question_unanswered_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagStats',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='Post.tag')),
+                ('question_count', models.IntegerField(default=0)),
+                ('questions_this_week', models.IntegerField(default=0)),
+                ('questions_this_month', models.IntegerField(default=0)),
+                ('last_activity_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-question_count', '-tag'], name='tagstats_popular_idx')],
+            },
+        ),
+        migrations.RunPython(populate_tag_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:05
+#
+# Question.answer_count and CustomUser.question_count/answer_count were never maintained
+# before Post/signals.py started incrementing them; the rows that existed by then are
+# recomputed once here, as `manage.py recount` would.
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, foreign_key):
+    counts = (
+        model.objects.filter(**{foreign_key: OuterRef('pk')})
+        .order_by().values(foreign_key).annotate(total=Count('pk')).values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def backfill_counters(apps, schema_editor):
+    Question = apps.get_model('Post', 'Question')
+    Answer = apps.get_model('Post', 'Answer')
+    CustomUser = apps.get_model('User', 'CustomUser')
+    Question.objects.update(answer_count=count_of(Answer, 'question'))
+    CustomUser.objects.update(
+        question_count=count_of(Question, 'author'),
+        answer_count=count_of(Answer, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Post', '0016_tagstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
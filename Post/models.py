@@ -12,6 +12,22 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+class TagStats(models.Model):
+    """Per-tag counters maintained incrementally by Post.stats (never computed at read time)."""
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    question_count = models.IntegerField(default=0)
+    questions_this_week = models.IntegerField(default=0)
+    questions_this_month = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-question_count', '-tag'], name='tagstats_popular_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag_id}: {self.question_count}"
+
 class Question(models.Model):
     title = models.CharField(max_length=255)
     content = models.TextField()
@@ -23,6 +39,16 @@ class Question(models.Model):
     tags = models.ManyToManyField(Tag, related_name='questions', blank=True)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    class Meta:
+        # (sort column, id) pairs used by keyset pagination
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='question_created_idx'),
+            models.Index(fields=['-updated_at', '-id'], name='question_updated_idx'),
+            models.Index(fields=['-vote_count', '-id'], name='question_votes_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(answer_count=0),
+                         name='question_unanswered_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -35,6 +61,12 @@ class Answer(models.Model):
     is_accepted = models.BooleanField(default=False)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='answers')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', '-vote_count', '-id'], name='answer_question_votes_idx'),
+            models.Index(fields=['question', 'created_at', 'id'], name='answer_question_created_idx'),
+        ]
+
     def __str__(self):
         return f"Answer by userid:{self.author.id} on questionid:{self.question.id}"
 
@@ -48,7 +80,13 @@ class Vote(models.Model):
     vote_type = models.CharField(max_length=10, choices=VOTE_TYPES)
 
     class Meta:
-        unique_together = ('user', 'question', 'answer')
+        # NULLs never collide in a plain unique index, so each kind of vote gets its own
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'], condition=models.Q(answer__isnull=True),
+                                    name='unique_question_vote'),
+            models.UniqueConstraint(fields=['user', 'answer'], condition=models.Q(question__isnull=True),
+                                    name='unique_answer_vote'),
+        ]
 
     def __str__(self):
         if self.question:
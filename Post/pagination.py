@@ -1,10 +1,189 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from StackOverflowCopy.cache import cached_computation
+
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
+    max_page_size = 100
 
 class TagCustomPageNumberPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (sort column, id).
+
+    A page is a range read `WHERE (col, id) < (last_col, last_id) ORDER BY col, id LIMIT n`
+    instead of OFFSET, so page 5000 costs the same as page 1. `ordering` must end with
+    a unique column (id). The total count is only computed with `?with_count=true`,
+    and is cached.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+
+    def __init__(self, ordering):
+        self.ordering = tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self._reversed(self.ordering) if reverse else self.ordering
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true', 'True'):
+            self.count = cached_count(queryset)
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position, queryset))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return self.first_page_link()
+        return self.encode_cursor(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.first_page_link()
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def first_page_link(self):
+        # an empty `cursor` keeps the client in keyset mode (see get_paginator)
+        return replace_query_param(self.base_url, self.cursor_query_param, '')
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': reverse}, default=str)
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = payload['p'], bool(payload['r'])
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            if not all(value is None or isinstance(value, (str, int, float)) for value in position):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+        return position, reverse
+
+    def _position(self, instance):
+        values = []
+        for field in self.ordering:
+            value = instance
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    def _after(self, ordering, position, queryset):
+        """(a, b, id) > (x, y, z) in `ordering` direction, spelled out as OR-ed prefixes."""
+        names = [field.lstrip('-') for field in ordering]
+        values = [self._to_python(queryset, name, value) for name, value in zip(names, position)]
+        condition = Q()
+        for i, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            prefix = {names[j]: values[j] for j in range(i)}
+            condition |= Q(**prefix, **{f"{names[i]}__{lookup}": values[i]})
+        return condition
+
+    @staticmethod
+    def _to_python(queryset, name, value):
+        model = queryset.model
+        *relations, attname = name.split('__')
+        try:
+            for relation in relations:
+                model = model._meta.get_field(relation).related_model
+            field = model._meta.get_field(attname)
+        except FieldDoesNotExist:
+            annotation = queryset.query.annotations.get(name)
+            if annotation is None:
+                return value
+            # annotation (e.g. a Count or the search rank)
+            field = annotation.output_field
+        try:
+            return field.to_python(value)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            raise NotFound('Invalid cursor')
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(field[1:] if field.startswith('-') else f"-{field}" for field in ordering)
+
+
+class TagKeysetPagination(KeysetPagination):
+    page_size = 20
+
+
+def cached_count(queryset):
+    try:
+        sql = str(queryset.query)
+    except EmptyResultSet:
+        # .none(), e.g. a search that matches nothing
+        return 0
+    key_hash = hashlib.md5(sql.encode()).hexdigest()
+    cache_key = f"count:{queryset.model._meta.label_lower}:{key_hash}"
+    return cached_computation(cache_key, queryset.count, settings.PAGINATION_COUNT_TIMEOUT)
+
+
+def get_paginator(request, ordering, page_number_class=CustomPageNumberPagination, keyset_class=KeysetPagination):
+    """Keyset pagination when the client asks for it with `?cursor=`, page numbers otherwise."""
+    if keyset_class.cursor_query_param in request.query_params:
+        return keyset_class(ordering)
+    return page_number_class()
@@ -0,0 +1,153 @@
+"""
+"Hot" question ranking kept in Redis sorted sets.
+
+hot = (votes + 2 * answers + log10(1 + views)) / (age in hours + 2) ** GRAVITY
+
+Every question has a score in `hot:all`; questions younger than a week / 30 days are
+also in `hot:week` / `hot:month`. `touch()` rescores single questions after the
+transaction that changed them commits (votes, answers, flushed views), and `rescore()`
+(Celery beat, every HOT_RESCORE_INTERVAL seconds) recomputes all scores in batches
+so ages keep decaying and old questions drop out of the windowed sets.
+
+`sort_by=hot|hot_week|hot_month` pages over the set with ZREVRANGE and loads only the
+questions of the requested page.
+"""
+import datetime
+import logging
+import math
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from Post.models import Question
+
+logger = logging.getLogger(__name__)
+
+GRAVITY = 1.5
+RESCORE_CHUNK_SIZE = 1000
+
+# sort_by -> (sorted set, max question age)
+HOT_SETS = {
+    'hot': ('hot:all', None),
+    'hot_week': ('hot:week', datetime.timedelta(days=7)),
+    'hot_month': ('hot:month', datetime.timedelta(days=30)),
+}
+
+SCORE_FIELDS = ('id', 'vote_count', 'answer_count', 'view_count', 'created_at')
+
+
+def hot_score(vote_count, answer_count, view_count, created_at, now):
+    activity = vote_count + 2 * answer_count + math.log10(1 + view_count)
+    age_hours = max((now - created_at).total_seconds(), 0) / 3600
+    return activity / (age_hours + 2) ** GRAVITY
+
+
+def _add_scores(pipe, rows, now, keys=None):
+    """ZADD `rows` (SCORE_FIELDS tuples) to the sets they belong to; `keys` renames the target sets."""
+    keys = keys or {}
+    for pk, vote_count, answer_count, view_count, created_at in rows:
+        score = hot_score(vote_count, answer_count, view_count, created_at, now)
+        for key, max_age in HOT_SETS.values():
+            target = keys.get(key, key)
+            if max_age is None or created_at >= now - max_age:
+                pipe.zadd(target, {pk: score})
+            elif target == key:
+                pipe.zrem(key, pk)
+
+
+def _touch(question_ids):
+    now = timezone.now()
+    rows = list(Question.objects.filter(pk__in=question_ids).values_list(*SCORE_FIELDS))
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        _add_scores(pipe, rows, now)
+        missing = set(question_ids) - {row[0] for row in rows}
+        for pk in missing:
+            for key, _ in HOT_SETS.values():
+                pipe.zrem(key, pk)
+        pipe.execute()
+    except RedisError:
+        logger.warning("could not rescore questions %s", question_ids, exc_info=True)
+
+
+def touch(question_ids):
+    """Rescore `question_ids` (or drop the deleted ones) once the surrounding transaction commits."""
+    question_ids = {int(pk) for pk in question_ids}
+    if question_ids:
+        transaction.on_commit(lambda: _touch(question_ids))
+
+
+def rescore():
+    """Recompute every hot score into fresh sets and swap them in. Returns the number of questions."""
+    conn = get_redis_connection('default')
+    now = timezone.now()
+    building = {key: f"{key}:building" for key, _ in HOT_SETS.values()}
+    conn.delete(*building.values())
+    total = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            Question.objects.filter(pk__gt=last_pk).order_by('pk').values_list(*SCORE_FIELDS)[:RESCORE_CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        pipe = conn.pipeline(transaction=False)
+        _add_scores(pipe, rows, now, keys=building)
+        pipe.execute()
+        total += len(rows)
+        last_pk = rows[-1][0]
+    for key, new_key in building.items():
+        # RENAME replaces the live set atomically; an empty set was never created
+        if conn.exists(new_key):
+            conn.rename(new_key, key)
+        else:
+            conn.delete(key)
+    return total
+
+
+class HotQuestions:
+    """
+    Lazy, sliceable view of one hot set for Django's Paginator: len() is a ZCARD and
+    a page slice is one ZREVRANGE plus one query for the questions on that page.
+    """
+
+    def __init__(self, sort_by, queryset):
+        self.key = HOT_SETS[sort_by][0]
+        self.queryset = queryset
+        self.conn = get_redis_connection('default')
+
+    def count(self):
+        return self.conn.zcard(self.key)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        if stop <= start:
+            return []
+        ids = [int(pk) for pk in self.conn.zrevrange(self.key, start, stop - 1)]
+        questions = self.queryset.in_bulk(ids)
+        # deleted in between: skip rather than fail the page
+        return [questions[pk] for pk in ids if pk in questions]
+
+
+def hot_questions(sort_by, queryset):
+    """HotQuestions for `sort_by`, or None (and a rebuild is queued) until the sets are built."""
+    try:
+        # hot:all holds every question, so it only misses before the first rescore
+        if get_redis_connection('default').exists(HOT_SETS['hot'][0]):
+            return HotQuestions(sort_by, queryset)
+    except RedisError:
+        logger.warning("hot ranking unavailable", exc_info=True)
+        return None
+    if cache.add('hot:rescore_queued', 1, timeout=60):
+        from Post.tasks import rescore_hot_questions
+        rescore_hot_questions.delay()
+    return None
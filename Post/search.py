@@ -0,0 +1,296 @@
+"""
+Question search backends behind `?search=`.
+
+Both backends return the matching questions annotated with a relevance `rank` where
+title terms weigh more than body terms, and build highlighted snippets for a page of
+results.
+
+- PostgresSearchBackend reads the `search_vector` column of Post_question, a stored
+  generated tsvector (title weight A, content weight B) with a GIN index, created by
+  migration 0013. It is maintained by PostgreSQL on every insert/update.
+- InvertedIndexSearchBackend is a pure-Python inverted index with the same tokenising,
+  stemming and weighting rules, used on SQLite (tests, local runs). It returns at most
+  SEARCH_MAX_RESULTS matches.
+"""
+import datetime
+import heapq
+import math
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVectorField
+from django.db import connection
+from django.db.models import Case, Count, FloatField, Max, Value, When
+from django.db.models.expressions import RawSQL
+
+from Post.models import Question
+
+SEARCH_CONFIG = 'english'
+START_SEL = '<b>'
+STOP_SEL = '</b>'
+HEADLINE_MAX_WORDS = 35
+
+# weights of ts_rank: {D, C, B, A}; the title is A, the content is B
+TITLE_WEIGHT = 1.0
+CONTENT_WEIGHT = 0.4
+
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being
+below between both but by can did do does doing down during each few for from further had has
+have having he her here hers herself him himself his how i if in into is it its itself just me
+more most my myself no nor not now of off on once only or other our ours ourselves out over own
+s same she should so some such t than that the their theirs them themselves then there these
+they this those through to too under until up very was we were what when where which while who
+whom why will with you your yours yourself yourselves
+""".split())
+
+WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+class PostgresSearchBackend:
+
+    def _vector(self):
+        column = f"{connection.ops.quote_name(Question._meta.db_table)}.{connection.ops.quote_name('search_vector')}"
+        return RawSQL(column, [], output_field=SearchVectorField())
+
+    def _query(self, text):
+        return SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+
+    def search(self, queryset, text):
+        query = self._query(text)
+        return (
+            queryset
+            .alias(search_vector=self._vector())
+            .filter(search_vector=query)
+            .annotate(rank=SearchRank(self._vector(), query))
+            .order_by('-rank', '-id')
+        )
+
+    def headlines(self, questions, text):
+        ids = [question.id for question in questions]
+        if not ids:
+            return {}
+        # ts_headline is expensive, so it only runs for the rows of the current page
+        rows = Question.objects.filter(id__in=ids).annotate(
+            headline=SearchHeadline(
+                'content', self._query(text), config=SEARCH_CONFIG,
+                start_sel=START_SEL, stop_sel=STOP_SEL, max_words=HEADLINE_MAX_WORDS,
+            )
+        ).values_list('id', 'headline')
+        return dict(rows)
+
+
+def tokenize(text):
+    return [word.lower() for word in WORD_RE.findall(text or '')]
+
+
+def stem(word):
+    """Porter step 1 (plurals, -ed/-ing, -y), close enough to the english snowball stemmer."""
+    if len(word) <= 2 or not word.isalpha():
+        return word
+    if word.endswith('sses'):
+        word = word[:-2]
+    elif word.endswith('ies'):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        word = word[:-1]
+
+    for suffix in ('eed', 'ed', 'ing'):
+        if word.endswith(suffix):
+            base = word[:-len(suffix)]
+            if suffix == 'eed':
+                if _measure(base) > 0:
+                    word = word[:-1]
+            elif _has_vowel(base):
+                word = base
+                if word.endswith(('at', 'bl', 'iz')):
+                    word += 'e'
+                elif len(word) > 1 and word[-1] == word[-2] and word[-1] not in 'lsz':
+                    word = word[:-1]
+                elif _measure(word) == 1 and _cvc(word):
+                    word += 'e'
+            break
+
+    if word.endswith('y') and _has_vowel(word[:-1]):
+        word = word[:-1] + 'i'
+    return word
+
+
+def _is_consonant(word, i):
+    if word[i] in 'aeiou':
+        return False
+    if word[i] == 'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _has_vowel(word):
+    return any(not _is_consonant(word, i) for i in range(len(word)))
+
+
+def _measure(word):
+    pattern = ''.join('c' if _is_consonant(word, i) else 'v' for i in range(len(word)))
+    return len(re.findall('vc', re.sub(r'(.)\1+', r'\1', pattern)))
+
+
+def _cvc(word):
+    n = len(word)
+    return (
+        n >= 3 and _is_consonant(word, n - 3) and not _is_consonant(word, n - 2)
+        and _is_consonant(word, n - 1) and word[-1] not in 'wxy'
+    )
+
+
+def lexemes(text):
+    return [stem(word) for word in tokenize(text) if word not in STOP_WORDS]
+
+
+def parse_query(text):
+    """
+    websearch_to_tsquery subset: words are AND-ed, `or` separates alternatives and a
+    leading `-` excludes a word. Returns ([[required lexemes], ...], {excluded lexemes}).
+    """
+    groups, excluded, current = [], set(), []
+    for raw in (text or '').split():
+        if raw.lower() == 'or':
+            if current:
+                groups.append(current)
+            current = []
+            continue
+        negate = raw.startswith('-')
+        words = lexemes(raw)
+        if negate:
+            excluded.update(words)
+        else:
+            current.extend(words)
+    if current:
+        groups.append(current)
+    return groups, excluded
+
+
+class InvertedIndexSearchBackend:
+    """
+    In-process inverted index {lexeme: {question_id: (title_tf, content_tf)}}.
+
+    The index follows the table incrementally: each search reads max(updated_at) and
+    the row count, and when either moved re-indexes only the questions saved since the
+    last sync (with SYNC_OVERLAP of slack for transactions that committed late) and
+    unindexes deleted ones.
+    """
+
+    SYNC_OVERLAP = datetime.timedelta(minutes=1)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._postings = {}
+        # question_id -> its lexemes, to take it out of the postings again
+        self._lexemes = {}
+
+    def _unindex(self, question_id):
+        for lexeme in self._lexemes.pop(question_id, ()):
+            postings = self._postings[lexeme]
+            del postings[question_id]
+            if not postings:
+                del self._postings[lexeme]
+
+    def _add(self, question_id, title, content):
+        self._unindex(question_id)
+        seen = set()
+        for weight_index, text in enumerate((title, content)):
+            for lexeme in lexemes(text):
+                counts = self._postings.setdefault(lexeme, {}).setdefault(question_id, [0, 0])
+                counts[weight_index] += 1
+                seen.add(lexeme)
+        self._lexemes[question_id] = seen
+
+    def _index(self):
+        state = Question.objects.aggregate(synced_at=Max('updated_at'), count=Count('id'))
+        with self._lock:
+            if state != self._state:
+                changed = Question.objects.all()
+                if self._state is not None and self._state['synced_at'] is not None:
+                    changed = changed.filter(updated_at__gte=self._state['synced_at'] - self.SYNC_OVERLAP)
+                for question_id, title, content in changed.values_list('id', 'title', 'content').iterator():
+                    self._add(question_id, title, content)
+                if len(self._lexemes) > state['count']:
+                    existing = set(Question.objects.values_list('id', flat=True))
+                    for question_id in set(self._lexemes) - existing:
+                        self._unindex(question_id)
+                self._state = state
+            return self._postings
+
+    def rank(self, text):
+        """{question_id: rank} for every question matching `text`."""
+        postings = self._index()
+        groups, excluded = parse_query(text)
+        ranks = {}
+        for group in groups:
+            matched = None
+            for lexeme in group:
+                ids = set(postings.get(lexeme, {}))
+                matched = ids if matched is None else matched & ids
+            for question_id in matched or ():
+                score = 0.0
+                for lexeme in group:
+                    title_tf, content_tf = postings[lexeme][question_id]
+                    score += TITLE_WEIGHT * title_tf + CONTENT_WEIGHT * content_tf
+                # ts_rank grows sub-linearly with repeated occurrences
+                score = math.log1p(score) / len(group)
+                ranks[question_id] = max(ranks.get(question_id, 0.0), score)
+        for lexeme in excluded:
+            for question_id in postings.get(lexeme, {}):
+                ranks.pop(question_id, None)
+        return ranks
+
+    def search(self, queryset, text):
+        # the query carries one WHEN per match: only the best ones go into it
+        best = heapq.nlargest(
+            settings.SEARCH_MAX_RESULTS, self.rank(text).items(), key=lambda item: (item[1], item[0]),
+        )
+        if not best:
+            return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+        rank = Case(
+            *[When(id=question_id, then=Value(score)) for question_id, score in best],
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=[question_id for question_id, _ in best]).annotate(rank=rank).order_by('-rank', '-id')
+
+    def headlines(self, questions, text):
+        groups, _ = parse_query(text)
+        terms = {lexeme for group in groups for lexeme in group}
+        return {question.id: self.headline(question.content, terms) for question in questions}
+
+    def headline(self, content, terms):
+        words = list(WORD_RE.finditer(content or ''))
+        hits = [i for i, match in enumerate(words) if stem(match.group().lower()) in terms]
+        start = max(hits[0] - HEADLINE_MAX_WORDS // 3, 0) if hits else 0
+        window = words[start:start + HEADLINE_MAX_WORDS]
+        if not window:
+            return ''
+        text = content[window[0].start():window[-1].end()]
+        offset = window[0].start()
+        parts, cursor = [], 0
+        for i in hits:
+            match = words[i]
+            if match.start() < window[0].start() or match.end() > window[-1].end():
+                continue
+            parts.append(text[cursor:match.start() - offset])
+            parts.append(f"{START_SEL}{match.group()}{STOP_SEL}")
+            cursor = match.end() - offset
+        parts.append(text[cursor:])
+        return ''.join(parts)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = settings.SEARCH_BACKEND or ('postgres' if connection.vendor == 'postgresql' else 'python')
+            _backend = PostgresSearchBackend() if name == 'postgres' else InvertedIndexSearchBackend()
+        return _backend
@@ -0,0 +1,134 @@
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from Post import ranking, stats
+from Post.models import Question, Answer, Tag, TagStats
+from StackOverflowCopy import cache as cache_ns
+from User import profile_cache
+from User.models import CustomUser
+
+
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, **kwargs):
+    # tag counts are derived from questions
+    cache_ns.bump_on_commit(cache_ns.QUESTIONS, cache_ns.TAGS)
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def question_tags_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        cache_ns.bump_on_commit(cache_ns.QUESTIONS, cache_ns.TAGS)
+
+
+@receiver([post_save, post_delete], sender=Answer)
+def answer_changed(sender, **kwargs):
+    # questions embed answer_count
+    cache_ns.bump_on_commit(cache_ns.ANSWERS, cache_ns.QUESTIONS)
+
+
+# Votes bump no namespace of their own: the vote_count they move is bumped where it is
+# written (Post.votes.apply_vote_delta, or Post.vote_buffer.flush in write-behind mode)
+# and the author's reputation with the Reputation row (User/signals.py).
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    cache_ns.bump_on_commit(cache_ns.TAGS, cache_ns.QUESTIONS)
+
+
+# Denormalized counters: Question.answer_count, CustomUser.question_count/answer_count.
+# Kept with database-side increments; `manage.py recount` repairs any drift. The
+# increments bypass CustomUser's save signals, so they refresh the profile cache themselves.
+
+@receiver(post_save, sender=Question)
+def question_created_count(sender, instance, created, **kwargs):
+    if created:
+        CustomUser.objects.filter(pk=instance.author_id).update(question_count=F('question_count') + 1)
+        profile_cache.refresh([instance.author_id])
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted_count(sender, instance, **kwargs):
+    CustomUser.objects.filter(pk=instance.author_id).update(question_count=F('question_count') - 1)
+    profile_cache.refresh([instance.author_id])
+
+
+@receiver(post_save, sender=Answer)
+def answer_created_count(sender, instance, created, **kwargs):
+    if created:
+        Question.objects.filter(pk=instance.question_id).update(answer_count=F('answer_count') + 1)
+        CustomUser.objects.filter(pk=instance.author_id).update(answer_count=F('answer_count') + 1)
+        profile_cache.refresh([instance.author_id])
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted_count(sender, instance, **kwargs):
+    Question.objects.filter(pk=instance.question_id).update(answer_count=F('answer_count') - 1)
+    CustomUser.objects.filter(pk=instance.author_id).update(answer_count=F('answer_count') - 1)
+    profile_cache.refresh([instance.author_id])
+
+
+# TagStats / UserTagStats: per-tag counters, moved with every change of Question.tags
+# and of the answers and votes under a tagged question.
+
+@receiver(post_save, sender=Tag)
+def tag_created_stats(sender, instance, created, **kwargs):
+    if created:
+        TagStats.objects.get_or_create(tag=instance)
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def question_tags_stats(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # the cleared ids are gone by post_clear
+        if reverse:
+            instance._cleared_question_ids = list(instance.questions.values_list('id', flat=True))
+        else:
+            instance._cleared_tag_ids = list(instance.tags.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    update = stats.tags_attached if action == 'post_add' else stats.tags_detached
+    if not reverse:
+        tag_ids = instance.__dict__.pop('_cleared_tag_ids', []) if action == 'post_clear' else pk_set
+        update(instance, list(tag_ids))
+        return
+    # tag.questions.add/remove/clear: one update per affected question
+    if action == 'post_clear':
+        question_ids = instance.__dict__.pop('_cleared_question_ids', [])
+    else:
+        question_ids = pk_set
+    for question in Question.objects.filter(pk__in=question_ids).only('id', 'created_at', 'author_id', 'vote_count'):
+        update(question, [instance.pk])
+
+
+@receiver(pre_delete, sender=Question)
+def question_deleted_stats(sender, instance, **kwargs):
+    # the through rows are cascaded without m2m_changed
+    stats.tags_detached(instance, list(instance.tags.values_list('id', flat=True)))
+
+
+@receiver(post_save, sender=Answer)
+def answer_created_stats(sender, instance, created, **kwargs):
+    if created:
+        stats.answer_created(instance)
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted_stats(sender, instance, **kwargs):
+    stats.answer_deleted(instance)
+
+
+# Hot ranking: rescore a question when its answers change or it is created / deleted.
+
+@receiver([post_save, post_delete], sender=Question)
+def question_ranking(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        ranking.touch([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Answer)
+def answer_ranking(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        ranking.touch([instance.question_id])
@@ -0,0 +1,190 @@
+"""
+Incremental maintenance of TagStats and User.UserTagStats.
+
+`tags_attached` / `tags_detached` are called from the Question.tags m2m and Question
+delete signals (Post/signals.py) and move the counters with F() increments. A question's
+tags also count for the authors of its answers, so those move the UserTagStats rows of
+every answerer; answer create/delete and vote tallies (`post_voted`) do the same.
+questions_this_week/month only grow or shrink with attach/detach events, so
+`refresh_windows()` (Celery beat) recomputes them as questions age out of the window.
+`rebuild_tag_stats()` / `rebuild_user_tag_stats()` recompute everything from scratch
+(`manage.py recount`), and `rebuild_top_tags()` refills CustomUser.top_tags from
+UserTagStats (User.tasks.rebuild_top_tags).
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, Max, Sum, Value, When
+from django.utils import timezone
+
+from Post.models import Question, Answer, Tag, TagStats
+from User.models import CustomUser, UserTagStats
+
+WEEK = datetime.timedelta(days=7)
+MONTH = datetime.timedelta(days=30)
+
+# number of tags shown as a user's top_tags
+TOP_TAGS = 5
+
+
+def _apply(tag_ids, created_at, delta):
+    if not tag_ids:
+        return
+    now = timezone.now()
+    TagStats.objects.bulk_create([TagStats(tag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True)
+    updates = {'question_count': F('question_count') + delta}
+    if created_at >= now - WEEK:
+        updates['questions_this_week'] = F('questions_this_week') + delta
+    if created_at >= now - MONTH:
+        updates['questions_this_month'] = F('questions_this_month') + delta
+    if delta > 0:
+        updates['last_activity_at'] = now
+    TagStats.objects.filter(tag_id__in=tag_ids).update(**updates)
+
+
+def tags_attached(question, tag_ids):
+    _apply(tag_ids, question.created_at, 1)
+    _apply_contributions(question, tag_ids, 1)
+
+
+def tags_detached(question, tag_ids):
+    _apply(tag_ids, question.created_at, -1)
+    _apply_contributions(question, tag_ids, -1)
+
+
+def _apply_user(user_id, tag_ids, posts, score):
+    if not tag_ids or not (posts or score):
+        return
+    UserTagStats.objects.bulk_create(
+        [UserTagStats(user_id=user_id, tag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True
+    )
+    UserTagStats.objects.filter(user_id=user_id, tag_id__in=tag_ids).update(
+        posts=F('posts') + posts, score=F('score') + score
+    )
+
+
+def _apply_contributions(question, tag_ids, sign):
+    """Move the question author's and every answerer's rows for `tag_ids`."""
+    if not tag_ids:
+        return
+    contributions = {question.author_id: [1, question.vote_count]}
+    answers = (
+        Answer.objects.filter(question_id=question.pk)
+        .values_list('author_id').annotate(posts=Count('pk'), score=Sum('vote_count')).order_by()
+    )
+    for author_id, posts, score in answers:
+        entry = contributions.setdefault(author_id, [0, 0])
+        entry[0] += posts
+        entry[1] += score
+    for user_id, (posts, score) in contributions.items():
+        _apply_user(user_id, tag_ids, sign * posts, sign * score)
+
+
+def _question_tag_ids(question_id):
+    return list(Question.tags.through.objects.filter(question_id=question_id).values_list('tag_id', flat=True))
+
+
+def answer_created(answer):
+    _apply_user(answer.author_id, _question_tag_ids(answer.question_id), 1, 0)
+
+
+def answer_deleted(answer):
+    # when the whole question is deleted its tags are already gone and tags_detached
+    # has taken this answer into account
+    _apply_user(answer.author_id, _question_tag_ids(answer.question_id), -1, -answer.vote_count)
+
+
+def post_voted(kind, pk, delta):
+    """A vote tally change of `delta` on a question or answer, applied to its author's tag scores."""
+    model = Question if kind == 'question' else Answer
+    question_field = 'id' if kind == 'question' else 'question_id'
+    row = model.objects.filter(pk=pk).values_list(question_field, 'author_id').first()
+    if row is not None:
+        question_id, author_id = row
+        _apply_user(author_id, _question_tag_ids(question_id), 0, delta)
+
+
+def _tag_counts(since=None):
+    through = Question.tags.through.objects.all()
+    if since is not None:
+        through = through.filter(question__created_at__gte=since)
+    return dict(through.values_list('tag_id').annotate(total=Count('id')).order_by())
+
+
+def _set_column(column, values, default=0, output_field=None, chunk_size=1000):
+    """Set `column` from {tag_id: value} on every TagStats row, `default` for tags not in `values`."""
+    output_field = output_field or IntegerField()
+    TagStats.objects.exclude(tag_id__in=list(values)).update(**{column: default})
+    items = list(values.items())
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        TagStats.objects.filter(tag_id__in=[tag_id for tag_id, _ in chunk]).update(**{column: Case(
+            *[When(tag_id=tag_id, then=Value(value)) for tag_id, value in chunk],
+            output_field=output_field,
+        )})
+
+
+def refresh_windows():
+    now = timezone.now()
+    _set_column('questions_this_week', _tag_counts(since=now - WEEK))
+    _set_column('questions_this_month', _tag_counts(since=now - MONTH))
+
+
+def rebuild_tag_stats():
+    TagStats.objects.bulk_create(
+        [TagStats(tag_id=tag_id) for tag_id in Tag.objects.values_list('id', flat=True)], ignore_conflicts=True
+    )
+    _set_column('question_count', _tag_counts())
+    refresh_windows()
+    last_activity = dict(
+        Question.tags.through.objects.values_list('tag_id').annotate(last=Max('question__created_at')).order_by()
+    )
+    _set_column('last_activity_at', last_activity, default=None, output_field=DateTimeField())
+
+
+def rebuild_user_tag_stats(user_ids):
+    """Recompute the UserTagStats rows of `user_ids` from their questions, answers and votes."""
+    user_ids = list(user_ids)
+    totals = {}
+    questions = (
+        Question.tags.through.objects.filter(question__author_id__in=user_ids)
+        .values_list('question__author_id', 'tag_id')
+        .annotate(posts=Count('pk'), score=Sum('question__vote_count'))
+    )
+    answers = (
+        Answer.objects.filter(author_id__in=user_ids, question__tags__isnull=False)
+        .values_list('author_id', 'question__tags')
+        .annotate(posts=Count('pk'), score=Sum('vote_count'))
+    )
+    for rows in (questions, answers):
+        for user_id, tag_id, posts, score in rows.order_by():
+            entry = totals.setdefault((user_id, tag_id), [0, 0])
+            entry[0] += posts
+            entry[1] += score or 0
+    with transaction.atomic():
+        UserTagStats.objects.filter(user_id__in=user_ids).delete()
+        UserTagStats.objects.bulk_create([
+            UserTagStats(user_id=user_id, tag_id=tag_id, posts=posts, score=score)
+            for (user_id, tag_id), (posts, score) in totals.items()
+        ], batch_size=1000)
+
+
+def rebuild_top_tags(user_ids):
+    """Set CustomUser.top_tags of `user_ids` to their TOP_TAGS best scoring tags."""
+    user_ids = list(user_ids)
+    rows = (
+        UserTagStats.objects.filter(user_id__in=user_ids, posts__gt=0)
+        .order_by('user_id', '-score', '-posts', '-tag_id')
+        .values_list('user_id', 'tag_id')
+    )
+    top = {}
+    for user_id, tag_id in rows:
+        tags = top.setdefault(user_id, [])
+        if len(tags) < TOP_TAGS:
+            tags.append(tag_id)
+    through = CustomUser.top_tags.through
+    with transaction.atomic():
+        through.objects.filter(customuser_id__in=user_ids).delete()
+        through.objects.bulk_create([
+            through(customuser_id=user_id, tag_id=tag_id) for user_id, tags in top.items() for tag_id in tags
+        ])
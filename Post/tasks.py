@@ -1,41 +1,57 @@
+import logging
+
 from celery import shared_task
-from django.core.cache import cache
-from Post.models import Question
-import json
-import hashlib
-from Post.pagination import CustomPageNumberPagination
-from Post.serializers import QuestionSerializer
+from Post import ranking, stats, view_counter, vote_buffer
+from StackOverflowCopy import cache as cache_ns
+from StackOverflowCopy import debounce, warmer
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
 def update_question_list_cache():
-    print("inside update_question_list_cache 1")
-
-    query_params = {
-        "page": "1",
-        "page_size": "10",
-        "sort_by": "newest"
-    }
-    key_raw = json.dumps(query_params, sort_keys=True)
-    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
-    cache_key = f"question_list:{key_hash}"
-    print(key_hash)
-
-    class FakeRequest:
-        def __init__(self, *args, **kwargs):
-            self.query_params = query_params
-
-        def build_absolute_uri(self):
-            return "/api/questions/"
-
-    fake_request = FakeRequest(query_params)
-
-    queryset = Question.objects.all()
-    queryset = queryset.order_by('-created_at')
-
-    paginator = CustomPageNumberPagination()
-    paginated_queryset = paginator.paginate_queryset(queryset, fake_request)
-    serializer = QuestionSerializer(paginated_queryset, many=True)
-    paginated_response = paginator.get_paginated_response(serializer.data)
-    cache.set(cache_key, paginated_response.data, timeout=60)
-    print("inside update_question_list_cache 2, cache have been set")
\ No newline at end of file
+    """Re-render the most requested question list pages after the list was invalidated."""
+    debounce.started(update_question_list_cache)
+    return warmer.warm(["question_list"])
+
+
+@shared_task
+def flush_vote_buffer():
+    """Fold write-behind vote deltas into vote_count / reputation (settings.VOTE_WRITE_BEHIND)."""
+    return vote_buffer.flush()
+
+
+@shared_task
+def flush_question_views():
+    """Fold views buffered in Redis into Question.view_count."""
+    return view_counter.flush()
+
+
+@shared_task
+def refresh_tag_windows():
+    """Recompute TagStats.questions_this_week/month as questions age out of the windows."""
+    stats.refresh_windows()
+    cache_ns.bump(cache_ns.TAGS)
+
+
+@shared_task
+def rescore_hot_questions():
+    """Recompute the hot ranking sets so question ages keep decaying."""
+    return ranking.rescore()
+
+
+@shared_task
+def warm_caches():
+    """Age the request counts and re-render the most requested pages of every cached view."""
+    warmer.decay()
+    return warmer.warm()
+
+
+@shared_task
+def warm_cache_urls(urls):
+    for url in urls:
+        try:
+            warmer.warm_url(url)
+        except Exception:
+            # one broken page must not keep the rest of the chunk cold
+            logger.warning("could not warm %s", url, exc_info=True)
@@ -1,3 +1,934 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from Post import ranking, stats, vote_buffer
+from Post.tasks import update_question_list_cache
+from Post.models import Question, Answer, Tag, TagStats, Vote
+from Post.search import InvertedIndexSearchBackend
+from Post.utils import get_or_create_tags
+from Post.votes import DOWNVOTE, UPVOTE, AlreadyVoted, cast_vote
+from StackOverflowCopy import cache as cache_ns
+from StackOverflowCopy import debounce, warmer
+from User.models import CustomUser, Reputation, UserTagStats
+
+# The tests use the Redis of settings.CACHES, flushed before every test.
+
+
+def make_user(name):
+    user = CustomUser.objects.create_user(email=f'{name}@example.com', username=name, password='pw')
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+    return user, client
+
+
+def make_question(author, title='How do I test this?', tags=()):
+    question = Question.objects.create(author=author, title=title, content='Some content for the question.')
+    if tags:
+        question.tags.set(get_or_create_tags(tags))
+    return question
+
+
+class RedisTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+
+class NamespaceBumpTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, _ = make_user('author')
+        self.voter, _ = make_user('voter')
+        self.question = make_question(self.author)
+        self.answer = Answer.objects.create(question=self.question, author=self.author, content='An answer.')
+
+    def versions(self):
+        return dict(zip(
+            (cache_ns.QUESTIONS, cache_ns.ANSWERS, cache_ns.USERS),
+            cache_ns.get_versions([cache_ns.QUESTIONS, cache_ns.ANSWERS, cache_ns.USERS]),
+        ))
+
+    def bumped(self, action):
+        before = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            action()
+        after = self.versions()
+        return {namespace for namespace in before if after[namespace] != before[namespace]}
+
+    @override_settings(VOTE_WRITE_BEHIND=False)
+    def test_question_vote_bumps_author_namespaces(self):
+        # the author's reputation is embedded in question and answer lists
+        bumped = self.bumped(lambda: cast_vote(self.voter, self.question, UPVOTE))
+        self.assertEqual(bumped, {cache_ns.QUESTIONS, cache_ns.ANSWERS, cache_ns.USERS})
+
+    @override_settings(VOTE_WRITE_BEHIND=False)
+    def test_answer_vote_bumps_author_namespaces(self):
+        bumped = self.bumped(lambda: cast_vote(self.voter, self.answer, UPVOTE))
+        self.assertEqual(bumped, {cache_ns.QUESTIONS, cache_ns.ANSWERS, cache_ns.USERS})
+
+    @override_settings(VOTE_WRITE_BEHIND=False)
+    def test_own_vote_writes_no_reputation(self):
+        bumped = self.bumped(lambda: cast_vote(self.author, self.question, UPVOTE))
+        self.assertEqual(bumped, {cache_ns.QUESTIONS})
+
+    @override_settings(VOTE_WRITE_BEHIND=True)
+    def test_write_behind_vote_bumps_on_flush(self):
+        self.assertEqual(self.bumped(lambda: cast_vote(self.voter, self.question, UPVOTE)), set())
+        self.assertEqual(self.bumped(vote_buffer.flush), {cache_ns.QUESTIONS, cache_ns.ANSWERS, cache_ns.USERS})
+
+    @override_settings(VOTE_WRITE_BEHIND=False)
+    def test_answer_vote_refreshes_cached_question_list(self):
+        client = APIClient()
+
+        def author_reputation():
+            return client.get('/api/questions/').json()['results'][0]['author']['reputation']
+
+        before = author_reputation()
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.voter, self.answer, UPVOTE)
+        self.assertEqual(author_reputation(), before + 20)
+
+    def test_profile_edit_bumps_users_only(self):
+        def edit():
+            self.author.about = 'About me'
+            self.author.save()
+        self.assertEqual(self.bumped(edit), {cache_ns.USERS})
+
+    def test_author_rename_bumps_embedding_namespaces(self):
+        def rename():
+            self.author.displayName = 'Renamed'
+            self.author.save()
+        self.assertEqual(self.bumped(rename), {cache_ns.USERS, cache_ns.QUESTIONS, cache_ns.ANSWERS})
+
+    def test_login_bumps_nothing(self):
+        self.assertEqual(self.bumped(lambda: update_last_login(None, self.author)), set())
+
+
+class TokenWriteTests(RedisTestCase):
+    """Token-authenticated writes through the async fronts must not need a CSRF token."""
+
+    def setUp(self):
+        super().setUp()
+        self.author, _ = make_user('author')
+        self.question = make_question(self.author)
+        self.client = APIClient(enforce_csrf_checks=True)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.author.auth_token.key)
+
+    def test_answer_create(self):
+        response = self.client.post(
+            '/api/answers/', {'question_id': self.question.id, 'content': 'An answer.'}, format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_question_edit(self):
+        response = self.client.patch(f'/api/questions/{self.question.id}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+
+class CacheResponseTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, self.client = make_user('author')
+        self.other, _ = make_user('other')
+        for i in range(3):
+            make_question(self.author, title=f'Question number {i}', tags=['python', 'django'])
+
+    def assert_cached(self, url, params=None):
+        with self.assertNumQueries(0):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_computed(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertTrue(queries.captured_queries, f'{url} {params} was served from the cache')
+        return response
+
+    def test_defaults_and_undeclared_params_share_entry(self):
+        url = f'/api/users/{self.author.pk}/questions/'
+        first = self.assert_computed(url)
+        second = self.assert_cached(url, {'page': '1', 'sort_by': 'views', '_': '1700000000'})
+        self.assertEqual(second.json(), first.json())
+
+    def test_declared_params_have_their_own_entries(self):
+        url = f'/api/users/{self.author.pk}/questions/'
+        self.assert_computed(url)
+        self.assert_computed(url, {'page_size': '2'})
+        self.assert_computed(url, {'sort_by': 'newest'})
+        # an empty cursor asks for keyset pages
+        self.assert_computed(url, {'cursor': ''})
+        self.assert_cached(url, {'page_size': '2'})
+
+    def test_list_params_in_any_order(self):
+        self.assert_computed('/api/questions/?tags=python&tags=django')
+        self.assert_cached('/api/questions/?tags=django&tags=python')
+
+    def test_url_kwargs_in_key(self):
+        self.assert_computed(f'/api/users/{self.author.pk}/tags/')
+        self.assertEqual(self.assert_computed(f'/api/users/{self.other.pk}/tags/').json(), [])
+        self.assert_computed(f'/api/users/{self.author.pk}/answers/')
+
+    def test_empty_results_cached(self):
+        for url in (f'/api/users/{self.other.pk}/tags/', f'/api/users/{self.other.pk}/questions/'):
+            empty = self.assert_computed(url).json()
+            self.assertEqual(self.assert_cached(url).json(), empty)
+
+    def test_errors_not_cached(self):
+        for _ in range(2):
+            self.assertEqual(self.assert_computed('/api/users/999999/tags/').status_code, 404)
+
+
+@override_settings(WARM_SAMPLE_RATE=1)
+class WarmerTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, _ = make_user('author')
+        self.client = APIClient()
+        for i in range(3):
+            make_question(self.author, title=f'Question number {i}', tags=['python'])
+        self.tags_url = 'http://testserver/api/tags/?page=1&page_size=20&sort_by=popular'
+
+    def scores(self, prefix):
+        conn = get_redis_connection('default')
+        return {url.decode(): score for url, score in conn.zrevrange(f'warm:hits:{prefix}', 0, -1, withscores=True)}
+
+    def test_record_normalizes_like_the_cache_key(self):
+        # the second and third requests are hits on the async front
+        self.client.get('/api/tags/')
+        self.client.get('/api/tags/?page=1&_=1700000000')
+        self.client.get('/api/tags/?sort_by=popular&page_size=20')
+        self.client.get('/api/tags/?sort_by=name')
+        self.assertEqual(self.scores('tags_list'), {
+            self.tags_url: 3, 'http://testserver/api/tags/?page=1&page_size=20&sort_by=name': 1,
+        })
+        self.assertEqual(warmer.top_urls(['tags_list'], limit=1), [self.tags_url])
+
+    @override_settings(WARM_SAMPLE_RATE=0)
+    def test_unsampled(self):
+        self.client.get('/api/tags/')
+        self.assertEqual(self.scores('tags_list'), {})
+
+    def test_warm_url_fills_invalidated_entry(self):
+        self.client.get('/api/tags/')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_question(self.author, title='Another question', tags=['django'])
+        self.assertEqual(warmer.warm_url(self.tags_url), 200)
+        # warming is not a hit
+        self.assertEqual(self.scores('tags_list'), {self.tags_url: 1})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/')
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_warm_in_chunks(self):
+        for page in range(1, 13):
+            self.client.get('/api/questions/', {'page': page, 'page_size': 1})
+        with mock.patch('Post.tasks.warm_cache_urls.delay') as delay:
+            self.assertEqual(warmer.warm(['question_list'], limit=20), 12)
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [warmer.CHUNK_SIZE, 2])
+
+    def test_decay(self):
+        for _ in range(4):
+            self.client.get('/api/tags/')
+        self.client.get('/api/tags/?sort_by=name')
+        with mock.patch.object(warmer, 'TRACKED_PER_PREFIX', 1):
+            warmer.decay()
+        self.assertEqual(self.scores('tags_list'), {self.tags_url: 4 * warmer.DECAY})
+
+
+class DebounceTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, self.client = make_user('author')
+        apply_async = mock.patch.object(update_question_list_cache, 'apply_async')
+        self.apply_async = apply_async.start()
+        self.addCleanup(apply_async.stop)
+
+    def schedule(self, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            debounce.schedule(update_question_list_cache, *args)
+
+    def test_burst_coalesced(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                response = self.client.post('/api/questions/', {
+                    'title': f'Question number {i} here', 'content': 'Some content here.', 'tag_names': ['python'],
+                }, format='json')
+                self.assertEqual(response.status_code, 201)
+        self.apply_async.assert_called_once_with((), countdown=settings.CACHE_REFRESH_DEBOUNCE)
+
+    def test_started_lets_the_next_write_queue(self):
+        self.schedule()
+        self.schedule()
+        self.assertEqual(self.apply_async.call_count, 1)
+        # the task clears the flag before it reads anything
+        with mock.patch.object(warmer, 'warm') as warm:
+            update_question_list_cache()
+        warm.assert_called_once_with(['question_list'])
+        self.schedule()
+        self.assertEqual(self.apply_async.call_count, 2)
+
+    def test_arguments_debounced_separately(self):
+        for args in ((1,), (2,), (1,)):
+            self.schedule(*args)
+        self.assertEqual([call.args[0] for call in self.apply_async.call_args_list], [(1,), (2,)])
+
+    def test_rolled_back_write_schedules_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                debounce.schedule(update_question_list_cache)
+                raise RuntimeError
+        self.apply_async.assert_not_called()
+
+
+class RawResponseETagTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, self.client = make_user('author')
+        for i in range(10):
+            make_question(self.author, title=f'Question number {i}', tags=['python'])
+
+    def test_encodings_have_their_own_etags(self):
+        # the first request fills the cache in the sync view, the rest are hits on the async front
+        for _ in range(2):
+            gzipped = self.client.get('/api/questions/', HTTP_ACCEPT_ENCODING='gzip, br')
+            identity = self.client.get('/api/questions/')
+            self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+            self.assertFalse(identity.has_header('Content-Encoding'))
+            self.assertEqual(gzipped['ETag'], identity['ETag'][:-1] + '-gzip"')
+
+        revalidated = self.client.get('/api/questions/', HTTP_IF_NONE_MATCH=gzipped['ETag'])
+        self.assertEqual(revalidated.status_code, 200)
+        revalidated = self.client.get(
+            '/api/questions/', HTTP_IF_NONE_MATCH=gzipped['ETag'], HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+
+class ConditionalGetTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, self.client = make_user('author')
+        self.question = make_question(self.author, tags=['python'])
+        self.tag = Tag.objects.get(name='python')
+        self.answer = Answer.objects.create(question=self.question, author=self.author, content='An answer.')
+
+    def assert_revalidates(self, url, change, client=None, queries=None):
+        """A matching If-None-Match gets a 304 until `change` runs, then a 200 with a new ETag."""
+        client = client or self.client
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        if queries is None:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        else:
+            with self.assertNumQueries(queries):
+                response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_tag_detail(self):
+        url = f'/api/tags/{self.tag.id}/'
+        # one query for the ETag, none for the view
+        self.assert_revalidates(
+            url, lambda: make_question(self.author, title='Another question', tags=['python']), queries=1,
+        )
+
+        def describe():
+            self.tag.description = 'The language'
+            self.tag.save()
+        self.assertEqual(self.assert_revalidates(url, describe).json()['description'], 'The language')
+
+    def test_answer_list(self):
+        url = f'/api/answers/?question_id={self.question.id}'
+        # answered on the event loop from the namespace versions
+        self.assert_revalidates(
+            url, lambda: Answer.objects.create(question=self.question, author=self.author, content='Another.'),
+            client=APIClient(), queries=0,
+        )
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url + '&sort_by=newest', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_detail(self):
+        def rename():
+            self.author.displayName = 'Renamed'
+            self.author.save()
+        response = self.assert_revalidates(f'/api/users/{self.author.id}/', rename, client=APIClient(), queries=0)
+        self.assertEqual(response.json()['displayName'], 'Renamed')
+        self.assertIn('public', response['Cache-Control'])
+
+    @override_settings(VOTE_WRITE_BEHIND=False)
+    def test_own_profile(self):
+        voter, _ = make_user('voter')
+        response = self.assert_revalidates('/api/users/me/', lambda: cast_vote(voter, self.question, UPVOTE))
+        self.assertIn('private', response['Cache-Control'])
+
+
+class KeysetPaginationTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, self.client = make_user('author')
+        for i in range(5):
+            make_question(self.author, title=f'Question number {i}')
+
+    def test_pages_forward_and_back(self):
+        first = self.client.get('/api/questions/', {'cursor': '', 'page_size': 2, 'sort_by': 'newest'}).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 2)
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([q['id'] for q in back['results']], [q['id'] for q in first['results']])
+
+    def test_count_of_empty_search(self):
+        response = self.client.get('/api/questions/', {
+            'search': 'zzzz', 'cursor': '', 'with_count': 'true', 'sort_by': 'newest',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_malformed_cursors(self):
+        for payload in ('{"p": [[1], 5], "r": false}', '{"p": {"a": 1, "b": 2}, "r": false}',
+                        '{"p": ["yesterday", 5], "r": false}', '[1, 2]', 'not json'):
+            cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+            response = self.client.get('/api/questions/', {'cursor': cursor, 'sort_by': 'newest'})
+            self.assertEqual(response.status_code, 404, payload)
+
+    def get_from(self, question, reverse):
+        payload = json.dumps({'p': [question.created_at.isoformat(), question.id], 'r': reverse})
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return self.client.get('/api/questions/', {'cursor': cursor, 'sort_by': 'newest'}).json()
+
+    def test_empty_pages_link_back_in_keyset_mode(self):
+        # nothing is newer than the newest question, nothing older than the oldest
+        response = self.get_from(Question.objects.order_by('-created_at', '-id').first(), reverse=True)
+        self.assertEqual(response['results'], [])
+        self.assertRegex(response['next'], r'[?&]cursor=(&|$)')
+        response = self.get_from(Question.objects.order_by('created_at', 'id').first(), reverse=False)
+        self.assertEqual(response['results'], [])
+        self.assertRegex(response['previous'], r'[?&]cursor=(&|$)')
+
+
+class InvertedIndexSearchTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, self.client = make_user('author')
+        self.backend = InvertedIndexSearchBackend()
+
+    def ask(self, title, content='Nothing to see here.'):
+        return Question.objects.create(author=self.author, title=title, content=content)
+
+    def ids(self, text):
+        return list(self.backend.search(Question.objects.all(), text).values_list('id', flat=True))
+
+    def test_title_matches_rank_first(self):
+        in_content = self.ask('Unrelated title', 'I keep getting a migration error.')
+        in_title = self.ask('Migration errors on deploy')
+        self.assertEqual(self.ids('migrations'), [in_title.id, in_content.id])
+
+    def test_and_or_and_exclusion(self):
+        both = self.ask('Celery and redis')
+        celery = self.ask('Celery worker')
+        redis = self.ask('Redis cluster')
+        self.assertEqual(set(self.ids('celery redis')), {both.id})
+        self.assertEqual(set(self.ids('celery or redis')), {both.id, celery.id, redis.id})
+        self.assertEqual(set(self.ids('celery -redis')), {celery.id})
+
+    def test_index_follows_edits_and_deletes(self):
+        question = self.ask('Django signals')
+        self.assertEqual(self.ids('signals'), [question.id])
+        question.title = 'Django middleware'
+        question.save()
+        self.assertEqual(self.ids('signals'), [])
+        self.assertEqual(self.ids('middleware'), [question.id])
+        question.delete()
+        self.assertEqual(self.ids('middleware'), [])
+        self.assertEqual(self.backend._postings, {})
+
+    def test_incremental_sync_reads_only_changed_rows(self):
+        for i in range(20):
+            self.ask(f'Question about caching {i}')
+        self.ids('caching')
+        newest = self.ask('Question about caching again')
+        # the state query, the changed rows; none of the older questions again
+        with self.assertNumQueries(3):
+            ids = self.ids('caching')
+        self.assertEqual(len(ids), 21)
+        self.assertIn(newest.id, ids)
+
+    @override_settings(SEARCH_MAX_RESULTS=3)
+    def test_results_are_capped(self):
+        for i in range(5):
+            self.ask(f'Pagination question {i}')
+        self.assertEqual(len(self.ids('pagination')), 3)
+
+    def test_search_endpoint(self):
+        question = self.ask('Keyset pagination', 'How do cursors work?')
+        with mock.patch('Post.views.get_search_backend', return_value=self.backend):
+            results = self.client.get('/api/questions/', {'search': 'cursor'}).json()['results']
+        self.assertEqual([result['id'] for result in results], [question.id])
+        self.assertIn('<b>cursors</b>', results[0]['headline'])
+
+
+def make_list_fixture(size):
+    """`size` questions by one author under two tags, `size` answers to the first one, `size` tags and users."""
+    author = CustomUser.objects.create_user(email='lists@example.com', username='lists', password='pw')
+    CustomUser.objects.bulk_create([
+        CustomUser(email=f'user{i}@example.com', username=f'user{i}', password='!') for i in range(size)
+    ])
+    tags = get_or_create_tags(['python', 'django'] + [f'tag{i}' for i in range(size)])
+    questions = []
+    for i in range(size):
+        question = make_question(author, title=f'Question number {i}')
+        question.tags.set(tags[:2])
+        questions.append(question)
+    Answer.objects.bulk_create([
+        Answer(question=questions[0], author=author, content=f'Answer number {i}') for i in range(size)
+    ])
+    return author, questions
+
+
+class QueryBudgetTestCase(RedisTestCase):
+    """Every list endpoint runs a fixed number of queries, whatever the page size."""
+
+    PAGE_SIZES = (1, 10, 100)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.questions = make_list_fixture(max(cls.PAGE_SIZES))
+
+    def assert_budget(self, url, queries):
+        for page_size in self.PAGE_SIZES:
+            with self.subTest(page_size=page_size):
+                # a cold cache, so the view itself runs
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    response = self.client.get(f"{url}{'&' if '?' in url else '?'}page_size={page_size}")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), page_size)
+
+
+class ListQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_questions(self):
+        self.assert_budget('/api/questions/', 3)
+
+    def test_questions_by_votes(self):
+        self.assert_budget('/api/questions/?sort_by=votes', 3)
+
+    def test_questions_keyset(self):
+        self.assert_budget('/api/questions/?cursor=', 2)
+
+    def test_answers(self):
+        self.assert_budget(f'/api/answers/?question_id={self.questions[0].id}', 3)
+
+    def test_answers_keyset(self):
+        self.assert_budget(f'/api/answers/?question_id={self.questions[0].id}&cursor=', 2)
+
+    def test_tags(self):
+        self.assert_budget('/api/tags/', 2)
+
+    def test_tags_keyset(self):
+        self.assert_budget('/api/tags/?cursor=', 1)
+
+    def test_tag_questions(self):
+        self.assert_budget('/api/tags/name/python/questions/', 4)
+
+
+class DuplicateVoteMigrationTests(TransactionTestCase):
+    user_app = ('User', '0012_customuser_user_reputation_idx_and_more')
+    before = [('Post', '0013_question_search_vector'), user_app]
+    after = [('Post', '0014_vote_unique_constraints'), user_app]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_removed_and_counters_recomputed(self):
+        CustomUser = self.apps.get_model('User', 'CustomUser')
+        Question = self.apps.get_model('Post', 'Question')
+        Answer = self.apps.get_model('Post', 'Answer')
+        Vote = self.apps.get_model('Post', 'Vote')
+        author = CustomUser.objects.create(email='author@example.com', username='author', reputation=1 + 3 * 10 + 2 * 20)
+        voter = CustomUser.objects.create(email='voter@example.com', username='voter')
+        question = Question.objects.create(author=author, title='Duplicated', content='Votes', vote_count=3)
+        answer = Answer.objects.create(question=question, author=author, content='Answer', vote_count=2)
+        # the same upvote recorded three times on the question and twice on the answer
+        Vote.objects.bulk_create([Vote(user=voter, question=question, vote_type='upvote') for _ in range(3)])
+        Vote.objects.bulk_create([Vote(user=voter, answer=answer, vote_type='upvote') for _ in range(2)])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+
+        Vote = apps.get_model('Post', 'Vote')
+        self.assertEqual(Vote.objects.filter(question_id=question.id).count(), 1)
+        self.assertEqual(Vote.objects.filter(answer_id=answer.id).count(), 1)
+        self.assertEqual(apps.get_model('Post', 'Question').objects.get(pk=question.id).vote_count, 1)
+        self.assertEqual(apps.get_model('Post', 'Answer').objects.get(pk=answer.id).vote_count, 1)
+        self.assertEqual(apps.get_model('User', 'CustomUser').objects.get(pk=author.id).reputation, 1 + 10 + 20)
+        self.assertEqual(
+            sorted(apps.get_model('User', 'Reputation').objects.values_list('change', flat=True)), [-20, -20],
+        )
+
+
+@override_settings(VOTE_WRITE_BEHIND=False)
+class StatsTests(RedisTestCase):
+    """TagStats and UserTagStats, moved incrementally, must match a rebuild from scratch."""
+
+    def setUp(self):
+        super().setUp()
+        self.author, _ = make_user('author')
+        self.answerer, _ = make_user('answerer')
+        self.voter, _ = make_user('voter')
+        self.question = make_question(self.author, tags=['python', 'django'])
+        self.answers = [
+            Answer.objects.create(question=self.question, author=author, content='An answer.')
+            for author in (self.answerer, self.answerer, self.author)
+        ]
+        cast_vote(self.voter, self.question, UPVOTE)
+        cast_vote(self.voter, self.answers[0], DOWNVOTE)
+        cast_vote(self.voter, self.answers[2], UPVOTE)
+
+    def snapshot(self):
+        # last_activity_at is the time of the change, not the question's, and a user's
+        # rows left at zero are not shown
+        return (
+            set(TagStats.objects.values_list(
+                'tag_id', 'question_count', 'questions_this_week', 'questions_this_month',
+            )),
+            set(UserTagStats.objects.exclude(posts=0, score=0).values_list('user_id', 'tag_id', 'posts', 'score')),
+        )
+
+    def assert_matches_rebuild(self):
+        incremental = self.snapshot()
+        stats.rebuild_tag_stats()
+        stats.rebuild_user_tag_stats(CustomUser.objects.values_list('pk', flat=True))
+        self.assertEqual(incremental, self.snapshot())
+
+    def tag(self, name):
+        return get_or_create_tags([name])[0]
+
+    def test_create_answer_and_vote(self):
+        self.assert_matches_rebuild()
+        self.assertEqual(
+            set(UserTagStats.objects.filter(tag__name='python').values_list('user_id', 'posts', 'score')),
+            # author: the question (+1) and an answer (+1); answerer: two answers (-1)
+            {(self.author.pk, 2, 2), (self.answerer.pk, 2, -1)},
+        )
+
+    def test_vote_change(self):
+        cast_vote(self.voter, self.question, DOWNVOTE)
+        cast_vote(self.answerer, self.answers[2], DOWNVOTE)
+        self.assert_matches_rebuild()
+
+    @override_settings(VOTE_WRITE_BEHIND=True)
+    def test_write_behind_vote_on_flush(self):
+        cast_vote(self.answerer, self.question, UPVOTE)
+        cast_vote(self.author, self.answers[1], UPVOTE)
+        vote_buffer.flush()
+        self.assert_matches_rebuild()
+
+    def test_attach_and_detach(self):
+        self.question.tags.add(self.tag('orm'))
+        self.assert_matches_rebuild()
+        self.question.tags.remove(self.tag('python'))
+        self.assert_matches_rebuild()
+        self.question.tags.set([self.tag('python'), self.tag('testing')])
+        self.assert_matches_rebuild()
+        self.question.tags.clear()
+        self.assert_matches_rebuild()
+
+    def test_attach_and_detach_from_tag(self):
+        other = make_question(self.answerer, title='Another question', tags=['django'])
+        tag = self.tag('orm')
+        tag.questions.add(self.question, other)
+        self.assert_matches_rebuild()
+        tag.questions.remove(other)
+        self.assert_matches_rebuild()
+        tag.questions.clear()
+        self.assert_matches_rebuild()
+
+    def test_old_question_windows(self):
+        Question.objects.filter(pk=self.question.pk).update(created_at=timezone.now() - datetime.timedelta(days=10))
+        stats.rebuild_tag_stats()
+        self.question.refresh_from_db()
+        self.question.tags.add(self.tag('orm'))
+        self.assert_matches_rebuild()
+        self.assertEqual(
+            TagStats.objects.filter(tag__name='orm').values_list(
+                'question_count', 'questions_this_week', 'questions_this_month',
+            ).get(),
+            (1, 0, 1),
+        )
+
+    def test_answer_delete(self):
+        self.answers[0].delete()
+        self.assert_matches_rebuild()
+
+    def test_question_delete(self):
+        make_question(self.answerer, title='Another question', tags=['python'])
+        self.question.delete()
+        self.assert_matches_rebuild()
+
+    def test_tag_delete(self):
+        self.tag('django').delete()
+        self.assert_matches_rebuild()
+
+    def test_top_tags(self):
+        for i, name in enumerate(['a', 'b', 'c', 'd', 'e', 'f']):
+            question = make_question(self.voter, title=f'Question number {i}', tags=[name])
+            for voter in (self.author, self.answerer)[:i % 3]:
+                cast_vote(voter, question, UPVOTE)
+        stats.rebuild_top_tags([self.voter.pk])
+        self.assertEqual(
+            sorted(self.voter.top_tags.values_list('name', flat=True)),
+            # the best scores, ties broken by the newer tag
+            ['b', 'c', 'd', 'e', 'f'],
+        )
+
+    def test_user_tags_view(self):
+        response = APIClient().get(f'/api/users/{self.answerer.pk}/tags/')
+        self.assertEqual(
+            [(tag['name'], tag['posts'], tag['score']) for tag in response.json()],
+            [('django', 2, -1), ('python', 2, -1)],
+        )
+
+
+@override_settings(VOTE_WRITE_BEHIND=False)
+class HotRankingTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, _ = make_user('author')
+        self.voter, _ = make_user('voter')
+        self.client = APIClient()
+        self.questions = [make_question(self.author, title=f'Question number {i}') for i in range(3)]
+
+    def hot_ids(self, sort_by='hot'):
+        response = self.client.get('/api/questions/', {'sort_by': sort_by})
+        self.assertEqual(response.status_code, 200)
+        return [question['id'] for question in response.json()['results']]
+
+    def age(self, question, days):
+        Question.objects.filter(pk=question.pk).update(created_at=timezone.now() - datetime.timedelta(days=days))
+
+    def test_rescore_decays_with_age(self):
+        self.age(self.questions[0], 40)
+        self.age(self.questions[1], 10)
+        self.assertEqual(ranking.rescore(), 3)
+        newest, month_old, old = self.questions[2].id, self.questions[1].id, self.questions[0].id
+        self.assertEqual(self.hot_ids(), [newest, month_old, old])
+        self.assertEqual(self.hot_ids('hot_month'), [newest, month_old])
+        self.assertEqual(self.hot_ids('hot_week'), [newest])
+
+        now = timezone.now()
+        score = ranking.hot_score(5, 1, 10, now, now)
+        self.assertLess(ranking.hot_score(5, 1, 10, now, now + datetime.timedelta(hours=6)), score)
+        self.assertGreater(ranking.hot_score(6, 1, 10, now, now), score)
+
+    def test_touch_on_vote_and_answer(self):
+        ranking.rescore()
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.voter, self.questions[0], UPVOTE)
+        self.assertEqual(self.hot_ids()[0], self.questions[0].id)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(2):
+                Answer.objects.create(question=self.questions[1], author=self.voter, content='An answer.')
+        self.assertEqual(self.hot_ids()[0], self.questions[1].id)
+
+    def test_touch_drops_deleted_question(self):
+        ranking.rescore()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.questions[2].delete()
+        self.assertEqual(sorted(self.hot_ids()), [self.questions[0].id, self.questions[1].id])
+
+    def test_rescore_queued_until_built(self):
+        with mock.patch('Post.tasks.rescore_hot_questions.delay') as delay:
+            self.assertEqual(self.hot_ids(), [question.id for question in reversed(self.questions)])
+        delay.assert_called_once_with()
+
+    def test_filters_rejected(self):
+        ranking.rescore()
+        for params in ({'search': 'question'}, {'tags': 'python'}, {'author': self.author.id}):
+            response = self.client.get('/api/questions/', {'sort_by': 'hot', **params})
+            self.assertEqual(response.status_code, 400, params)
+
+
+class CounterBackfillMigrationTests(TransactionTestCase):
+    before = [('Post', '0016_tagstats'), ('User', '0014_customuser_avatar_variants')]
+    after = [('Post', '0017_backfill_counters')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_counters_backfilled(self):
+        CustomUser = self.apps.get_model('User', 'CustomUser')
+        Question = self.apps.get_model('Post', 'Question')
+        Answer = self.apps.get_model('Post', 'Answer')
+        author = CustomUser.objects.create(email='author@example.com', username='author', question_count=7)
+        other = CustomUser.objects.create(email='other@example.com', username='other', answer_count=3)
+        answered = Question.objects.create(author=author, title='Answered', content='Content')
+        unanswered = Question.objects.create(author=author, title='Unanswered', content='Content', answer_count=2)
+        Answer.objects.create(question=answered, author=other, content='Answer')
+        Answer.objects.create(question=answered, author=author, content='Answer')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+
+        Question = apps.get_model('Post', 'Question')
+        self.assertEqual(Question.objects.get(pk=answered.pk).answer_count, 2)
+        self.assertEqual(Question.objects.get(pk=unanswered.pk).answer_count, 0)
+        users = apps.get_model('User', 'CustomUser').objects.order_by('pk')
+        self.assertEqual(
+            list(users.values_list('question_count', 'answer_count')), [(2, 1), (0, 1)],
+        )
+
+
+class CounterTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author, _ = make_user('author')
+        self.answerer, _ = make_user('answerer')
+
+    def counters(self):
+        self.author.refresh_from_db()
+        self.answerer.refresh_from_db()
+        return self.author.question_count, self.answerer.answer_count
+
+    def test_create_and_delete(self):
+        question = make_question(self.author)
+        answers = [Answer.objects.create(question=question, author=self.answerer, content='An answer.')
+                   for _ in range(2)]
+        question.refresh_from_db()
+        self.assertEqual(question.answer_count, 2)
+        self.assertEqual(self.counters(), (1, 2))
+
+        answers[0].delete()
+        question.refresh_from_db()
+        self.assertEqual(question.answer_count, 1)
+        self.assertEqual(self.counters(), (1, 1))
+
+        # the remaining answer is cascaded
+        question.delete()
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_unanswered_sort(self):
+        answered = make_question(self.author, title='An answered question')
+        unanswered = make_question(self.author, title='An unanswered question')
+        Answer.objects.create(question=answered, author=self.answerer, content='An answer.')
+        response = APIClient().get('/api/questions/', {'sort_by': 'unanswered'})
+        self.assertEqual([q['id'] for q in response.json()['results']], [unanswered.id])
+
+    def test_recount_repairs_drift(self):
+        questions = [make_question(self.author, title=f'Question number {i}') for i in range(3)]
+        Answer.objects.create(question=questions[0], author=self.answerer, content='An answer.')
+        Question.objects.update(answer_count=5)
+        CustomUser.objects.update(question_count=0, answer_count=9)
+
+        out = io.StringIO()
+        call_command('recount', chunk_size=2, stdout=out)
+        self.assertIn('Question.answer_count: 3 row(s) fixed', out.getvalue())
+        self.assertEqual(
+            dict(Question.objects.values_list('pk', 'answer_count')),
+            {questions[0].pk: 1, questions[1].pk: 0, questions[2].pk: 0},
+        )
+        self.assertEqual(self.counters(), (3, 1))
+        self.assertEqual(CustomUser.objects.get(pk=self.author.pk).answer_count, 0)
+
+        out = io.StringIO()
+        call_command('recount', stdout=out)
+        self.assertIn('Question.answer_count: 0 row(s) fixed', out.getvalue())
+
+
+@skipUnless(connection.vendor == 'postgresql', "needs row locks and concurrent writers")
+@override_settings(VOTE_WRITE_BEHIND=False)
+class ConcurrentVoteTests(TransactionTestCase):
+    VOTERS = 1000
+    THREADS = 20
+
+    def setUp(self):
+        cache.clear()
+
+    def test_parallel_votes_are_counted_once(self):
+        author = CustomUser.objects.create_user(email='author@example.com', username='author', password='pw')
+        question = make_question(author)
+        voters = CustomUser.objects.bulk_create([
+            CustomUser(email=f'voter{i}@example.com', username=f'voter{i}', password='!') for i in range(self.VOTERS)
+        ])
+        # every voter casts the same upvote twice, the two attempts in different threads
+        attempts = voters + voters[::-1]
+        outcomes = {'counted': 0, 'already_voted': 0}
+        lock = threading.Lock()
+
+        def vote(batch):
+            try:
+                for voter in batch:
+                    try:
+                        cast_vote(voter, Question.objects.get(pk=question.pk), UPVOTE)
+                        outcome = 'counted'
+                    except AlreadyVoted:
+                        outcome = 'already_voted'
+                    with lock:
+                        outcomes[outcome] += 1
+            finally:
+                connections.close_all()
+
+        batches = [attempts[i::self.THREADS] for i in range(self.THREADS)]
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            list(pool.map(vote, batches))
+
+        self.assertEqual(outcomes, {'counted': self.VOTERS, 'already_voted': self.VOTERS})
+        self.assertEqual(Vote.objects.filter(question=question).count(), self.VOTERS)
+        question.refresh_from_db()
+        self.assertEqual(question.vote_count, self.VOTERS)
+        author.refresh_from_db()
+        self.assertEqual(author.reputation, 1 + 10 * self.VOTERS)
+        self.assertEqual(Reputation.objects.filter(user=author).count(), self.VOTERS)
@@ -1,13 +1,23 @@
 from django.contrib.auth import get_user_model
+from django.db.models import F
+from Post import vote_buffer
+from Post.models import Tag
 from User.models import Reputation, CustomUser
 
 User = get_user_model()
 
 def add_reputation(user_id:int, rep_type:str, change:int, description:str):
-    try:
-        user = CustomUser.objects.get(id=user_id)
-        Reputation.objects.create(user=user, type=rep_type, change=change, description=description)
-        user.reputation += change
-        user.save()
-    except CustomUser.DoesNotExist:
-        pass
\ No newline at end of file
+    if vote_buffer.enabled():
+        if CustomUser.objects.filter(id=user_id).exists():
+            Reputation.objects.create(user_id=user_id, type=rep_type, change=change, description=description)
+            vote_buffer.add('user', user_id, change)
+        return
+    # database-side increment: no read-modify-write race and only the reputation column is written
+    updated = CustomUser.objects.filter(id=user_id).update(reputation=F('reputation') + change)
+    if updated:
+        Reputation.objects.create(user_id=user_id, type=rep_type, change=change, description=description)
+
+
+def get_or_create_tags(names):
+    """Tag objects for `names`, creating the missing ones (their TagStats row comes with them)."""
+    return [Tag.objects.get_or_create(name=name)[0] for name in names]
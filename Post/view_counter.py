@@ -0,0 +1,97 @@
+"""
+Question view tracking without a database write on the detail GET.
+
+`record_view()` runs one Lua script in Redis: the viewer is PFADD'ed to a per-question
+HyperLogLog for the current VIEW_DEDUP_WINDOW, and only a viewer that is new to that
+window is counted in the `question_views:pending` hash. `flush()` (Celery beat, every
+VIEW_FLUSH_INTERVAL seconds) folds the pending counts into Question.view_count with one
+bulk UPDATE per chunk of questions.
+
+Flushed view counts do not bump the questions cache namespace: they are approximate
+by nature and would otherwise invalidate every list cache once per flush.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from Post import ranking
+from Post.models import Question
+from StackOverflowCopy import async_cache
+from StackOverflowCopy.cache import draining
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'question_views:pending'
+FLUSH_CHUNK_SIZE = 500
+
+# KEYS[1] window HyperLogLog, KEYS[2] pending hash; ARGV: viewer, ttl, question id
+RECORD_VIEW_SCRIPT = """
+if redis.call('PFADD', KEYS[1], ARGV[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+    return 1
+end
+return 0
+"""
+
+_record_view = None
+
+
+def viewer_key(request):
+    if request.user.is_authenticated:
+        return f"u:{request.user.id}"
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    ip = forwarded.split(',')[0].strip() or request.META.get('REMOTE_ADDR', '')
+    agent = request.META.get('HTTP_USER_AGENT', '')
+    return 'a:' + hashlib.md5(f"{ip}|{agent}".encode()).hexdigest()[:16]
+
+
+def record_view(request, question_id):
+    """Count a view of `question_id`; never fails the request it is called from."""
+    global _record_view
+    if not settings.VIEW_TRACKING_ENABLED:
+        return
+    window = settings.VIEW_DEDUP_WINDOW
+    try:
+        if _record_view is None:
+            _record_view = get_redis_connection('default').register_script(RECORD_VIEW_SCRIPT)
+        _record_view(keys=[_window_key(question_id), PENDING_KEY], args=[viewer_key(request), window, question_id])
+    except RedisError:
+        logger.warning("could not record view of question %s", question_id, exc_info=True)
+
+
+async def arecord_view(request, question_id):
+    """record_view() for async views."""
+    if not settings.VIEW_TRACKING_ENABLED:
+        return
+    window = settings.VIEW_DEDUP_WINDOW
+    try:
+        await async_cache.client().eval(
+            RECORD_VIEW_SCRIPT, 2, _window_key(question_id), PENDING_KEY, viewer_key(request), window, question_id,
+        )
+    except RedisError:
+        logger.warning("could not record view of question %s", question_id, exc_info=True)
+
+
+def _window_key(question_id):
+    window = settings.VIEW_DEDUP_WINDOW
+    return f"question_views:{question_id}:{int(time.time() // window)}"
+
+
+def flush():
+    """Fold pending views into Question.view_count. Returns the number of questions updated."""
+    with draining(PENDING_KEY) as counts:
+        ids = sorted(counts, key=int)
+        for start in range(0, len(ids), FLUSH_CHUNK_SIZE):
+            chunk = ids[start:start + FLUSH_CHUNK_SIZE]
+            Question.objects.filter(pk__in=chunk).update(view_count=F('view_count') + Case(
+                *[When(pk=pk, then=Value(counts[pk])) for pk in chunk],
+                default=Value(0),
+            ))
+        ranking.touch(counts)
+    return len(counts)
@@ -1,39 +1,68 @@
-from copy import copy
-from django.core.cache import cache
-import json
-import hashlib
-from django.db.models import Q
-from django.db.models import Count
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from Post.models import Question, Answer, Vote, Tag
-from Post.pagination import CustomPageNumberPagination, TagCustomPageNumberPagination
-from Post.serializers import QuestionSerializer, AnswerSerializer
+from Post import ranking, view_counter, vote_buffer
+from Post.models import Question, Answer, Tag, TagStats
+from Post.pagination import CustomPageNumberPagination, TagCustomPageNumberPagination, TagKeysetPagination, get_paginator
+from Post.search import get_search_backend
+from Post.serializers import QuestionSerializer, QuestionSearchSerializer, AnswerSerializer
 from Post.tasks import update_question_list_cache
-from Post.utils import add_reputation
+from Post.utils import add_reputation, get_or_create_tags
+from Post.votes import AlreadyVoted, cast_vote, normalize_vote_type
+from StackOverflowCopy import cache as cache_ns
+from StackOverflowCopy import debounce, http
+from StackOverflowCopy.cache import async_cached, cache_response
+from StackOverflowCopy.http import conditional
+from StackOverflowCopy.renderers import FastJSONRenderer
+from User.authentication import CachedTokenAuthentication, acached_user
+
+# sort_by -> ordering; every ordering ends with id so it can drive keyset pagination
+QUESTION_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    'active': ('-updated_at', '-id'),
+    'votes': ('-vote_count', '-id'),
+    'unanswered': ('-created_at', '-id'),
+}
+ANSWER_ORDERINGS = {
+    'votes': ('-vote_count', '-id'),
+    'newest': ('-created_at', '-id'),
+    'oldest': ('created_at', 'id'),
+}
+TAG_ORDERINGS = {
+    'popular': ('-stats__question_count', '-id'),
+    'name': ('name', 'id'),
+    'newest': ('-created_at', '-id'),
+}
+
+
+def question_list_timeout(params):
+    # hot order moves with every rescore without bumping the namespace
+    if params['sort_by'] in ranking.HOT_SETS:
+        return settings.HOT_RESCORE_INTERVAL
+    return settings.LIST_CACHE_TIMEOUT
+
 
 @api_view(['GET', 'POST'])
+@cache_response('question_list', [cache_ns.QUESTIONS], params={
+    'page': '1', 'page_size': '10', 'sort_by': None, 'search': None, 'tags': [], 'author': None,
+    'cursor': None, 'with_count': None,
+}, timeout=question_list_timeout, raw=True)
 def questions_list_and_create(request):
-    query_params = request.query_params.dict()
-    key_raw = json.dumps(query_params, sort_keys=True)
-    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
-    cache_key = f"question_list:{key_hash}"
-    print(key_hash)
-
-    cached_response = cache.get(cache_key)
-    if cached_response:
-        return Response(cached_response, status=status.HTTP_200_OK)
-
     if request.method == 'GET':
-        queryset = Question.objects.all()
+        queryset = QuestionSerializer.setup_eager_loading(Question.objects.all())
 
         search = request.query_params.get('search')
         if search:
-            queryset = queryset.filter(Q(title__icontains=search) | Q(content__icontains=search))
+            search_backend = get_search_backend()
+            queryset = search_backend.search(queryset, search)
 
         tags = request.query_params.getlist('tags')
         if tags:
@@ -44,23 +73,35 @@ def questions_list_and_create(request):
             queryset = queryset.filter(author__id=author)
 
         sort_by = request.query_params.get('sort_by')
-        if sort_by:
-            if sort_by == 'newest':
-                queryset = queryset.order_by('-created_at')
-            elif sort_by == 'active':
-                queryset = queryset.order_by('-updated_at')
-            elif sort_by == 'votes':
-                queryset = queryset.order_by('-vote_count')
-            elif sort_by == 'unanswered':
-                queryset = queryset.filter(answer_count=0).order_by('-created_at')
-
-        paginator = CustomPageNumberPagination()
+        if sort_by == 'unanswered':
+            queryset = queryset.filter(answer_count=0)
+        hot = None
+        if sort_by in ranking.HOT_SETS:
+            # the sorted sets rank every question: there is no hot order of a filtered list
+            if search or tags or author:
+                return Response(
+                    {'detail': f'sort_by={sort_by} cannot be combined with search, tags or author.'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            # ids come straight from the sorted set
+            hot = ranking.hot_questions(sort_by, queryset)
+        if hot is not None:
+            paginator = CustomPageNumberPagination()
+            queryset = hot
+        elif search and sort_by not in QUESTION_ORDERINGS:
+            # relevance order; float ranks are not a stable keyset, so page numbers only
+            paginator = CustomPageNumberPagination()
+        else:
+            ordering = QUESTION_ORDERINGS.get(sort_by, QUESTION_ORDERINGS['newest'])
+            queryset = queryset.order_by(*ordering)
+            paginator = get_paginator(request, ordering)
         paginated_queryset = paginator.paginate_queryset(queryset, request)
-        serializer = QuestionSerializer(paginated_queryset, many=True)
-        paginated_response = paginator.get_paginated_response(serializer.data)
-
-        cache.set(cache_key, paginated_response.data, timeout=60)
-        return paginated_response
+        if search:
+            headlines = search_backend.headlines(paginated_queryset, search)
+            serializer = QuestionSearchSerializer(paginated_queryset, many=True, context={'headlines': headlines})
+        else:
+            serializer = QuestionSerializer(paginated_queryset, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
     elif request.method == 'POST':
@@ -72,19 +113,55 @@ def questions_list_and_create(request):
 
         if serializer.is_valid():
             serializer.save(author=request.user)
-            update_question_list_cache.delay()
+            debounce.schedule(update_question_list_cache)
 
             return Response(serializer.data, status=201)
 
         return Response(serializer.errors, status=400)
 
 
+questions_list_async = async_cached('question_list', questions_list_and_create)
+
+
+
+QUESTION_ETAG_FIELDS = (
+    'updated_at', 'vote_count', 'answer_count', 'view_count', 'author_id',
+    'author__username', 'author__displayName', 'author__avatar_url', 'author__reputation',
+)
+
+
+def question_etag(request, id):
+    row = Question.objects.filter(id=id).values_list(*QUESTION_ETAG_FIELDS).first()
+    if row is None:
+        return None
+    # every GET of an existing question passes here, including the ones answered with a 304
+    view_counter.record_view(request, id)
+    pending = (
+        vote_buffer.pending('question', [id]).get(id, 0),
+        vote_buffer.pending('user', [row[4]]).get(row[4], 0),
+    ) if vote_buffer.enabled() else ()
+    return (*row, *pending)
+
+
+async def aquestion_etag(request, id):
+    """question_etag() for the async view: the Redis round-trips run concurrently."""
+    row = await Question.objects.filter(id=id).values_list(*QUESTION_ETAG_FIELDS).afirst()
+    if row is None:
+        return None
+    lookups = [view_counter.arecord_view(request, id)]
+    if vote_buffer.enabled():
+        lookups += [vote_buffer.apending('question', [id]), vote_buffer.apending('user', [row[4]])]
+    _, *deltas = await asyncio.gather(*lookups)
+    pending = (deltas[0].get(id, 0), deltas[1].get(row[4], 0)) if deltas else ()
+    return (*row, *pending)
+
 
 @api_view(['GET','PATCH','DELETE'])
+@conditional(question_etag)
 def question_details_edit_delete(request, id):
     if request.method == 'GET':
         try:
-            question = Question.objects.get(id=id)
+            question = QuestionSerializer.setup_eager_loading(Question.objects.all()).get(id=id)
         except Question.DoesNotExist:
             return Response({"message":"question not found by this id"},status=status.HTTP_404_NOT_FOUND)
         serializer = QuestionSerializer(question)
@@ -118,7 +195,7 @@ def question_details_edit_delete(request, id):
         if new_content and new_content != "" and new_content is not None:
             question.content = new_content
         if new_tags and new_tags != [] and new_tags is not None:
-            question.tags = new_tags
+            question.tags.set(get_or_create_tags(new_tags))
         question.save()
         serializer = QuestionSerializer(question)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -139,8 +216,38 @@ def question_details_edit_delete(request, id):
         return Response({"message":"question deleted"}, status=status.HTTP_204_NO_CONTENT)
 
 
+def render_question(id):
+    question = QuestionSerializer.setup_eager_loading(Question.objects.all()).filter(id=id).first()
+    if question is None:
+        return None
+    return FastJSONRenderer().render(QuestionSerializer(question).data)
+
 
-@authentication_classes([TokenAuthentication])
+@csrf_exempt
+async def question_details_async(request, id):
+    """
+    ASGI front of question_details_edit_delete: a JSON GET runs its ETag lookups on the
+    event loop and only needs a thread to render a changed question; other requests, and
+    callers whose token is not cached, go to the sync view.
+    """
+    user = await acached_user(request)
+    if request.method != 'GET' or user is None or not http.wants_json(request):
+        return await sync_to_async(question_details_edit_delete)(request, id=id)
+    request.user = user
+    parts = await aquestion_etag(request, id)
+    body = None
+    if parts is not None:
+        etag = http.make_etag(*parts)
+        if http.etag_matches(request, etag):
+            return http.not_modified(request, etag)
+        body = await sync_to_async(render_question)(id)
+    if body is None:
+        return JsonResponse({"message": "question not found by this id"}, status=status.HTTP_404_NOT_FOUND)
+    return http.add_validators(request, HttpResponse(body, content_type='application/json'), etag)
+
+
+
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 @api_view(['POST'])
 def question_vote(request,id):
@@ -150,71 +257,45 @@ def question_vote(request,id):
     }
     """
     try:
-        question = Question.objects.get(id=id)
+        question = QuestionSerializer.setup_eager_loading(Question.objects.all()).get(id=id)
     except Question.DoesNotExist:
         return Response({"message":"question with this id does not exist"}, status=status.HTTP_404_NOT_FOUND)
-    vote_type = request.data.get('vote_type')
-    if vote_type not in ['upvote', 'downvote', 'Upvote', 'Downvote']:
+    vote_type = normalize_vote_type(request.data.get('vote_type'))
+    if vote_type is None:
         return Response({"message":"invalid vote_type"}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        vote = Vote.objects.get(question=question,user=request.user)
-        if vote.vote_type == vote_type:
-            return Response({"message":"you have already cast this vote"}, status=status.HTTP_409_CONFLICT)
-        else:
-            old_vote = copy(vote.vote_type)
-            vote.vote_type = vote_type
-            vote.save()
-
-            if old_vote == "upvote" and vote_type == "downvote":
-                question.vote_count -= 2
-                if request.user != question.author:
-                    add_reputation(user_id=question.author_id, rep_type='question_downvote', change=-20,
-                                   description=f"Question was upvoted but now changed to downvoted:{question.title}")
-            elif old_vote == "downvote" and vote_type == "upvote":
-                question.vote_count += 2
-                if request.user != question.author:
-                    add_reputation(user_id=question.author_id, rep_type='question_downvote', change=20,
-                                   description=f"Question was downvated but now changed to upvoted:{question.title}")
-            question.save()
-    except Vote.DoesNotExist:
-        Vote.objects.create(question=question, user=request.user, vote_type=vote_type)
-        if vote_type == "upvote":
-            question.vote_count += 1
-            if request.user != question.author:
-                add_reputation(user_id=question.author_id,rep_type='question_upvote',change=10,
-                               description=f"Question upvoted:{question.title}")
-        elif vote_type == "downvote":
-            question.vote_count -= 1
-            if request.user != question.author:
-                add_reputation(user_id=question.author_id, rep_type='question_downvote', change=-10,
-                               description=f"Question downvoted:{question.title}")
-        question.save()
+        cast_vote(request.user, question, vote_type)
+    except AlreadyVoted:
+        return Response({"message":"you have already cast this vote"}, status=status.HTTP_409_CONFLICT)
     serializer = QuestionSerializer(question)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+ANSWER_LIST_NAMESPACES = [cache_ns.ANSWERS, cache_ns.USERS]
+
+
+def answer_list_etag(request):
+    # list-level marker: any answer, vote or author change bumps one of the namespaces
+    params = sorted(request.query_params.lists())
+    return (*cache_ns.get_versions(ANSWER_LIST_NAMESPACES), params)
+
+
 @api_view(['GET','POST'])
+@conditional(answer_list_etag)
 def answer_list_create(request):
     if request.method == 'GET':
-        queryset = Answer.objects.all()
+        queryset = AnswerSerializer.setup_eager_loading(Answer.objects.all())
         question_id = request.query_params.get('question_id')
-        try:
-            question = Question.objects.get(id=question_id)
-        except Question.DoesNotExist:
+        if not Question.objects.filter(id=question_id).exists():
             return Response({"message": "question with this id does not exist"}, status=status.HTTP_404_NOT_FOUND)
         queryset = queryset.filter(question_id=question_id)
         if request.query_params.get('author'):
             queryset = queryset.filter(author=request.query_params.get('author'))
         sort_by = request.query_params.get('sort_by')
-        if sort_by:
-            if sort_by == 'votes':
-                queryset = queryset.order_by('-vote_count')
-            elif sort_by == 'newest':
-                queryset = queryset.order_by('-newest')
-            elif sort_by == 'oldest':
-                queryset = queryset.order_by('-oldest')
-
-        paginator = CustomPageNumberPagination()
+        ordering = ANSWER_ORDERINGS.get(sort_by, ANSWER_ORDERINGS['votes'])
+        queryset = queryset.order_by(*ordering)
+
+        paginator = get_paginator(request, ordering)
         paginated_queryset = paginator.paginate_queryset(queryset, request)
         serializer = AnswerSerializer(paginated_queryset, many=True)
         return paginator.get_paginated_response(serializer.data)
@@ -240,11 +321,25 @@ def answer_list_create(request):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@csrf_exempt
+async def answer_list_async(request):
+    """ASGI front of answer_list_create: a revalidation that still matches gets its 304 on the event loop."""
+    if request.method == 'GET' and request.META.get('HTTP_IF_NONE_MATCH'):
+        user = await acached_user(request)
+        versions = await cache_ns.aget_versions(ANSWER_LIST_NAMESPACES)
+        if user is not None and versions is not None:
+            etag = http.make_etag(*versions, sorted(request.GET.lists()))
+            if http.etag_matches(request, etag):
+                request.user = user
+                return http.not_modified(request, etag)
+    return await sync_to_async(answer_list_create)(request)
+
+
 @api_view(['GET','PATCH','DELETE'])
 def answer_details_edit_delete(request,id):
     if request.method == 'GET':
         try:
-            answer = Answer.objects.get(id=id)
+            answer = AnswerSerializer.setup_eager_loading(Answer.objects.all()).get(id=id)
         except Answer.DoesNotExist:
             return Response({"message": "answer with this id does not exist"}, status=status.HTTP_404_NOT_FOUND)
         serializer = AnswerSerializer(answer)
@@ -280,7 +375,7 @@ def answer_details_edit_delete(request,id):
 
 
 
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 @api_view(['POST'])
 def answer_vote(request,id):
@@ -290,50 +385,21 @@ def answer_vote(request,id):
         }
         """
     try:
-        answer = Answer.objects.get(id=id)
+        answer = AnswerSerializer.setup_eager_loading(Answer.objects.select_related('question')).get(id=id)
     except Answer.DoesNotExist:
         return Response({"message": "answer with this id does not exist"}, status=status.HTTP_404_NOT_FOUND)
-    vote_type = request.data.get('vote_type')
-    if vote_type not in ['upvote', 'downvote', 'Upvote', 'Downvote']:
+    vote_type = normalize_vote_type(request.data.get('vote_type'))
+    if vote_type is None:
         return Response({"message": "invalid vote_type"}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        vote = Vote.objects.get(answer=answer, user=request.user)
-        if vote.vote_type == vote_type:
-            return Response({"message": "you have already cast this vote"}, status=status.HTTP_409_CONFLICT)
-        else:
-            old_vote = copy(vote.vote_type)
-            vote.vote_type = vote_type
-            vote.save()
-
-            if old_vote == "upvote" and vote_type == "downvote":
-                answer.vote_count -= 2
-                if request.user != answer.author:
-                    add_reputation(user_id=answer.author_id, rep_type='answer_downvote', change=-40,
-                                   description=f"Answer was upvoted but now changed to downvoted ->:{answer.question.title}:{answer.content}")
-            elif old_vote == "downvote" and vote_type == "upvote":
-                answer.vote_count += 2
-                if request.user != answer.author:
-                    add_reputation(user_id=answer.author_id, rep_type='answer_upvote', change=40,
-                                   description=f"Answer was downvoted but now changed to upvoted ->:{answer.question.title}:{answer.content}")
-            answer.save()
-    except Vote.DoesNotExist:
-        Vote.objects.create(answer=answer, user=request.user, vote_type=vote_type)
-        if vote_type == "upvote":
-            answer.vote_count += 1
-            if request.user != answer.author:
-                add_reputation(user_id=answer.author_id, rep_type='answer_upvote', change=20,
-                               description=f"Answer upvoted ->:{answer.question.title}:{answer.content}")
-        elif vote_type == "downvote":
-            answer.vote_count -= 1
-            if request.user != answer.author:
-                add_reputation(user_id=answer.author_id, rep_type='answer_downvote', change=-20,
-                               description=f"Answer downvoted ->:{answer.question.title}:{answer.content}")
-        answer.save()
+        cast_vote(request.user, answer, vote_type)
+    except AlreadyVoted:
+        return Response({"message": "you have already cast this vote"}, status=status.HTTP_409_CONFLICT)
     serializer = AnswerSerializer(answer)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 @api_view(['POST'])
 def answer_accept(request, id):
@@ -375,7 +441,17 @@ def answer_accept(request, id):
         return Response({'error': 'Answer not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+def tag_question_count(tag):
+    try:
+        return tag.stats.question_count
+    except TagStats.DoesNotExist:
+        return 0
+
+
 @api_view(['GET'])
+@cache_response('tags_list', [cache_ns.TAGS], params={
+    'page': '1', 'page_size': '20', 'search': None, 'sort_by': 'popular', 'cursor': None, 'with_count': None,
+}, raw=True)
 def tags_list(request):
     """
         Метод: GET
@@ -385,32 +461,18 @@ def tags_list(request):
           - search: поиск по имени тега
           - sort_by: 'popular', 'name', 'newest'
     """
-    query_params = request.query_params.dict()
-    key_raw = json.dumps(query_params, sort_keys=True)
-    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
-    cache_key = f"tags_list:{key_hash}"
-
-    cached_response = cache.get(cache_key)
-    if cached_response:
-        return Response(cached_response, status=status.HTTP_200_OK)
-
-    queryset = Tag.objects.all()
+    # counts come from the TagStats row (Post.stats), not a Count over the m2m table
+    queryset = Tag.objects.select_related('stats')
 
     search = request.query_params.get('search')
     if search:
         queryset = queryset.filter(name__icontains=search)
 
-    queryset = queryset.annotate(count=Count('questions'))
-
     sort_by = request.query_params.get('sort_by')
-    if sort_by == 'name':
-        queryset = queryset.order_by('name')
-    elif sort_by == 'newest':
-        queryset = queryset.order_by('-created_at')
-    elif sort_by == 'popular':
-        queryset = queryset.order_by('-count')
-
-    paginator = TagCustomPageNumberPagination()
+    ordering = TAG_ORDERINGS.get(sort_by, TAG_ORDERINGS['popular'])
+    queryset = queryset.order_by(*ordering)
+
+    paginator = get_paginator(request, ordering, TagCustomPageNumberPagination, TagKeysetPagination)
     paginated_queryset = paginator.paginate_queryset(queryset, request)
 
     results = [
@@ -418,20 +480,26 @@ def tags_list(request):
             "id": tag.id,
             "name": tag.name,
             "description": tag.description,
-            "count": tag.count
+            "count": tag_question_count(tag)
         }
         for tag in paginated_queryset
     ]
-    paginated_response = paginator.get_paginated_response(results)
-    cache.set(cache_key, paginated_response.data, timeout=60)
-    return paginated_response
+    return paginator.get_paginated_response(results)
+
+
+tags_list_async = async_cached('tags_list', tags_list)
+
+
+def tag_etag(request, id):
+    return Tag.objects.filter(id=id).values_list('name', 'description', 'stats__question_count').first()
 
 
 @api_view(['GET'])
+@conditional(tag_etag)
 def tags_details(request, id):
     try:
-        tag = Tag.objects.get(id=id)
-        count = tag.questions.count()
+        tag = Tag.objects.select_related('stats').get(id=id)
+        count = tag_question_count(tag)
     except Tag.DoesNotExist:
         return Response({"message": "Tag not found"}, status=status.HTTP_404_NOT_FOUND)
     response_data = {
@@ -446,8 +514,8 @@ def tags_details(request, id):
 @api_view(['GET'])
 def tags_by_name(request,name):
     try:
-        tag = Tag.objects.get(name=name)
-        count = tag.questions.count()
+        tag = Tag.objects.select_related('stats').get(name=name)
+        count = tag_question_count(tag)
     except Tag.DoesNotExist:
         return Response({"message": "Tag not found"}, status=status.HTTP_404_NOT_FOUND)
     response_data = {
@@ -481,17 +549,13 @@ def tag_questions(request,name):
     except Tag.DoesNotExist:
         return Response({"message": "Tag not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    queryset = Question.objects.filter(tags=tag)
+    queryset = QuestionSerializer.setup_eager_loading(Question.objects.filter(tags=tag))
 
     sort_by = request.query_params.get('sort_by')
-    if sort_by == 'votes':
-        queryset = queryset.order_by('-vote_count')
-    elif sort_by == 'active':
-        queryset = queryset.order_by('-updated_at')
-    elif sort_by == 'newest':
-        queryset = queryset.order_by('-created_at')
-
-    paginator = CustomPageNumberPagination()
+    ordering = QUESTION_ORDERINGS.get(sort_by, QUESTION_ORDERINGS['newest'])
+    queryset = queryset.order_by(*ordering)
+
+    paginator = get_paginator(request, ordering)
     paginated_queryset = paginator.paginate_queryset(queryset, request)
     serializer = QuestionSerializer(paginated_queryset, many=True)
 
@@ -0,0 +1,134 @@
+"""
+Write-behind buffer for vote tallies, enabled with settings.VOTE_WRITE_BEHIND.
+
+Votes still write their Vote and Reputation rows right away, but the hot counters
+(Question/Answer.vote_count and the author's CustomUser.reputation) are HINCRBY'd in
+Redis hashes instead of locking those rows. `flush()` (Celery beat, every
+VOTE_FLUSH_INTERVAL seconds) folds the aggregated deltas into the database with one
+UPDATE per entity, and only then bumps the cache namespaces the counter is shown in
+(a vote bumps none). Until then `merge_pending()` adds the deltas to instances before
+they are serialized, so a voter sees their vote counted immediately.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django_redis import get_redis_connection
+
+from Post import ranking, stats
+from Post.models import Question, Answer
+from StackOverflowCopy import async_cache, cache as cache_ns
+from StackOverflowCopy.cache import draining
+from User import profile_cache
+from User.models import CustomUser
+
+# kind -> (model, counter column)
+COUNTERS = {
+    'question': (Question, 'vote_count'),
+    'answer': (Answer, 'vote_count'),
+    'user': (CustomUser, 'reputation'),
+}
+
+# kind -> the cache namespaces its counter is shown in; bumped when the counter is flushed.
+# Reputation is also shown in the authors embedded in question and answer lists.
+NAMESPACES = {
+    'question': (cache_ns.QUESTIONS,),
+    'answer': (cache_ns.ANSWERS,),
+    'user': (cache_ns.USERS, cache_ns.QUESTIONS, cache_ns.ANSWERS),
+}
+
+
+def enabled():
+    return settings.VOTE_WRITE_BEHIND
+
+
+def _key(kind):
+    return f"vote_buffer:{kind}"
+
+
+def _flushing_key(kind):
+    # see StackOverflowCopy.cache.draining
+    return f"{_key(kind)}:flushing"
+
+
+def add(kind, pk, delta):
+    """Buffer `delta` for one entity once the surrounding transaction commits."""
+    transaction.on_commit(lambda: get_redis_connection('default').hincrby(_key(kind), pk, delta))
+
+
+def pending(kind, pks):
+    """{pk: delta} not yet flushed, including a flush that is in progress."""
+    pks = list(pks)
+    if not pks:
+        return {}
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    pipe.hmget(_key(kind), pks)
+    pipe.hmget(_flushing_key(kind), pks)
+    return _deltas(pks, *pipe.execute())
+
+
+async def apending(kind, pks):
+    """pending() for async views."""
+    pks = list(pks)
+    if not pks:
+        return {}
+    pipe = async_cache.client().pipeline(transaction=False)
+    pipe.hmget(_key(kind), pks)
+    pipe.hmget(_flushing_key(kind), pks)
+    return _deltas(pks, *await pipe.execute())
+
+
+def _deltas(pks, buffered, flushing):
+    deltas = {}
+    for pk, value, in_flight in zip(pks, buffered, flushing):
+        delta = int(value or 0) + int(in_flight or 0)
+        if delta:
+            deltas[pk] = delta
+    return deltas
+
+
+def merge_pending(instances):
+    """Add buffered deltas to Question/Answer vote_count, their loaded authors' and users' reputation."""
+    if not enabled() or not instances:
+        return
+    posts = {'question': [], 'answer': []}
+    users = []
+    for instance in instances:
+        if isinstance(instance, CustomUser):
+            users.append(instance)
+            continue
+        posts['question' if isinstance(instance, Question) else 'answer'].append(instance)
+        if type(instance).author.is_cached(instance):
+            users.append(instance.author)
+
+    for kind, objects in posts.items():
+        deltas = pending(kind, {obj.pk for obj in objects})
+        for obj in objects:
+            obj.vote_count += deltas.get(obj.pk, 0)
+    deltas = pending('user', {user.pk for user in users})
+    seen = set()
+    for user in users:
+        # the same author object may appear on several rows of a page
+        if id(user) not in seen:
+            seen.add(id(user))
+            user.reputation += deltas.get(user.pk, 0)
+
+
+def flush():
+    """Fold buffered deltas into the database. Returns the number of entities updated."""
+    updated = 0
+    for kind, (model, field) in COUNTERS.items():
+        with draining(_key(kind)) as deltas:
+            with transaction.atomic():
+                # fixed pk order so concurrent writers cannot deadlock against the flush
+                for pk in sorted(deltas, key=int):
+                    model.objects.filter(pk=pk).update(**{field: F(field) + deltas[pk]})
+                    if kind != 'user':
+                        stats.post_voted(kind, pk, deltas[pk])
+                if kind == 'question':
+                    ranking.touch(deltas)
+                elif kind == 'user':
+                    profile_cache.refresh(deltas)
+                if deltas:
+                    cache_ns.bump_on_commit(*NAMESPACES[kind])
+        updated += len(deltas)
+    return updated
@@ -0,0 +1,102 @@
+"""
+Vote pipeline shared by question_vote and answer_vote.
+
+The vote row, the target's vote_count and the author's reputation are changed in one
+transaction. Counters are moved with database-side increments (UPDATE ... SET
+vote_count = vote_count + n), so concurrent votes never lose updates and only the
+counter column is written. With settings.VOTE_WRITE_BEHIND the counter increments go
+to Post.vote_buffer instead and are flushed in batches.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from Post import ranking, stats, vote_buffer
+from Post.models import Question, Answer, Vote
+from Post.utils import add_reputation
+from StackOverflowCopy import cache as cache_ns
+
+UPVOTE = 'upvote'
+DOWNVOTE = 'downvote'
+VOTE_TYPES = (UPVOTE, DOWNVOTE)
+VOTE_VALUES = {UPVOTE: 1, DOWNVOTE: -1}
+
+# reputation the author gets for one vote of each type
+REPUTATION_POINTS = {
+    'question': {UPVOTE: 10, DOWNVOTE: -10},
+    'answer': {UPVOTE: 20, DOWNVOTE: -20},
+}
+
+
+class AlreadyVoted(Exception):
+    pass
+
+
+def normalize_vote_type(vote_type):
+    """'Upvote'/'upvote' -> 'upvote'; None for anything that is not a vote type."""
+    if isinstance(vote_type, str) and vote_type.lower() in VOTE_TYPES:
+        return vote_type.lower()
+    return None
+
+
+def _kind(target):
+    return 'question' if isinstance(target, Question) else 'answer'
+
+
+def _describe(target, vote_type, old_vote_type):
+    if old_vote_type:
+        action = f"was {old_vote_type}d but now changed to {vote_type}d"
+    else:
+        action = f"{vote_type}d"
+    if isinstance(target, Question):
+        return f"Question {action}:{target.title}"
+    return f"Answer {action} ->:{target.question.title}:{target.content}"
+
+
+def cast_vote(user, target, vote_type):
+    """
+    Record `user`'s `vote_type` on a Question or Answer and apply the tally and
+    reputation changes. Raises AlreadyVoted when the same vote is cast twice.
+    Returns the signed change applied to the target's vote_count.
+    """
+    kind = _kind(target)
+    with transaction.atomic():
+        # the row lock serializes concurrent votes of the same user on the same post;
+        # the partial unique constraints on Vote make the create race-free
+        vote, created = Vote.objects.select_for_update().get_or_create(
+            user=user, **{kind: target}, defaults={'vote_type': vote_type}
+        )
+        if created:
+            old_vote_type = None
+        elif vote.vote_type == vote_type:
+            raise AlreadyVoted()
+        else:
+            old_vote_type = vote.vote_type
+            vote.vote_type = vote_type
+            vote.save(update_fields=['vote_type'])
+
+        delta = VOTE_VALUES[vote_type] - VOTE_VALUES.get(old_vote_type, 0)
+        apply_vote_delta(kind, target.pk, delta)
+
+        if user.pk != target.author_id:
+            points = REPUTATION_POINTS[kind]
+            change = points[vote_type] - points.get(old_vote_type, 0)
+            add_reputation(
+                user_id=target.author_id,
+                rep_type=f"{kind}_{UPVOTE if change > 0 else DOWNVOTE}",
+                change=change,
+                description=_describe(target, vote_type, old_vote_type),
+            )
+    target.refresh_from_db(fields=['vote_count'])
+    return delta
+
+
+def apply_vote_delta(kind, pk, delta):
+    if vote_buffer.enabled():
+        vote_buffer.add(kind, pk, delta)
+        return
+    model = Question if kind == 'question' else Answer
+    model.objects.filter(pk=pk).update(vote_count=F('vote_count') + delta)
+    cache_ns.bump_on_commit(cache_ns.QUESTIONS if kind == 'question' else cache_ns.ANSWERS)
+    stats.post_voted(kind, pk, delta)
+    if kind == 'question':
+        ranking.touch([pk])
@@ -0,0 +1,47 @@
+"""
+Async reads of the Django cache for the async views.
+
+django-redis only has a blocking client, and Django's BaseCache.aget() just runs it in
+a thread. The helpers here read the same entries with redis.asyncio on the event loop:
+keys are built and values decoded by django-redis's own client (`make_key`, `decode`),
+so anything written by the sync code reads back unchanged. One connection pool per
+event loop.
+"""
+import asyncio
+import weakref
+
+import redis.asyncio
+from django.conf import settings
+from django.core.cache import cache
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def _connect():
+    return redis.asyncio.Redis.from_url(settings.CACHES['default']['LOCATION'])
+
+
+def client():
+    """The redis.asyncio client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    conn = _clients.get(loop)
+    if conn is None:
+        conn = _clients[loop] = _connect()
+    return conn
+
+
+def _decode(value):
+    return None if value is None else cache.client.decode(value)
+
+
+async def aget(key):
+    return _decode(await client().get(cache.client.make_key(key)))
+
+
+async def aget_many(keys):
+    """[value or None for key in keys]"""
+    if not keys:
+        return []
+    values = await client().mget([cache.client.make_key(key) for key in keys])
+    return [_decode(value) for value in values]
+
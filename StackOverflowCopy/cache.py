@@ -0,0 +1,418 @@
+"""
+Versioned cache namespaces.
+
+List caches depend on one or more namespaces (questions, answers, tags, users).
+Each namespace has a version number stored in the cache, and every list cache key
+embeds the current versions of the namespaces it depends on. A write only has to
+bump the affected namespaces: all keys built from the old version are never read
+again and simply expire on their own TTL, so there is no SCAN/DELETE on write.
+"""
+import functools
+import gzip
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+from rest_framework import status
+from rest_framework.response import Response
+
+from StackOverflowCopy import async_cache, http, warmer
+from StackOverflowCopy.renderers import FastJSONRenderer
+
+QUESTIONS = 'questions'
+ANSWERS = 'answers'
+TAGS = 'tags'
+USERS = 'users'
+
+# cached_computation: XFetch refreshes a value early with a probability that grows as
+# expiry nears and with how long the value took to compute; a larger beta refreshes earlier.
+XFETCH_BETA = 1.0
+RECOMPUTE_LOCK_TIMEOUT = 30
+RECOMPUTE_WAIT = 5
+RECOMPUTE_POLL_INTERVAL = 0.05
+
+# cache_response(raw=True) also stores a gzipped body for responses at least this large
+RAW_GZIP_MIN_SIZE = 1024
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def _version_key(namespace):
+    return f"ns_version:{namespace}"
+
+
+def _initial_version():
+    # A missing version (first use or evicted) starts from the clock instead of 1,
+    # so keys written under an earlier lifetime of the namespace are never reused.
+    return int(time.time() * 1000)
+
+
+def get_versions(namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*namespaces):
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), timeout=None)
+
+
+def bump_on_commit(*namespaces):
+    """
+    Bump after the surrounding transaction commits, so a reader can never cache
+    uncommitted state under the new version.
+    """
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+def _key_for_versions(prefix, versions, params=None):
+    versions = '.'.join(str(version) for version in versions)
+    key_raw = json.dumps(params or {}, sort_keys=True)
+    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
+    return f"{prefix}:{versions}:{key_hash}"
+
+
+def versioned_key(prefix, namespaces, params=None):
+    return _key_for_versions(prefix, get_versions(namespaces), params)
+
+
+async def aget_versions(namespaces):
+    """get_versions() on the event loop; None when a version is not set yet."""
+    versions = await async_cache.aget_many([_version_key(namespace) for namespace in namespaces])
+    return None if None in versions else versions
+
+
+@contextmanager
+def draining(key):
+    """
+    Move the Redis hash `key` aside and yield its contents as {field: int}.
+
+    New increments keep landing in a fresh `key` while the caller applies the drained
+    ones. The moved copy is only deleted when the block succeeds, so a failed flush is
+    picked up again by the next one. Concurrent drains of the same key yield {}.
+    """
+    conn = get_redis_connection('default')
+    flushing_key = f"{key}:flushing"
+    lock = conn.lock(f"{key}:lock", timeout=60, blocking_timeout=0)
+    if not lock.acquire():
+        yield {}
+        return
+    try:
+        if not conn.exists(flushing_key):
+            try:
+                conn.rename(key, flushing_key)
+            except ResponseError:
+                # nothing buffered
+                yield {}
+                return
+        values = {field.decode(): int(value) for field, value in conn.hgetall(flushing_key).items()}
+        yield {field: value for field, value in values.items() if value}
+        conn.delete(flushing_key)
+    finally:
+        lock.release()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _single_flight(key, fn):
+    """Run fn() once per key in this process; concurrent callers wait for and share its result."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+    try:
+        flight.value = fn()
+        return flight.value
+    except Exception as error:
+        flight.error = error
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def store(key, value, timeout, delta=0.0):
+    """Cache `value` in the envelope cached_computation reads; `delta` is what it cost to compute."""
+    envelope = (value, delta, time.time() + timeout)
+    cache.set(key, envelope, timeout=timeout)
+    return envelope
+
+
+def _is_fresh(envelope):
+    _, delta, expiry = envelope
+    # -log(u) for u in (0, 1] is an exponential sample: usually small, occasionally large
+    return time.time() - delta * XFETCH_BETA * math.log(1.0 - random.random()) < expiry
+
+
+def _recompute(key, compute, timeout, stale):
+    lock_key = f"{key}:recompute"
+    if not cache.add(lock_key, 1, timeout=RECOMPUTE_LOCK_TIMEOUT):
+        if stale is not None:
+            # another worker is already refreshing early; keep serving the current value
+            return stale
+        deadline = time.monotonic() + RECOMPUTE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(RECOMPUTE_POLL_INTERVAL)
+            # the holder caches its value before releasing the lock, so the lock is read first
+            released = cache.get(lock_key) is None
+            envelope = cache.get(key)
+            if envelope is not None:
+                return envelope
+            if released:
+                # the holder finished without caching anything (e.g. a 404)
+                break
+        lock_key = None
+    else:
+        # the previous holder may have cached a value and released the lock since our read
+        envelope = cache.get(key)
+        if type(envelope) is tuple and (stale is None or envelope[2] != stale[2]):
+            cache.delete(lock_key)
+            return envelope
+    try:
+        start = time.monotonic()
+        value = compute()
+        if value is None:
+            return None
+        return store(key, value, timeout, time.monotonic() - start)
+    finally:
+        if lock_key is not None:
+            cache.delete(lock_key)
+
+
+def cached_envelope(key, compute, timeout):
+    """cached_computation, returning the whole (value, delta, expiry) envelope or None."""
+    envelope = cache.get(key)
+    if type(envelope) is not tuple:
+        # miss, or a value cached before envelopes were used
+        envelope = None
+    elif _is_fresh(envelope):
+        return envelope
+    return _single_flight(key, lambda: _recompute(key, compute, timeout, envelope))
+
+
+def cached_computation(key, compute, timeout):
+    """
+    cache.get(key), falling back to compute() and caching its result for `timeout`
+    seconds; a None result is returned but not cached.
+
+    A miss is recomputed once: concurrent callers in this process share one compute()
+    call, and across processes only the worker holding `<key>:recompute` computes while
+    the others wait for its result. Hits are refreshed early (XFetch), so a hot key is
+    usually recomputed by one worker before it expires instead of by all of them after.
+    """
+    envelope = cached_envelope(key, compute, timeout)
+    return envelope[0] if envelope is not None else None
+
+
+def response_cache_key(prefix, namespaces=(), params=None, kwargs=None):
+    """
+    Key of a cached response: `prefix`, the URL kwargs and the namespace versions, plus a
+    hash of the query params that are set (None and [] are the same as absent; an empty
+    `?cursor=` is not).
+    """
+    return _response_key(prefix, get_versions(namespaces), params, kwargs)
+
+
+def _response_key(prefix, versions, params, kwargs):
+    parts = [prefix] + [f"{name}={value}" for name, value in sorted((kwargs or {}).items())]
+    params = {name: value for name, value in (params or {}).items() if value is not None and value != []}
+    return _key_for_versions(':'.join(parts), versions, params)
+
+
+def render_json(data):
+    """(body, gzipped body or None): `data` encoded once, the way the JSON renderer sends it."""
+    body = FastJSONRenderer().render(data)
+    compressed = gzip.compress(body, mtime=0) if len(body) >= RAW_GZIP_MIN_SIZE else None
+    return body, compressed
+
+
+def _gzipped(request, rendered):
+    """Whether the raw response to `request` is sent gzipped."""
+    return rendered[1] is not None and bool(ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def _raw_etag(request, key, envelope):
+    etag = http.make_etag(key, envelope[2])
+    if _gzipped(request, envelope[0]):
+        # the gzipped body is a representation of its own and a strong ETag must tell it apart
+        etag = f'{etag[:-1]}-gzip"'
+    return etag
+
+
+def _raw_response(request, rendered):
+    body, compressed = rendered
+    if _gzipped(request, rendered):
+        response = HttpResponse(compressed, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def raw_cache_prefix(prefix):
+    # raw entries hold bytes, so they never share a key with the data entries
+    return f"{prefix}.json"
+
+
+def _param_values(query_params, allowed):
+    values = {}
+    for name, default in allowed.items():
+        if isinstance(default, list):
+            values[name] = sorted(query_params.getlist(name)) or default
+        else:
+            values[name] = query_params.get(name, default)
+    return values
+
+
+# prefix -> (namespaces, params) of every raw cache_response view, for async_cached
+_raw_views = {}
+
+
+def cache_response(prefix, namespaces=(), params=None, timeout=None, vary_on_user=False, raw=False):
+    """
+    Cache the 200 responses of a function-based GET view; goes under @api_view.
+
+    `params` maps every query param that changes the response to its default (a list
+    default reads the param with getlist). Other params are ignored for the key, so
+    `?page=1` and no page share an entry. `timeout` defaults to LIST_CACHE_TIMEOUT and
+    may be a callable taking the params; `vary_on_user` keys the entry on the caller.
+    Other methods and non-200 responses pass through uncached.
+
+    The ETag of a cached response identifies the cache entry (key and expiry), so a
+    matching If-None-Match gets a 304 straight from the cache (StackOverflowCopy.http).
+    A gzipped raw body has its own ETag, the identity one with a `-gzip` suffix.
+
+    With `raw`, JSON responses are cached as the encoded body (see render_json) and hits
+    are sent as a plain HttpResponse, skipping unpickling nested data and DRF rendering.
+    Other formats (the browsable API) keep using the data entries.
+
+    GETs of views that do not vary on the user are sampled for the cache warmer
+    (StackOverflowCopy/warmer.py), which keeps the most requested entries filled.
+    """
+    allowed = params or {}
+    if raw and not vary_on_user:
+        _raw_views[prefix] = (namespaces, allowed)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            values = _param_values(request.query_params, allowed)
+            key_kwargs = dict(kwargs)
+            if vary_on_user:
+                key_kwargs['user'] = request.user.pk if request.user.is_authenticated else 'anon'
+            else:
+                warmer.record(request, prefix, values)
+            raw_json = raw and request.accepted_renderer.format == 'json'
+            key_prefix = raw_cache_prefix(prefix) if raw_json else prefix
+            key = response_cache_key(key_prefix, namespaces, values, key_kwargs)
+            if callable(timeout):
+                ttl = timeout(values)
+            else:
+                ttl = timeout or settings.LIST_CACHE_TIMEOUT
+
+            uncached = {}
+
+            def compute():
+                response = view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    uncached['response'] = response
+                    return None
+                return render_json(response.data) if raw_json else response.data
+
+            envelope = cached_envelope(key, compute, ttl)
+            if envelope is None:
+                # computed by another thread of this process: run the view for our own response
+                return uncached.get('response') or view(request, *args, **kwargs)
+            etag = _raw_etag(request, key, envelope) if raw_json else http.make_etag(key, envelope[2])
+            if http.etag_matches(request, etag):
+                return http.not_modified(request, etag)
+            if raw_json:
+                response = _raw_response(request, envelope[0])
+            else:
+                response = Response(envelope[0], status=status.HTTP_200_OK)
+            return http.add_validators(request, response, etag)
+        return wrapper
+    return decorator
+
+
+def async_cached(prefix, view):
+    """
+    Async front for the raw cache_response view `prefix` (the sync `view`), for ASGI.
+
+    A JSON GET whose entry is cached and fresh is answered from Redis on the event loop,
+    without a thread or a database connection, provided the caller is anonymous or their
+    token is cached (User/authentication.py). Everything else, including misses and
+    entries due for an early refresh, runs `view` in a thread as before.
+    """
+    from User.authentication import acached_user
+
+    namespaces, allowed = _raw_views[prefix]
+    sync_view = sync_to_async(view)
+
+    async def cached(request, kwargs):
+        if request.method != 'GET' or not http.wants_json(request):
+            return None
+        user = await acached_user(request)
+        versions = await aget_versions(namespaces)
+        if user is None or versions is None:
+            return None
+        values = _param_values(request.GET, allowed)
+        key = _response_key(raw_cache_prefix(prefix), versions, values, kwargs)
+        envelope = await async_cache.aget(key)
+        if type(envelope) is not tuple or not _is_fresh(envelope):
+            return None
+        request.user = user
+        await warmer.arecord(request, prefix, values)
+        etag = _raw_etag(request, key, envelope)
+        if http.etag_matches(request, etag):
+            return http.not_modified(request, etag)
+        return http.add_validators(request, _raw_response(request, envelope[0]), etag)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        response = await cached(request, kwargs)
+        if response is None:
+            response = await sync_view(request, *args, **kwargs)
+        return response
+    return wrapper
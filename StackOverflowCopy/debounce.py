@@ -0,0 +1,35 @@
+"""
+Debounced Celery tasks for cache refreshes.
+
+`schedule(task, *args)` queues task(*args) to run CACHE_REFRESH_DEBOUNCE seconds later
+unless the same call is already pending, so a burst of signups or posts costs one
+rebuild per window instead of one per write. The pending flag is a cache.add key; the
+task calls `started(task, *args)` first thing, so a write that lands while it runs
+queues one more run rather than being missed.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# the flag outlives the countdown by this much, in case the task is lost or runs late
+FLAG_GRACE = 60
+
+
+def _flag_key(task, args):
+    return ':'.join(['debounce', task.name, *(str(arg) for arg in args)])
+
+
+def _schedule(task, args, window):
+    if cache.add(_flag_key(task, args), 1, timeout=window + FLAG_GRACE):
+        task.apply_async(args, countdown=window)
+
+
+def schedule(task, *args, window=None):
+    """Run task(*args) once, `window` seconds after the surrounding transaction commits."""
+    window = settings.CACHE_REFRESH_DEBOUNCE if window is None else window
+    transaction.on_commit(lambda: _schedule(task, args, window))
+
+
+def started(task, *args):
+    """Clear the pending flag of task(*args); call it before the task reads anything."""
+    cache.delete(_flag_key(task, args))
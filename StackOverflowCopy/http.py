@@ -0,0 +1,87 @@
+"""
+HTTP caching for read endpoints: ETag validators, 304 Not Modified and Cache-Control.
+
+Views cached with StackOverflowCopy.cache.cache_response get their ETag from the cache
+entry. Other GET views use @conditional with a cheap etag function (one small query on
+the row the response is built from), so a client revalidating an unchanged resource
+gets a 304 without the view or its serializer running.
+
+Anonymous responses are `public` with `s-maxage=EDGE_CACHE_MAX_AGE` so a reverse proxy
+can serve them; authenticated ones are `private, no-cache`.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+
+
+def wants_json(request):
+    """Whether DRF would answer `request` with the JSON renderer (not the browsable API)."""
+    if request.GET.get('format', 'json') != 'json':
+        return False
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return 'text/html' not in accept
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison
+    candidates = {tag.removeprefix('W/') for tag in parse_etags(header)}
+    return '*' in candidates or etag.removeprefix('W/') in candidates
+
+
+def patch_caching(request, response):
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=0, s_maxage=settings.EDGE_CACHE_MAX_AGE)
+    # DRF adds Accept itself; plain responses from the async views need it too
+    patch_vary_headers(response, ['Accept', 'Authorization'])
+    return response
+
+
+def add_validators(request, response, etag):
+    if response.status_code == status.HTTP_200_OK:
+        response['ETag'] = etag
+        patch_caching(request, response)
+    return response
+
+
+def not_modified(request, etag):
+    # a plain response, so async views can return it too
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return patch_caching(request, response)
+
+
+def conditional(etag_func):
+    """
+    ETag / If-None-Match for a function-based GET view; goes under @api_view.
+
+    etag_func(request, *args, **kwargs) returns the validator parts for the resource, or
+    None when it does not exist (the view then runs and answers 404 itself).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            parts = etag_func(request, *args, **kwargs)
+            if parts is None:
+                return view(request, *args, **kwargs)
+            etag = make_etag(*parts)
+            if etag_matches(request, etag):
+                return not_modified(request, etag)
+            return add_validators(request, view(request, *args, **kwargs), etag)
+        return wrapper
+    return decorator
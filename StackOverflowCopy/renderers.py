@@ -0,0 +1,81 @@
+"""
+JSON renderer and parser with a pluggable encoding backend (settings.JSON_BACKEND).
+
+With 'orjson' (the default, when the package is installed) responses are encoded by
+orjson the way DRF's JSONRenderer encodes them with this project's settings: UTF-8,
+compact separators, U+2028/U+2029 escaped, and anything orjson does not encode the same
+way (datetimes, Decimals, lazy strings, querysets...) handed to DRF's JSONEncoder.
+Indented output (`Accept: application/json; indent=4`) and anything orjson rejects go
+through the stdlib renderer. With 'stdlib', or without orjson, both classes behave
+exactly like DRF's.
+
+The bytes are the same except for some floats. orjson switches to an exponent at
+other magnitudes and writes it without sign or padding (1e-05 as 0.00001, 1e+16 as
+1e16); the values parse back the same. NaN and infinities become null, where DRF
+(STRICT_JSON) raises ValueError. The only float in the API is the search rank of
+QuestionSearchSerializer. Post.benchmarks compares the bytes on the serializers' real
+payloads.
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    return _encoder.default(obj)
+
+
+def fast_backend():
+    """The orjson module when it is configured and installed, else None."""
+    if settings.JSON_BACKEND == 'orjson':
+        return orjson
+    return None
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        backend = fast_backend()
+        if (data is None or backend is None
+                or self.get_indent(accepted_media_type, renderer_context or {})
+                or not (self.compact and self.ensure_ascii is False and self.strict)):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = backend.dumps(
+                data,
+                default=_default,
+                option=backend.OPT_PASSTHROUGH_DATETIME | backend.OPT_NON_STR_KEYS,
+            )
+        except TypeError:
+            # e.g. integers above 64 bits; let the stdlib have it
+            return super().render(data, accepted_media_type, renderer_context)
+        # same as JSONRenderer: these are valid JSON but not valid JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        backend = fast_backend()
+        if backend is None:
+            return super().parse(stream, media_type, parser_context)
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            # orjson rejects NaN/Infinity, as STRICT_JSON does
+            return backend.loads(body)
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
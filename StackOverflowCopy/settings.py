@@ -1,4 +1,5 @@
 import os
+import tempfile
 import dj_database_url
 from pathlib import Path
 from dotenv import load_dotenv
@@ -18,6 +19,27 @@ DEFAULT_AVATAR_PATH = os.getenv('DEFAULT_AVATAR_PATH')
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
+
+# Avatar uploads are staged in AVATAR_STAGING_DIR, which the web and worker processes must
+# share, and processed by User.tasks.process_avatar on the `media` queue (User/avatars.py)
+# into one square WebP per AVATAR_SIZES, rendered by a pool of AVATAR_PROCESSES processes
+# (0: one per CPU). AVATAR_STORAGE is 'supabase' or 'local' (files under MEDIA_ROOT).
+AVATAR_STORAGE = os.getenv('AVATAR_STORAGE', 'supabase')
+AVATAR_STAGING_DIR = os.getenv('AVATAR_STAGING_DIR', os.path.join(tempfile.gettempdir(), 'avatar_staging'))
+AVATAR_SIZES = [int(size) for size in os.getenv('AVATAR_SIZES', '32,64,128,256').split(',')]
+AVATAR_WEBP_QUALITY = int(os.getenv('AVATAR_WEBP_QUALITY', 80))
+AVATAR_PROCESSES = int(os.getenv('AVATAR_PROCESSES', 0)) or None
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+MEDIA_URL = '/media/'
+
+# Object storage clients (User/supabase_client.py): one pooled keep-alive HTTP session and
+# one S3 client per process. Failed requests are retried STORAGE_RETRIES times with
+# exponential backoff (STORAGE_RETRY_BACKOFF seconds, doubling).
+STORAGE_CONNECT_TIMEOUT = float(os.getenv('STORAGE_CONNECT_TIMEOUT', 5))
+STORAGE_READ_TIMEOUT = float(os.getenv('STORAGE_READ_TIMEOUT', 30))
+STORAGE_RETRIES = int(os.getenv('STORAGE_RETRIES', 3))
+STORAGE_RETRY_BACKOFF = float(os.getenv('STORAGE_RETRY_BACKOFF', 0.5))
+STORAGE_POOL_SIZE = int(os.getenv('STORAGE_POOL_SIZE', 10))
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -65,12 +87,23 @@ CORS_ALLOW_CREDENTIALS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'User.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'StackOverflowCopy.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'StackOverflowCopy.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
+# JSON encoding/decoding backend of the REST API: 'orjson' (used when installed) or 'stdlib'.
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson')
 CACHES = {
     'default': {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -81,10 +114,102 @@ CACHES = {
     }
 }
 
+# List caches are invalidated by namespace version bumps (StackOverflowCopy/cache.py),
+# so their TTL only bounds memory, not staleness.
+LIST_CACHE_TIMEOUT = int(os.getenv('LIST_CACHE_TIMEOUT', 60 * 60 * 6))
+# Optional totals of keyset-paginated lists (?with_count=true) are cached this long.
+PAGINATION_COUNT_TIMEOUT = int(os.getenv('PAGINATION_COUNT_TIMEOUT', 300))
+
+# Question search backend: 'postgres' (tsvector + GIN) or 'python' (in-process inverted index).
+# Unset picks 'postgres' on PostgreSQL and 'python' elsewhere.
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND')
+# The 'python' backend returns only this many best matches.
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 500))
+
+# TagStats.questions_this_week/month are recomputed every TAG_WINDOW_REFRESH_INTERVAL seconds (Post/stats.py).
+TAG_WINDOW_REFRESH_INTERVAL = float(os.getenv('TAG_WINDOW_REFRESH_INTERVAL', 3600))
+
+# CustomUser.top_tags is refilled from UserTagStats every TOP_TAGS_REFRESH_INTERVAL seconds.
+TOP_TAGS_REFRESH_INTERVAL = float(os.getenv('TOP_TAGS_REFRESH_INTERVAL', 6 * 3600))
+
+# Anonymous GET responses are marked `public, s-maxage=EDGE_CACHE_MAX_AGE` for a reverse proxy (StackOverflowCopy/http.py).
+EDGE_CACHE_MAX_AGE = int(os.getenv('EDGE_CACHE_MAX_AGE', 60))
+
+# User profile entries (User/profile_cache.py) are written through on every change;
+# the TTL only bounds memory.
+USER_CACHE_TIMEOUT = int(os.getenv('USER_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# API tokens resolve to their user from an in-process LRU (TOKEN_LOCAL_CACHE_SIZE entries,
+# TOKEN_LOCAL_CACHE_TIMEOUT seconds), then the cache (TOKEN_CACHE_TIMEOUT), then the
+# database (User/authentication.py).
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 5 * 60))
+TOKEN_LOCAL_CACHE_TIMEOUT = float(os.getenv('TOKEN_LOCAL_CACHE_TIMEOUT', 10))
+TOKEN_LOCAL_CACHE_SIZE = int(os.getenv('TOKEN_LOCAL_CACHE_SIZE', 1024))
+
+# Cache refresh tasks queued by writes run CACHE_REFRESH_DEBOUNCE seconds later, once per
+# burst of writes (StackOverflowCopy/debounce.py).
+CACHE_REFRESH_DEBOUNCE = float(os.getenv('CACHE_REFRESH_DEBOUNCE', 5))
+
+# The WARM_TOP_N most requested pages of each cached list (sampled at WARM_SAMPLE_RATE) are
+# re-rendered after writes and every WARM_INTERVAL seconds (StackOverflowCopy/warmer.py).
+WARM_SAMPLE_RATE = float(os.getenv('WARM_SAMPLE_RATE', 0.1))
+WARM_TOP_N = int(os.getenv('WARM_TOP_N', 20))
+WARM_INTERVAL = float(os.getenv('WARM_INTERVAL', 5 * 60))
+
+# sort_by=hot rankings live in Redis sorted sets, fully recomputed every HOT_RESCORE_INTERVAL
+# seconds (Post/ranking.py); a cached hot page lives as long.
+HOT_RESCORE_INTERVAL = int(os.getenv('HOT_RESCORE_INTERVAL', 10 * 60))
+
+# Buffer vote_count / reputation increments in Redis and flush them every
+# VOTE_FLUSH_INTERVAL seconds instead of updating the rows on every vote (Post/vote_buffer.py).
+VOTE_WRITE_BEHIND = os.getenv('VOTE_WRITE_BEHIND', '').lower() in ('1', 'true')
+VOTE_FLUSH_INTERVAL = float(os.getenv('VOTE_FLUSH_INTERVAL', 5))
+
+# Question views are deduplicated per viewer within VIEW_DEDUP_WINDOW seconds in Redis
+# and folded into Question.view_count every VIEW_FLUSH_INTERVAL seconds (Post/view_counter.py).
+VIEW_TRACKING_ENABLED = os.getenv('VIEW_TRACKING_ENABLED', 'true').lower() in ('1', 'true')
+VIEW_DEDUP_WINDOW = int(os.getenv('VIEW_DEDUP_WINDOW', 60 * 60))
+VIEW_FLUSH_INTERVAL = float(os.getenv('VIEW_FLUSH_INTERVAL', 60))
+
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
 CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+# the media queue has its own worker (Procfile): a solo pool, so that avatar processing
+# can start its process pool (prefork children are not allowed child processes)
+CELERY_TASK_ROUTES = {
+    'User.tasks.process_avatar': {'queue': 'media'},
+}
+# run by the single `beat` process of the Procfile; without it the buffered votes and
+# view counts never reach the database
+CELERY_BEAT_SCHEDULE = {
+    'refresh-tag-windows': {
+        'task': 'Post.tasks.refresh_tag_windows',
+        'schedule': TAG_WINDOW_REFRESH_INTERVAL,
+    },
+    'rebuild-top-tags': {
+        'task': 'User.tasks.rebuild_top_tags',
+        'schedule': TOP_TAGS_REFRESH_INTERVAL,
+    },
+    'rescore-hot-questions': {
+        'task': 'Post.tasks.rescore_hot_questions',
+        'schedule': HOT_RESCORE_INTERVAL,
+    },
+    'warm-caches': {
+        'task': 'Post.tasks.warm_caches',
+        'schedule': WARM_INTERVAL,
+    },
+}
+if VIEW_TRACKING_ENABLED:
+    CELERY_BEAT_SCHEDULE['flush-question-views'] = {
+        'task': 'Post.tasks.flush_question_views',
+        'schedule': VIEW_FLUSH_INTERVAL,
+    }
+if VOTE_WRITE_BEHIND:
+    CELERY_BEAT_SCHEDULE['flush-vote-buffer'] = {
+        'task': 'Post.tasks.flush_vote_buffer',
+        'schedule': VOTE_FLUSH_INTERVAL,
+    }
 
 ROOT_URLCONF = 'StackOverflowCopy.urls'
 
@@ -111,10 +236,34 @@ WSGI_APPLICATION = 'StackOverflowCopy.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Connections to the remote Postgres are reused instead of opened (TCP + TLS) per request.
+# DATABASE_POOL (the default) keeps a psycopg 3 connection pool per process, the mode that
+# works under ASGI, where Django's persistent connections are per-thread and not reused
+# across requests. Without the pool, DATABASE_CONN_MAX_AGE seconds of persistent
+# connections (0: one per request) is the option for WSGI deployments. Both check a
+# reused connection before handing it out when DATABASE_CONN_HEALTH_CHECKS is set.
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'true').lower() in ('1', 'true', 'yes')
+DATABASE_CONN_HEALTH_CHECKS = os.getenv('DATABASE_CONN_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes')
+
 DATABASES = {
-    'default': dj_database_url.config(default=os.environ.get("SUPABASE_DATABASE_URL"))
+    'default': dj_database_url.config(
+        default=os.environ.get("SUPABASE_DATABASE_URL"),
+        # Django refuses a pool together with persistent connections
+        conn_max_age=0 if DATABASE_POOL else int(os.getenv('DATABASE_CONN_MAX_AGE', 0)),
+        conn_health_checks=DATABASE_CONN_HEALTH_CHECKS,
+    )
 }
 
+if DATABASE_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # needs psycopg 3 with its pool (psycopg[pool]); Django picks it over psycopg2, and
+    # passes the pool ConnectionPool.check_connection itself when CONN_HEALTH_CHECKS is set
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 1)),
+        'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', 10)),
+        # seconds a request waits for a free connection before failing
+        'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -0,0 +1,130 @@
+"""
+Traffic-driven cache warming for the views cached with cache_response.
+
+`record()` samples GET requests (WARM_SAMPLE_RATE) into one Redis sorted set per cache
+prefix, `warm:hits:<prefix>`, scored by hit count. The member is the request URL with its
+query params normalized the way the cache key is, so `?page=1` and no page are one entry.
+
+`warm()` takes the WARM_TOP_N most requested URLs of each prefix and re-requests them
+through the real views (RequestFactory + resolve), split into chunks handled by
+Post.tasks.warm_cache_urls on whichever workers are free. A URL whose entry is still
+cached is a cheap hit; one invalidated by a namespace bump is recomputed before a user
+asks for it. It runs after writes that invalidate the lists and from Celery beat every
+WARM_INTERVAL seconds, which also decays the scores (`decay()`) so pages that stopped
+being requested drop out.
+
+Views that vary on the user are not recorded: their entries are per caller.
+"""
+import logging
+import random
+from inspect import iscoroutinefunction
+from urllib.parse import urlencode, urlsplit
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import RequestFactory
+from django.urls import resolve
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from StackOverflowCopy import async_cache
+
+logger = logging.getLogger(__name__)
+
+PREFIXES_KEY = 'warm:prefixes'
+# members kept per prefix beyond the warmed ones, so a page can climb into the top N
+TRACKED_PER_PREFIX = 1000
+# scores are multiplied by this on every beat run
+DECAY = 0.5
+CHUNK_SIZE = 10
+
+
+def _hits_key(prefix):
+    return f"warm:hits:{prefix}"
+
+
+def record(request, prefix, values):
+    """Count a sampled GET of a cache_response view; never fails the request it is called from."""
+    if _sampled(request):
+        try:
+            _count_hit(get_redis_connection('default').pipeline(transaction=False), request, prefix, values).execute()
+        except RedisError:
+            logger.warning("could not record cache hit for %s", prefix, exc_info=True)
+
+
+async def arecord(request, prefix, values):
+    """record() for async views."""
+    if _sampled(request):
+        try:
+            await _count_hit(async_cache.client().pipeline(transaction=False), request, prefix, values).execute()
+        except RedisError:
+            logger.warning("could not record cache hit for %s", prefix, exc_info=True)
+
+
+def _sampled(request):
+    return not getattr(request, 'cache_warming', False) and random.random() < settings.WARM_SAMPLE_RATE
+
+
+def _count_hit(pipe, request, prefix, values):
+    query = sorted(
+        (name, value) for name, value in values.items() if value is not None and value != []
+    )
+    url = request.build_absolute_uri(request.path)
+    if query:
+        url = f"{url}?{urlencode(query, doseq=True)}"
+    pipe.zincrby(_hits_key(prefix), 1, url)
+    pipe.sadd(PREFIXES_KEY, prefix)
+    return pipe
+
+
+def top_urls(prefixes=None, limit=None):
+    """The `limit` (WARM_TOP_N) most requested URLs of each of `prefixes` (default: all recorded)."""
+    conn = get_redis_connection('default')
+    if prefixes is None:
+        prefixes = sorted(prefix.decode() for prefix in conn.smembers(PREFIXES_KEY))
+    limit = limit or settings.WARM_TOP_N
+    pipe = conn.pipeline(transaction=False)
+    for prefix in prefixes:
+        pipe.zrevrange(_hits_key(prefix), 0, limit - 1)
+    return [url.decode() for urls in pipe.execute() for url in urls]
+
+
+def decay():
+    """Age the recorded scores and drop the members beyond TRACKED_PER_PREFIX of each prefix."""
+    conn = get_redis_connection('default')
+    for prefix in conn.smembers(PREFIXES_KEY):
+        key = _hits_key(prefix.decode())
+        pipe = conn.pipeline(transaction=False)
+        pipe.zunionstore(key, {key: DECAY})
+        pipe.zremrangebyrank(key, 0, -TRACKED_PER_PREFIX - 1)
+        pipe.execute()
+
+
+def warm(prefixes=None, limit=None):
+    """Queue warm_cache_urls for the top URLs of `prefixes`, CHUNK_SIZE URLs per task."""
+    from Post.tasks import warm_cache_urls
+
+    try:
+        urls = top_urls(prefixes, limit)
+    except RedisError:
+        logger.warning("could not read the most requested URLs", exc_info=True)
+        return 0
+    for start in range(0, len(urls), CHUNK_SIZE):
+        warm_cache_urls.delay(urls[start:start + CHUNK_SIZE])
+    return len(urls)
+
+
+def warm_url(url):
+    """GET `url` anonymously through its view, which fills its cache entry if it is missing."""
+    parts = urlsplit(url)
+    request = RequestFactory().get(
+        f"{parts.path}?{parts.query}", HTTP_HOST=parts.netloc, HTTP_ACCEPT='application/json',
+        secure=parts.scheme == 'https',
+    )
+    # not a user request: keep it out of the hit counts
+    request.cache_warming = True
+    match = resolve(parts.path)
+    view = match.func
+    if iscoroutinefunction(view):
+        view = async_to_sync(view)
+    return view(request, *match.args, **match.kwargs).status_code
@@ -0,0 +1,129 @@
+"""
+Token authentication with the token lookup cached.
+
+DRF's TokenAuthentication joins Token and CustomUser on every authenticated request.
+CachedTokenAuthentication resolves a token to its user id from a small in-process LRU
+(TOKEN_LOCAL_CACHE_TIMEOUT seconds), then the cache (TOKEN_CACHE_TIMEOUT), and only
+then the database. Only the id of an active user is cached: request.user is a
+CustomUser with every other field deferred, loaded on first access, and the views
+only ever use its id.
+
+Deleting a token (logout) or saving its user drops the cached entry (User/signals.py);
+entries in the LRU of other processes run out within TOKEN_LOCAL_CACHE_TIMEOUT.
+
+`acached_user()` resolves the caller the same way for the async views, from the LRU and
+the cache only.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from StackOverflowCopy import async_cache
+from User.models import CustomUser
+
+
+class _LocalCache:
+    """Thread-safe LRU of cache key -> user id with a per-entry expiry."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user_id, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return user_id
+
+    def set(self, key, user_id, timeout):
+        with self.lock:
+            self.entries[key] = (user_id, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+_local = _LocalCache(settings.TOKEN_LOCAL_CACHE_SIZE)
+
+
+def _cache_key(token_key):
+    # the token itself never appears in a cache key
+    return 'auth_token:' + hashlib.sha256(token_key.encode()).hexdigest()
+
+
+def forget(token_keys):
+    """Drop the cached lookups of `token_keys` (this process's LRU and the shared cache)."""
+    keys = [_cache_key(token_key) for token_key in token_keys]
+    if keys:
+        cache.delete_many(keys)
+        for key in keys:
+            _local.delete(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        cache_key = _cache_key(key)
+        user_id = _local.get(cache_key)
+        if user_id is None:
+            user_id = cache.get(cache_key)
+            if user_id is None:
+                # raises AuthenticationFailed for unknown tokens and inactive users
+                user, token = super().authenticate_credentials(key)
+                cache.set(cache_key, user.pk, timeout=settings.TOKEN_CACHE_TIMEOUT)
+                _local.set(cache_key, user.pk, settings.TOKEN_LOCAL_CACHE_TIMEOUT)
+                return user, token
+            _local.set(cache_key, user_id, settings.TOKEN_LOCAL_CACHE_TIMEOUT)
+        return _cached_credentials(key, user_id)
+
+
+def _cached_user(user_id):
+    return CustomUser.from_db(DEFAULT_DB_ALIAS, ['id', 'is_active'], [user_id, True])
+
+
+def _cached_credentials(key, user_id):
+    token = Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id'], [key, user_id])
+    token.user = _cached_user(user_id)
+    return token.user, token
+
+
+async def acached_user(request):
+    """
+    request.user as CachedTokenAuthentication would resolve it, for async views, from the
+    LRU and the cache only: None when the token would need the database (or is malformed).
+    """
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != CachedTokenAuthentication.keyword.lower().encode():
+        return AnonymousUser()
+    if len(auth) != 2:
+        return None
+    try:
+        cache_key = _cache_key(auth[1].decode())
+    except UnicodeError:
+        return None
+    user_id = _local.get(cache_key)
+    if user_id is None:
+        user_id = await async_cache.aget(cache_key)
+        if user_id is None:
+            return None
+        _local.set(cache_key, user_id, settings.TOKEN_LOCAL_CACHE_TIMEOUT)
+    return _cached_user(user_id)
@@ -0,0 +1,185 @@
+"""
+Avatar uploads, processed off the request path.
+
+The PATCH rejects files that are not images (`is_image()`). `stage()` streams the upload
+into AVATAR_STAGING_DIR and, once the request's transaction commits, queues
+User.tasks.process_avatar on the `media` Celery queue; the PATCH answers right away.
+`process()` then validates the image and renders one square WebP variant per
+AVATAR_SIZES (User/imaging.py, EXIF and other metadata dropped) in a process pool, hands
+them to the storage backend and swaps CustomUser.avatar_variants and avatar_url (the
+largest variant) with a save(), so the profile cache and the list namespaces follow.
+The original upload is never served. When a user uploads twice in a row only the last
+upload is applied.
+
+The staging directory must be shared by the web and worker processes.
+
+Storage backends (settings.AVATAR_STORAGE):
+- SupabaseAvatarStorage uploads to the SUPABASE_BUCKET_NAME bucket (User/supabase_client.py).
+- LocalAvatarStorage writes under MEDIA_ROOT, a stand-in for tests and local runs.
+
+`variant_url()` picks the variant the serializers embed for a given display size.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from PIL import Image
+
+from User import imaging
+from User.models import CustomUser
+from User.supabase_client import upload_file_to_supabase
+
+logger = logging.getLogger(__name__)
+
+LATEST_TIMEOUT = 24 * 60 * 60
+
+# what Pillow raises for a file that is not an image it can decode
+INVALID_IMAGE_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+
+class AvatarUploadError(Exception):
+    pass
+
+
+class SupabaseAvatarStorage:
+
+    def save(self, path, file):
+        bucket = settings.SUPABASE_BUCKET_NAME
+        if not upload_file_to_supabase(file, bucket, path):
+            raise AvatarUploadError(f"could not upload {path} to {bucket}")
+        return f"{os.getenv('SUPABASE_URL').strip('/')}/storage/v1/object/public/{bucket}/{path}"
+
+
+class LocalAvatarStorage:
+
+    def save(self, path, file):
+        target = os.path.join(settings.MEDIA_ROOT, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as out:
+            out.write(file.read())
+        return f"{settings.MEDIA_URL}{path}"
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_avatar_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = LocalAvatarStorage() if settings.AVATAR_STORAGE == 'local' else SupabaseAvatarStorage()
+        return _storage
+
+
+def _latest_key(user_id):
+    return f"avatar:latest:{user_id}"
+
+
+def is_image(upload):
+    """
+    Whether `upload` (an UploadedFile) looks like an image Pillow can decode. Only the
+    header and structure are checked, so this is cheap enough for the request.
+    """
+    try:
+        with Image.open(upload) as image:
+            image.verify()
+    except INVALID_IMAGE_ERRORS:
+        return False
+    finally:
+        upload.seek(0)
+    return True
+
+
+def stage(user, upload):
+    """Copy `upload` (an UploadedFile) to the staging directory and queue its processing."""
+    from User.tasks import process_avatar
+
+    os.makedirs(settings.AVATAR_STAGING_DIR, exist_ok=True)
+    staged_name = f"{user.pk}-{uuid.uuid4().hex}"
+    with open(os.path.join(settings.AVATAR_STAGING_DIR, staged_name), 'wb') as out:
+        for chunk in upload.chunks():
+            out.write(chunk)
+    cache.set(_latest_key(user.pk), staged_name, timeout=LATEST_TIMEOUT)
+    transaction.on_commit(lambda: process_avatar.delay(user.pk, staged_name))
+
+
+def discard(staged_name):
+    try:
+        os.remove(os.path.join(settings.AVATAR_STAGING_DIR, staged_name))
+    except FileNotFoundError:
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _render_variants(staged_path):
+    """{size: WebP bytes} for AVATAR_SIZES, rendered in parallel in the process pool."""
+    global _pool
+    sizes = settings.AVATAR_SIZES
+    quality = settings.AVATAR_WEBP_QUALITY
+    if multiprocessing.current_process().daemon:
+        # a prefork pool child, which may not start processes of its own: render inline
+        return {size: imaging.render_variant(staged_path, size, quality) for size in sizes}
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.AVATAR_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    futures = {size: _pool.submit(imaging.render_variant, staged_path, size, quality) for size in sizes}
+    return {size: future.result() for size, future in futures.items()}
+
+
+def process(user_id, staged_name):
+    """
+    Render and upload the variants of the staged avatar and point the user at them. Raises AvatarUploadError when
+    the storage backend fails; the staged file is left for the task to retry or discard.
+    """
+    if cache.get(_latest_key(user_id)) != staged_name:
+        # superseded by a newer upload
+        discard(staged_name)
+        return None
+    staged_path = os.path.join(settings.AVATAR_STAGING_DIR, staged_name)
+    try:
+        imaging.verify(staged_path)
+        rendered = _render_variants(staged_path)
+    except INVALID_IMAGE_ERRORS:
+        logger.warning("avatar upload %s of user %s is not a valid image", staged_name, user_id)
+        discard(staged_name)
+        return None
+    storage = get_avatar_storage()
+    prefix = f"avatars/{user_id}/{uuid.uuid4().hex}"
+    # JSON object keys are strings
+    variants = {
+        str(size): storage.save(f"{prefix}/{size}.webp", io.BytesIO(data))
+        for size, data in rendered.items()
+    }
+    discard(staged_name)
+    user = CustomUser.objects.filter(pk=user_id).first()
+    if user is None or cache.get(_latest_key(user_id)) != staged_name:
+        return None
+    user.avatar_variants = variants
+    user.avatar_url = variants[str(max(rendered))]
+    user.save(update_fields=['avatar_url', 'avatar_variants'])
+    return user.avatar_url
+
+
+def variant_url(user, size):
+    """
+    URL of the smallest avatar variant at least `size` px a side (else the largest one);
+    avatar_url for users without variants (the default avatar, older uploads).
+    """
+    sizes = sorted(int(variant) for variant in user.avatar_variants or ())
+    if not sizes:
+        return user.avatar_url
+    return user.avatar_variants[str(next((s for s in sizes if s >= size), sizes[-1]))]
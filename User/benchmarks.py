@@ -0,0 +1,227 @@
+"""
+Benchmarks of the User app, run on demand like Post.benchmarks:
+
+    python manage.py test User.benchmarks -v 2
+"""
+import io
+import os
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image, ImageOps
+
+from Post.benchmarks import measure, report
+from Post.tests import RedisTestCase, make_question, make_user
+from User import avatars, supabase_client
+from User.tasks import process_avatar
+
+
+class FakeStorageHandler(BaseHTTPRequestHandler):
+    """Accepts every PUT of the Storage object API, keeping connections alive."""
+    protocol_version = 'HTTP/1.1'
+    # as real servers do; otherwise the body written after the headers waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # one handler per connection, serving all of its requests
+        super().setup()
+        self.server.connections += 1
+
+    def do_PUT(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 65536)))
+        body = b'{"Key": "ok"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def upload_before(file, bucket_name, file_name):
+    """upload_file_to_supabase as it was: a bare requests.put of the whole file read into memory."""
+    url = f"{os.getenv('SUPABASE_URL').strip('/')}/storage/v1/object/{bucket_name}/{file_name}"
+    file.seek(0)
+    file_data = file.read()
+    headers = {
+        "Content-Type": "image/webp",
+        "Authorization": f"Bearer {os.getenv('SUPABASE_SERVICE_ROLE_KEY')}",
+    }
+    return requests.put(url, headers=headers, data=file_data).status_code == 200
+
+
+class StorageUploadBenchmark(SimpleTestCase):
+    """
+    Uploads per second against a local fake Storage server, and the connections they
+    open, with the old bare requests.put and with the pooled session. The server is plain
+    HTTP on loopback, so only the TCP handshake is saved; against Supabase each new
+    connection also costs a TLS handshake over the network. The peak memory of one large
+    upload shows the streamed body.
+    """
+    UPLOADS = 300
+    UPLOAD_SIZE = 64 * 1024
+    LARGE_UPLOAD_SIZE = 8 * 1024 * 1024
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStorageHandler)
+        self.server.connections = 0
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        environ = mock.patch.dict(os.environ, {
+            'SUPABASE_URL': f'http://127.0.0.1:{self.server.server_port}/',
+            'SUPABASE_SERVICE_ROLE_KEY': 'key',
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def run_uploads(self, upload):
+        file = io.BytesIO(os.urandom(self.UPLOAD_SIZE))
+        results = []
+        # the first pooled upload opens the connection the rest reuse
+        upload(io.BytesIO(b'warm-up'), 'avatars', 'warm-up.webp')
+        self.server.connections = 0
+        wall, _ = measure(lambda: results.extend(
+            upload(file, 'avatars', f'avatar{i}.webp') for i in range(self.UPLOADS)
+        ))
+        self.assertTrue(all(results))
+        return wall, self.server.connections
+
+    def peak_memory(self, upload):
+        # a file on disk, as Django keeps large uploads
+        file = tempfile.TemporaryFile()
+        self.addCleanup(file.close)
+        file.write(os.urandom(self.LARGE_UPLOAD_SIZE))
+        tracemalloc.start()
+        try:
+            self.assertTrue(upload(file, 'avatars', 'large.webp'))
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_upload_throughput(self):
+        rows = []
+        connections = {}
+        for name, upload in (
+            ('requests.put', upload_before),
+            ('pooled session', supabase_client.upload_file_to_supabase),
+        ):
+            wall, connections[name] = self.run_uploads(upload)
+            rows.append((
+                name, self.UPLOADS, f'{self.UPLOADS / wall:.0f}', connections[name],
+                f'{self.peak_memory(upload) / 2 ** 20:.1f}',
+            ))
+        report(
+            f'{self.UPLOAD_SIZE // 1024} KiB uploads (peak memory of one {self.LARGE_UPLOAD_SIZE // 2 ** 20} MiB upload)',
+            ('client', 'uploads', 'uploads/s', 'new connections', 'peak MiB'), rows,
+        )
+        self.assertEqual(connections['requests.put'], self.UPLOADS)
+        self.assertEqual(connections['pooled session'], 0)
+
+
+def make_photo(width=3024, height=4032):
+    """
+    A JPEG the size a phone camera takes, with EXIF. Noise summed over several scales
+    keeps detail at every size, as a photo has, so the downscaled variants do not
+    collapse to a flat colour.
+    """
+    def band():
+        octaves = [
+            Image.effect_noise((max(1, width >> k), max(1, height >> k)), 64).resize(
+                (width, height), Image.Resampling.BICUBIC,
+            ) for k in range(0, 9, 2)
+        ]
+        image = octaves[0]
+        for count, octave in enumerate(octaves[1:], 2):
+            image = Image.blend(image, octave, 1 / count)
+        return ImageOps.autocontrast(image)
+
+    exif = Image.Exif()
+    exif[0x0110] = 'Phone camera'  # Model
+    buffer = io.BytesIO()
+    Image.merge('RGB', [band() for _ in range(3)]).save(buffer, format='JPEG', quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+class AvatarBytesBenchmark(RedisTestCase):
+    """
+    Bytes a browser downloads for one question list page: the JSON plus each distinct
+    avatar on it, when avatar_url is the original upload (as before) and when it is the
+    variant AuthorSerializer picks. Files are stored with LocalAvatarStorage.
+    """
+    AUTHORS = 10
+    QUESTIONS_PER_AUTHOR = 2
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.photo = make_photo()
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(
+            MEDIA_ROOT=media_root.name,
+            AVATAR_STAGING_DIR=os.path.join(media_root.name, 'staging'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = avatars.LocalAvatarStorage()
+        storage = mock.patch.object(avatars, 'get_avatar_storage', return_value=self.storage)
+        storage.start()
+        self.addCleanup(storage.stop)
+        self.authors = [make_user(f'author{i}')[0] for i in range(self.AUTHORS)]
+        for author in self.authors:
+            for i in range(self.QUESTIONS_PER_AUTHOR):
+                make_question(author, title=f'Question number {i} by {author.username}')
+
+    def page_bytes(self):
+        """(JSON bytes, avatar bytes, distinct avatars) of the default question list page."""
+        cache.clear()
+        response = self.client.get(f'/api/questions/?page_size={self.AUTHORS * self.QUESTIONS_PER_AUTHOR}')
+        self.assertEqual(response.status_code, 200)
+        urls = {question['author']['avatar_url'] for question in response.json()['results']}
+        paths = [os.path.join(settings.MEDIA_ROOT, url.removeprefix(settings.MEDIA_URL)) for url in urls]
+        return len(response.content), sum(os.path.getsize(path) for path in paths), len(urls)
+
+    def test_bytes_per_question_page(self):
+        # before: avatar_url is the uploaded file itself
+        for author in self.authors:
+            author.avatar_url = self.storage.save(f'avatars/{author.pk}/original.jpg', io.BytesIO(self.photo))
+            author.save(update_fields=['avatar_url'])
+        before = self.page_bytes()
+
+        for author in self.authors:
+            with mock.patch.object(process_avatar, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+                avatars.stage(author, SimpleUploadedFile('avatar.jpg', self.photo))
+            avatars.process(*delay.call_args.args)
+        after = self.page_bytes()
+
+        report(
+            f'Question list page, {self.AUTHORS} authors with a {len(self.photo) / 2 ** 20:.1f} MiB photo',
+            ('avatars', 'distinct', 'JSON bytes', 'avatar bytes', 'total bytes'),
+            [(name, count, json_bytes, avatar_bytes, json_bytes + avatar_bytes)
+             for name, (json_bytes, avatar_bytes, count) in (('original', before), ('variant', after))],
+        )
+        for author in self.authors:
+            author.refresh_from_db()
+            path = os.path.join(settings.MEDIA_ROOT, avatars.variant_url(author, 64).removeprefix(settings.MEDIA_URL))
+            with Image.open(path) as variant:
+                self.assertEqual(dict(variant.getexif()), {})
+        self.assertEqual(before[2], self.AUTHORS)
+        self.assertEqual(after[2], self.AUTHORS)
+        self.assertLess(after[1] * 100, before[1])
@@ -0,0 +1,30 @@
+"""
+Avatar image encoding, run in the process pool of User/avatars.py.
+
+Nothing here imports Django: the pool's worker processes are spawned and only import
+this module.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+
+def verify(path):
+    """Raise if the file at `path` is not an image Pillow can decode."""
+    with Image.open(path) as image:
+        image.verify()
+
+
+def render_variant(path, size, quality):
+    """The image at `path` as a `size`x`size` WebP, centre-cropped, with no metadata."""
+    with Image.open(path) as image:
+        # JPEGs are decoded straight at the smallest scale still at least `size` a side
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+    image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    # EXIF, ICC profile and XMP are all carried in info
+    image.info = {}
+    buffer = io.BytesIO()
+    image.save(buffer, format='WEBP', quality=quality, method=6)
+    return buffer.getvalue()
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Post', '0012_answer_answer_question_votes_idx_and_more'),
+        ('User', '0011_rename_bio_customuser_about'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['-reputation', '-id'], name='user_reputation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['-member_since', '-id'], name='user_member_since_idx'),
+        ),
+    ]
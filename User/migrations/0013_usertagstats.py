@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_user_tag_stats(apps, schema_editor):
+    Question = apps.get_model('Post', 'Question')
+    Answer = apps.get_model('Post', 'Answer')
+    UserTagStats = apps.get_model('User', 'UserTagStats')
+    totals = {}
+    questions = Question.tags.through.objects.values_list('question__author_id', 'tag_id')
+    answers = Answer.objects.filter(question__tags__isnull=False).values_list('author_id', 'question__tags')
+    for rows, votes in ((questions, 'question__vote_count'), (answers, 'vote_count')):
+        for user_id, tag_id, posts, score in rows.annotate(Count('pk'), Sum(votes)).order_by():
+            entry = totals.setdefault((user_id, tag_id), [0, 0])
+            entry[0] += posts
+            entry[1] += score or 0
+    UserTagStats.objects.bulk_create([
+        UserTagStats(user_id=user_id, tag_id=tag_id, posts=posts, score=score)
+        for (user_id, tag_id), (posts, score) in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Post', '0016_tagstats'),
+        ('User', '0012_customuser_user_reputation_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTagStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(default=0)),
+                ('posts', models.IntegerField(default=0)),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_stats', to='Post.tag')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-score', '-posts', '-tag'], name='user_tag_stats_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'tag'), name='unique_user_tag_stats')],
+            },
+        ),
+        migrations.RunPython(populate_user_tag_stats, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,5 @@
-import os
-
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-import io
-from PIL import Image
-from .supabase_client import upload_file_to_supabase
 from Post.models import Tag
 
 
@@ -20,37 +15,8 @@ class CustomUser(AbstractUser):
     about = models.TextField(null=True, blank=True)
     displayName = models.CharField(max_length=100,default="default_displayName")
     avatar_url = models.CharField(default="https://aenacihkjsxjdpkeqxja.supabase.co/storage/v1/object/public/stackoverflowcopyomar//IMG-20221013-WA0032.jpg",max_length=255, null=True, blank=True)
-
-    def save_avatar(self, file_data, file_name):
-        try:
-            if not isinstance(file_data, io.BytesIO):
-                file_data = io.BytesIO(file_data.read())
-
-            file_data.seek(0)
-            try:
-                image = Image.open(file_data)
-                image.verify()
-                print(f"✅ Файл {file_name} успешно открыт и проверен. Формат: {image.format}")
-            except Exception as e:
-                print(f"❌ Ошибка при проверке изображения: {e}")
-                return
-
-            file_data.seek(0)
-
-            full_path = f"avatars/{self.username}/{file_name}"
-
-            success = upload_file_to_supabase(file_data, os.getenv('SUPABASE_BUCKET_NAME'), full_path)
-
-            if success:
-                supabase_url = os.getenv('SUPABASE_URL').strip('/')
-                self.avatar_url = f"{supabase_url}/storage/v1/object/public/{os.getenv('SUPABASE_BUCKET_NAME')}/{full_path}"
-                self.save()
-                print(f"✅ Файл успешно загружен: {self.avatar_url}")
-            else:
-                raise Exception("❌ Ошибка загрузки файла на Supabase.")
-
-        except Exception as e:
-            print(f"Ошибка в save_avatar(): {e}")
+    # {"<size>": url} of the square WebP renditions of the avatar (User/avatars.py)
+    avatar_variants = models.JSONField(default=dict, blank=True)
 
     reputation = models.IntegerField(default=1)
     location = models.CharField(max_length=255,null=True, blank=True)
@@ -62,10 +28,37 @@ class CustomUser(AbstractUser):
     answer_count = models.IntegerField(default=0)
     top_tags = models.ManyToManyField(Tag, related_name='users', blank=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['-reputation', '-id'], name='user_reputation_idx'),
+            models.Index(fields=['-member_since', '-id'], name='user_member_since_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
 
+class UserTagStats(models.Model):
+    """
+    A user's activity in one tag: posts = their questions and answers carrying the tag,
+    score = the sum of those posts' votes. Maintained incrementally by Post.stats.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='tag_stats')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='user_stats')
+    score = models.IntegerField(default=0)
+    posts = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'tag'], name='unique_user_tag_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score', '-posts', '-tag'], name='user_tag_stats_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.tag_id}: {self.score}/{self.posts}"
+
 
 class Reputation(models.Model):
     TYPE_CHOICES = [
@@ -1,5 +1,12 @@
 from rest_framework.pagination import PageNumberPagination
 
+from Post.pagination import KeysetPagination
+
+
 class CustomPageNumberPagination(PageNumberPagination):
     page_size = 12
-    page_size_query_param = 'page_size'
\ No newline at end of file
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class UserKeysetPagination(KeysetPagination):
+    page_size = 12
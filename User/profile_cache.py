@@ -0,0 +1,106 @@
+"""
+Write-through cache of user profiles.
+
+One entry per user, `user:<id>`, holds every column the profile endpoints return;
+`public()` (GET /users/<id>/) and `private()` (GET /users/me/) are projections of it,
+so a profile read is a single cache GET. The entry is rewritten from the database
+after every transaction that changes the user: CustomUser saves, Reputation rows
+(add_reputation), the question/answer counters (Post/signals.py) and flushed
+write-behind reputation (Post/vote_buffer.py). Reputation still buffered in Redis is
+added on read, as merge_pending does for model instances.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from Post import vote_buffer
+from StackOverflowCopy import async_cache, http
+from User.models import CustomUser
+
+FIELDS = (
+    'id', 'username', 'displayName', 'email', 'avatar_url', 'reputation', 'location', 'about',
+    'member_since', 'last_login', 'gold_badges', 'silver_badges', 'bronze_badges',
+    'question_count', 'answer_count',
+)
+
+
+def _key(user_id):
+    return f"user:{user_id}"
+
+
+def _load(user_ids):
+    written_at = time.time()
+    return {
+        row['id']: {**row, 'written_at': written_at}
+        for row in CustomUser.objects.filter(pk__in=user_ids).values(*FIELDS)
+    }
+
+
+def _write(user_ids):
+    records = _load(user_ids)
+    cache.set_many({_key(pk): record for pk, record in records.items()}, timeout=settings.USER_CACHE_TIMEOUT)
+    cache.delete_many([_key(pk) for pk in set(user_ids) - set(records)])
+
+
+def refresh(user_ids):
+    """Rewrite the entries of `user_ids` (or drop the deleted ones) once the surrounding transaction commits."""
+    user_ids = {int(pk) for pk in user_ids}
+    if user_ids:
+        transaction.on_commit(lambda: _write(user_ids))
+
+
+def get(user_id):
+    """The cached record of `user_id`, loaded on a miss; None when there is no such user."""
+    user_id = int(user_id)
+    record = cache.get(_key(user_id))
+    if record is None:
+        record = _load([user_id]).get(user_id)
+        if record is None:
+            return None
+        # add, not set: a refresh that committed meanwhile wins over this read
+        cache.add(_key(user_id), record, timeout=settings.USER_CACHE_TIMEOUT)
+    if vote_buffer.enabled():
+        record['reputation'] += vote_buffer.pending('user', [user_id]).get(user_id, 0)
+    return record
+
+
+async def aget(user_id):
+    """get() for async views, without the database: None on a miss."""
+    user_id = int(user_id)
+    record = await async_cache.aget(_key(user_id))
+    if record is not None and vote_buffer.enabled():
+        record['reputation'] += (await vote_buffer.apending('user', [user_id])).get(user_id, 0)
+    return record
+
+
+def etag(record):
+    return http.make_etag('user', record['id'], record['written_at'], record['reputation'])
+
+
+def private(record):
+    return {
+        "id": record['id'],
+        "username": record['username'],
+        "displayName": record['displayName'],
+        "email": record['email'],
+        "avatar_url": record['avatar_url'],
+        "reputation": record['reputation'],
+        "location": record['location'],
+        "about": record['about'],
+        "member_since": record['member_since'],
+        "last_seen": record['last_login'],
+        "visit_streak": "Add in the future",
+    }
+
+
+def public(record):
+    return {
+        **private(record),
+        "gold_badges": record['gold_badges'],
+        "silver_badges": record['silver_badges'],
+        "bronze_badges": record['bronze_badges'],
+        "question_count": record['question_count'],
+        "answer_count": record['answer_count'],
+    }
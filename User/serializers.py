@@ -2,8 +2,9 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
 
+from User import avatars
 from User.models import CustomUser, Reputation
-from Post.serializers import TagSerializer
+from Post.serializers import TagSerializer, PendingVotesMixin, PendingVotesListSerializer
 
 User = get_user_model()
 
@@ -29,16 +30,26 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         user = User.objects.create(**validated_data)
         return user
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(PendingVotesMixin, serializers.ModelSerializer):
     top_tags = TagSerializer(many=True, read_only=True)
+    # the users list shows avatars at 64 CSS px
+    avatar_url = serializers.SerializerMethodField()
+
+    def get_avatar_url(self, user):
+        return avatars.variant_url(user, 128)
 
     class Meta:
         model = CustomUser
+        list_serializer_class = PendingVotesListSerializer
         fields = [
             'id', 'username', 'displayName', 'avatar_url', 'reputation',
             'location', 'member_since', 'gold_badges', 'silver_badges', 'bronze_badges', 'top_tags'
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related('top_tags')
+
 class ReputationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reputation
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from User import authentication, profile_cache
+from User.models import CustomUser, Reputation
+from StackOverflowCopy import cache as cache_ns
+
+
+# the author fields questions and answers embed (Post.serializers.AuthorSerializer)
+AUTHOR_FIELDS = ('username', 'displayName', 'avatar_url', 'avatar_variants', 'reputation')
+
+
+@receiver(pre_save, sender=CustomUser)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    # a full save() does not say what it changed: keep the stored author fields to compare
+    if update_fields is None and instance.pk is not None:
+        instance._saved_author = (
+            CustomUser.objects.filter(pk=instance.pk).values_list(*AUTHOR_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=CustomUser)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None:
+        if set(update_fields) <= {'last_login'}:
+            return
+        author_changed = not set(update_fields).isdisjoint(AUTHOR_FIELDS)
+    elif created:
+        # no questions or answers yet
+        author_changed = False
+    else:
+        saved = instance.__dict__.pop('_saved_author', None)
+        author_changed = saved != tuple(getattr(instance, field) for field in AUTHOR_FIELDS)
+    if author_changed:
+        cache_ns.bump_on_commit(cache_ns.USERS, cache_ns.QUESTIONS, cache_ns.ANSWERS)
+    else:
+        cache_ns.bump_on_commit(cache_ns.USERS)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, **kwargs):
+    # their questions and answers are cascaded and bump their own namespaces
+    cache_ns.bump_on_commit(cache_ns.USERS)
+
+
+@receiver(post_save, sender=Reputation)
+def reputation_changed(sender, **kwargs):
+    # reputation is an author field too; write-behind reputation is bumped when
+    # Post.vote_buffer.flush writes it
+    if not settings.VOTE_WRITE_BEHIND:
+        cache_ns.bump_on_commit(cache_ns.USERS, cache_ns.QUESTIONS, cache_ns.ANSWERS)
+
+
+# Profile entity cache (User/profile_cache.py): written through on every change of the user.
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def user_profile_changed(sender, instance, **kwargs):
+    profile_cache.refresh([instance.pk])
+
+
+@receiver(post_save, sender=Reputation)
+def reputation_profile_changed(sender, instance, **kwargs):
+    # add_reputation moves CustomUser.reputation with update(), which sends no signal
+    profile_cache.refresh([instance.user_id])
+
+
+# Cached token lookups (User/authentication.py): dropped when the token goes away or
+# its user changes (e.g. is deactivated).
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    # the deletion sets the key (the pk) to None before an outer transaction commits
+    key = instance.key
+    transaction.on_commit(lambda: authentication.forget([key]))
+
+
+@receiver(post_save, sender=CustomUser)
+def user_tokens_changed(sender, instance, created, **kwargs):
+    if not created:
+        keys = list(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+        transaction.on_commit(lambda: authentication.forget(keys))
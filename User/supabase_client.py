@@ -1,20 +1,82 @@
+"""
+Clients for Supabase Storage.
+
+Both clients are built once per process and reused, so uploads share keep-alive
+connections instead of opening a new TCP+TLS connection each: the requests Session
+behind upload_file_to_supabase (timeouts and retries with backoff from the STORAGE_*
+settings) and the boto3 S3 client of get_s3_client(). Each is rebuilt after a fork,
+which must not share sockets with the parent.
+"""
+import logging
+import os
+import threading
+
 import boto3
 import requests
-import os
-import io
-from botocore.exceptions import NoCredentialsError, ClientError
+from botocore.config import Config
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def get_s3_client():
-    return boto3.client(
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _per_process(name, build):
+    key = (name, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = build()
+    return client
+
+
+def _build_session():
+    retry = Retry(
+        total=settings.STORAGE_RETRIES,
+        backoff_factor=settings.STORAGE_RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # PUT is idempotent: a retried upload overwrites the same object
+        allowed_methods=frozenset({'GET', 'HEAD', 'PUT', 'DELETE'}),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.STORAGE_POOL_SIZE,
+        pool_maxsize=settings.STORAGE_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    return _per_process('session', _build_session)
+
+
+def _build_s3_client():
+    # a Session of its own: boto3's default session is not thread-safe
+    return boto3.session.Session().client(
         's3',
         aws_access_key_id=os.getenv('SUPABASE_ACCESS_KEY_ID'),
         aws_secret_access_key=os.getenv('SUPABASE_SECRET_ACCESS_KEY'),
         region_name=os.getenv('SUPABASE_REGION'),  # Убедись, что указан правильный регион
-        endpoint_url=os.getenv('SUPABASE_ENDPOINT_URL')
+        endpoint_url=os.getenv('SUPABASE_ENDPOINT_URL'),
+        config=Config(
+            connect_timeout=settings.STORAGE_CONNECT_TIMEOUT,
+            read_timeout=settings.STORAGE_READ_TIMEOUT,
+            max_pool_connections=settings.STORAGE_POOL_SIZE,
+            retries={'total_max_attempts': settings.STORAGE_RETRIES + 1, 'mode': 'standard'},
+        ),
     )
 
 
-from botocore.exceptions import NoCredentialsError, ClientError
+def get_s3_client():
+    return _per_process('s3', _build_s3_client)
 
 
 def upload_file_to_supabase(file, bucket_name, file_name):
@@ -24,15 +86,10 @@ def upload_file_to_supabase(file, bucket_name, file_name):
     # Формируем URL для загрузки файла
     url = f"{supabase_url}/storage/v1/object/{bucket_name}/{file_name}"
 
-    # Перемещаем указатель в начало файла
+    # Перемещаем указатель в начало файла: тело запроса читается прямо из него
+    # (и перечитывается при повторной попытке), без копии в памяти
     file.seek(0)
 
-    # Читаем файл в байты
-    file_data = file.read()
-
-    # Логируем размер файла
-    print(f"📊 Размер файла: {len(file_data)} байтов")
-
     # Определяем MIME-Type
     if file_name.endswith(".webp"):
         content_type = "image/webp"
@@ -49,13 +106,20 @@ def upload_file_to_supabase(file, bucket_name, file_name):
         "Authorization": f"Bearer {service_role_key}"
     }
 
-    response = requests.put(url, headers=headers, data=file_data)
+    try:
+        response = get_session().put(
+            url, headers=headers, data=file,
+            timeout=(settings.STORAGE_CONNECT_TIMEOUT, settings.STORAGE_READ_TIMEOUT),
+        )
+    except requests.RequestException:
+        logger.exception("upload of %s to bucket %s failed", file_name, bucket_name)
+        return False
 
     if response.status_code == 200:
-        print(f"✅ Файл {file_name} успешно загружен в бакет {bucket_name}.")
+        logger.info("uploaded %s to bucket %s", file_name, bucket_name)
         return True
     else:
-        print(f"❌ Ошибка загрузки файла: {response.status_code} - {response.text}")
+        logger.warning(
+            "upload of %s to bucket %s failed: %s %s", file_name, bucket_name, response.status_code, response.text,
+        )
         return False
-
-
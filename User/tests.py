@@ -1,3 +1,325 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from PIL import Image
+
+from Post import vote_buffer
+from Post.models import Answer, Question, Vote
+from Post.tests import QueryBudgetTestCase, RedisTestCase, make_question, make_user
+from Post.utils import add_reputation
+from User import authentication, avatars, imaging, profile_cache
+from User.models import Reputation
+from User.tasks import process_avatar
+
+
+def make_png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 200), 'teal').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class ListQueryBudgetTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Reputation.objects.bulk_create([
+            Reputation(user=cls.author, type='question_upvote', change=10, description='Question upvoted')
+            for _ in range(max(cls.PAGE_SIZES))
+        ])
+
+    def test_users(self):
+        self.assert_budget('/api/users/', 3)
+
+    def test_users_keyset(self):
+        self.assert_budget('/api/users/?cursor=', 2)
+
+    def test_user_questions(self):
+        self.assert_budget(f'/api/users/{self.author.id}/questions/', 4)
+
+    def test_user_answers(self):
+        self.assert_budget(f'/api/users/{self.author.id}/answers/', 3)
+
+    def test_user_reputation(self):
+        self.assert_budget(f'/api/users/{self.author.id}/reputation/', 3)
+
+
+class TokenAuthenticationTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.client = make_user('author')
+        self.key = self.user.auth_token.key
+        self.cache_key = authentication._cache_key(self.key)
+
+    def authenticate(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def assert_revoked(self):
+        self.assertIsNone(authentication._local.get(self.cache_key))
+        self.assertIsNone(cache.get(self.cache_key))
+        self.assertEqual(self.authenticate(), 401)
+
+    def test_lookup_is_cached(self):
+        self.assertEqual(self.authenticate(), 200)
+        self.assertEqual(authentication._local.get(self.cache_key), self.user.pk)
+        self.assertEqual(cache.get(self.cache_key), self.user.pk)
+        with self.assertNumQueries(0):
+            user, token = authentication.CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.key))
+
+    def test_token_delete_in_transaction_revokes(self):
+        self.assertEqual(self.authenticate(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Token.objects.get(key=self.key).delete()
+        self.assert_revoked()
+
+    def test_logout_revokes(self):
+        self.assertEqual(self.authenticate(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/logout/')
+        self.assertEqual(response.status_code, 200)
+        self.assert_revoked()
+
+    def test_deleted_user_rejected(self):
+        self.assertEqual(self.authenticate(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.user.delete()
+        self.assert_revoked()
+
+    def test_inactive_user_rejected(self):
+        self.assertEqual(self.authenticate(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assert_revoked()
+
+    def test_cached_user_in_write_views(self):
+        # the second round authenticates from the cache, with a deferred request.user
+        for i in range(2):
+            response = self.client.post(
+                '/api/questions/', {'title': f'Question number {i} here', 'content': 'Some content here.', 'tag_names': ['python']},
+                format='json',
+            )
+            self.assertEqual(response.status_code, 201)
+            question = Question.objects.get(pk=response.json()['id'])
+            self.assertEqual(question.author_id, self.user.pk)
+            response = self.client.patch(f'/api/questions/{question.id}/', {'title': 'Renamed question'}, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.get(self.cache_key), self.user.pk)
+
+        other, _ = make_user('other')
+        response = self.client.post(f'/api/questions/{make_question(other).id}/vote/', {'vote_type': 'upvote'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Vote.objects.filter(user=self.user).exists())
+        response = self.client.patch('/api/users/me/', {'displayName': 'Renamed'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['displayName'], 'Renamed')
+
+    def test_cached_user_loads_deferred_fields(self):
+        self.assertEqual(self.authenticate(), 200)
+        user, _ = authentication.CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.assertEqual(user.username, 'author')
+
+
+class ProfileCacheTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.client = make_user('author')
+        self.other, _ = make_user('other')
+        self.url = f'/api/users/{self.user.pk}/'
+
+    def cached(self, field):
+        # filled by the first read, then only ever rewritten from the database
+        profile_cache.get(self.user.pk)
+        return cache.get(profile_cache._key(self.user.pk))[field]
+
+    def test_reputation_change_rewrites(self):
+        self.assertEqual(self.cached('reputation'), 1)
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            add_reputation(self.user.pk, 'question_upvote', 10, 'Question upvoted')
+        self.assertEqual(self.cached('reputation'), 11)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['reputation'], 11)
+
+    @override_settings(VOTE_WRITE_BEHIND=True)
+    def test_write_behind_reputation(self):
+        self.assertEqual(self.cached('reputation'), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_reputation(self.user.pk, 'question_upvote', 10, 'Question upvoted')
+        self.assertEqual(self.client.get(self.url).json()['reputation'], 11)
+        with self.captureOnCommitCallbacks(execute=True):
+            vote_buffer.flush()
+        self.assertEqual(self.cached('reputation'), 11)
+        self.assertEqual(self.client.get(self.url).json()['reputation'], 11)
+
+    def test_counters_rewrite(self):
+        self.assertEqual((self.cached('question_count'), self.cached('answer_count')), (0, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            question = make_question(self.other)
+            answer = Answer.objects.create(question=question, author=self.user, content='An answer.')
+            make_question(self.user)
+        self.assertEqual((self.cached('question_count'), self.cached('answer_count')), (1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            answer.delete()
+        self.assertEqual(self.client.get(self.url).json()['answer_count'], 0)
+
+    def test_profile_edit_rewrites(self):
+        self.assertEqual(self.cached('displayName'), self.user.displayName)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/users/me/', {'displayName': 'Renamed'}, format='multipart')
+        self.assertEqual(self.cached('displayName'), 'Renamed')
+        self.assertEqual(self.client.get('/api/users/me/').json()['displayName'], 'Renamed')
+
+    def test_user_delete_drops(self):
+        self.cached('id')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertIsNone(cache.get(profile_cache._key(self.user.pk)))
+        self.assertEqual(APIClient().get(self.url).status_code, 404)
+
+
+class AvatarUploadTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.client = make_user('author')
+        staging_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(staging_dir.cleanup)
+        self.staging_dir = staging_dir.name
+        settings = override_settings(AVATAR_STAGING_DIR=self.staging_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def stage(self):
+        with mock.patch.object(process_avatar, 'delay'), self.captureOnCommitCallbacks(execute=True):
+            avatars.stage(self.user, SimpleUploadedFile('avatar.png', make_png()))
+        return cache.get(avatars._latest_key(self.user.pk))
+
+    def test_patch_rejects_non_image(self):
+        response = self.client.patch('/api/users/me/', {
+            'displayName': 'Renamed', 'avatar': SimpleUploadedFile('avatar.png', b'not an image'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.displayName, 'Renamed')
+        self.assertFalse(os.path.exists(self.staging_dir) and os.listdir(self.staging_dir))
+
+    def test_patch_stages_image(self):
+        with mock.patch.object(process_avatar, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/users/me/', {
+                'avatar': SimpleUploadedFile('avatar.png', make_png()),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        staged_name = delay.call_args.args[1]
+        self.assertTrue(os.path.exists(os.path.join(self.staging_dir, staged_name)))
+
+    def test_failed_job_discards_staged_file(self):
+        staged_name = self.stage()
+        storage = mock.Mock()
+        storage.save.side_effect = OSError('disk full')
+        with mock.patch.object(avatars, 'get_avatar_storage', return_value=storage), \
+                mock.patch.object(avatars, '_render_variants', return_value={32: b'webp'}):
+            result = process_avatar.apply(args=(self.user.pk, staged_name))
+        self.assertIsInstance(result.result, OSError)
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+    def test_failed_upload_retried_then_discarded(self):
+        staged_name = self.stage()
+        storage = mock.Mock()
+        storage.save.side_effect = avatars.AvatarUploadError('storage down')
+        with mock.patch.object(avatars, 'get_avatar_storage', return_value=storage), \
+                mock.patch.object(avatars, '_render_variants', return_value={32: b'webp'}):
+            process_avatar.apply(args=(self.user.pk, staged_name))
+        self.assertEqual(storage.save.call_count, process_avatar.max_retries + 1)
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+
+class AvatarVariantTests(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, _ = make_user('author')
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(
+            MEDIA_ROOT=media_root.name, AVATAR_STAGING_DIR=os.path.join(media_root.name, 'staging'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def render(self, image, size, **save_options):
+        with tempfile.NamedTemporaryFile(suffix='.img') as file:
+            image.save(file, **save_options)
+            file.flush()
+            return Image.open(io.BytesIO(imaging.render_variant(file.name, size, 80)))
+
+    def test_render_variant_square_webp_without_metadata(self):
+        exif = Image.Exif()
+        exif[0x0110] = 'Phone camera'  # Model
+        variant = self.render(Image.new('RGB', (600, 400), 'teal'), 64, format='JPEG', exif=exif)
+        self.assertEqual((variant.format, variant.size, variant.mode), ('WEBP', (64, 64), 'RGB'))
+        self.assertEqual(dict(variant.getexif()), {})
+
+    def test_render_variant_applies_orientation(self):
+        # stored sideways: left half red, right half blue; EXIF orientation 6 turns it upright
+        image = Image.new('RGB', (400, 200), 'red')
+        image.paste('blue', (200, 0, 400, 200))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation
+        variant = self.render(image, 32, format='JPEG', exif=exif)
+        # upright, red is on top
+        red, green, blue = variant.getpixel((24, 8))
+        self.assertGreater(red, blue)
+        red, green, blue = variant.getpixel((24, 24))
+        self.assertGreater(blue, red)
+
+    def test_render_variant_keeps_transparency(self):
+        variant = self.render(Image.new('RGBA', (100, 100), (0, 0, 0, 0)), 32, format='PNG')
+        self.assertEqual(variant.mode, 'RGBA')
+        self.assertEqual(variant.getpixel((16, 16))[3], 0)
+
+    def test_variant_url(self):
+        self.assertEqual(avatars.variant_url(self.user, 64), self.user.avatar_url)
+        self.user.avatar_variants = {str(size): f'/media/{size}.webp' for size in (32, 64, 128, 256)}
+        for size, url in ((16, '/media/32.webp'), (64, '/media/64.webp'), (100, '/media/128.webp'),
+                          (512, '/media/256.webp')):
+            self.assertEqual(avatars.variant_url(self.user, size), url, size)
+
+    def test_process_and_serializers(self):
+        make_question(self.user)
+        with mock.patch.object(avatars, 'get_avatar_storage', return_value=avatars.LocalAvatarStorage()), \
+                mock.patch.object(process_avatar, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            avatars.stage(self.user, SimpleUploadedFile('avatar.png', make_png()))
+        # rendered inline rather than in the process pool
+        with mock.patch.object(avatars, 'get_avatar_storage', return_value=avatars.LocalAvatarStorage()), \
+                mock.patch.object(avatars, '_render_variants', side_effect=lambda path: {
+                    size: imaging.render_variant(path, size, 80) for size in (32, 64, 128, 256)
+                }), self.captureOnCommitCallbacks(execute=True):
+            avatars.process(*delay.call_args.args)
+        self.user.refresh_from_db()
+        self.assertEqual(sorted(self.user.avatar_variants, key=int), ['32', '64', '128', '256'])
+        self.assertEqual(self.user.avatar_url, self.user.avatar_variants['256'])
+        for size, url in self.user.avatar_variants.items():
+            with Image.open(os.path.join(settings.MEDIA_ROOT, url.removeprefix(settings.MEDIA_URL))) as variant:
+                self.assertEqual(variant.size, (int(size), int(size)))
+
+        client = APIClient()
+        question = client.get('/api/questions/').json()['results'][0]
+        self.assertEqual(question['author']['avatar_url'], self.user.avatar_variants['64'])
+        profile = client.get('/api/users/').json()['results'][0]
+        self.assertEqual(profile['avatar_url'], self.user.avatar_variants['128'])
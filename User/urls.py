@@ -8,8 +8,8 @@ urlpatterns = [
     path('auth/logout/', views.logout, name='logout'),
     path('auth/user/', views.user, name='profile'),
 
-    path('users/', views.user_list, name='users'),
-    path('users/<int:id>/', views.user_details, name='user_details'),
+    path('users/', views.user_list_async, name='users'),
+    path('users/<int:id>/', views.user_details_async, name='user_details'),
     path('users/me/', views.user_edit_get, name='user_edit_get'),
     path('users/<int:id>/questions/', views.user_questions, name='user_questions'),
     path('users/<int:id>/answers/', views.user_answers, name='user_answers'),
@@ -1,22 +1,42 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from django.db.models import Count, Q
-from django.http import JsonResponse
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from django.core.cache import cache
-import json
-import hashlib
 
-from Post.models import Question, Answer, Tag
+from Post.models import Question, Answer
 from Post.serializers import QuestionSerializer, AnswerSerializer
-from User.pagination import CustomPageNumberPagination
-from User.models import CustomUser, Reputation
+from Post.pagination import get_paginator
+from User.pagination import CustomPageNumberPagination, UserKeysetPagination
+from User.models import CustomUser, Reputation, UserTagStats
 from User.serializers import UserRegistrationSerializer, UserSerializer, ReputationSerializer
-from User.tasks import update_users_list_cache, update_users_me_cache, update_users_details_cache
+from User import avatars, profile_cache
+from User.authentication import CachedTokenAuthentication, acached_user
+from User.tasks import update_users_list_cache
+from StackOverflowCopy import cache as cache_ns
+from StackOverflowCopy import debounce, http
+from StackOverflowCopy.cache import async_cached, cache_response
+from StackOverflowCopy.renderers import FastJSONRenderer
+
+# sort_by -> ordering; every ordering ends with id so it can drive keyset pagination
+USER_ORDERINGS = {
+    'reputation': ('-reputation', '-id'),
+    'newest': ('-member_since', '-id'),
+    'name': ('username', 'id'),
+}
+USER_QUESTION_ORDERINGS = {
+    'views': ('-view_count', '-id'),
+    'votes': ('-vote_count', '-id'),
+    'newest': ('-created_at', '-id'),
+}
+USER_ANSWER_ORDERINGS = {
+    'votes': ('-vote_count', '-id'),
+    'newest': ('-created_at', '-id'),
+}
 
 
 @api_view(['POST'])
@@ -25,8 +45,7 @@ def register(request):
     if serializer.is_valid():
         user = serializer.save()
 
-        print("user registered, start to update cache")
-        update_users_list_cache.delay()
+        debounce.schedule(update_users_list_cache)
 
         token, created = Token.objects.get_or_create(user=user)
         return Response({
@@ -75,7 +94,7 @@ def logout(request):
         return Response({"error": "Invalid request, user not authenticated"}, status=status.HTTP_400_BAD_REQUEST)
 
 
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 @api_view(['GET'])
 def user(request):
@@ -93,6 +112,9 @@ def user(request):
 
 
 @api_view(['GET'])
+@cache_response('users_list', [cache_ns.USERS], params={
+    'page': '1', 'page_size': '12', 'cursor': None, 'with_count': None, 'search': None, 'sort_by': 'reputation',
+}, raw=True)
 def user_list(request):
     """
         Эндпоинт для получения списка пользователей.
@@ -103,68 +125,52 @@ def user_list(request):
           - search: фильтрация по username или displayName
           - sort_by: варианты сортировки: 'reputation', 'newest', 'name'
     """
-    query_params = request.query_params.dict()
-    key_raw = json.dumps(query_params,sort_keys=True)
-    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
-    cache_key = f"users_list:{key_hash}"
-
-    cached_users = cache.get(cache_key)
-    if cached_users:
-        return Response(cached_users, status=status.HTTP_200_OK)
-
-    queryset = CustomUser.objects.all()
+    queryset = UserSerializer.setup_eager_loading(CustomUser.objects.all())
 
     search = request.query_params.get('search')
     if search:
         queryset = queryset.filter(username__icontains=search)
 
     sort_by = request.query_params.get('sort_by')
-    if sort_by:
-        if sort_by == 'newest':
-            queryset = queryset.order_by('-member_since')
-        elif sort_by == 'reputation':
-            queryset = queryset.order_by('-reputation')
-        elif sort_by == 'name':
-            queryset = queryset.order_by('username')
-    paginator = CustomPageNumberPagination()
+    ordering = USER_ORDERINGS.get(sort_by, USER_ORDERINGS['reputation'])
+    queryset = queryset.order_by(*ordering)
+    paginator = get_paginator(request, ordering, CustomPageNumberPagination, UserKeysetPagination)
     paginated_queryset = paginator.paginate_queryset(queryset, request)
     serializer = UserSerializer(paginated_queryset, many=True)
-    paginated_response = paginator.get_paginated_response(serializer.data)
-    cache.set(cache_key, paginated_response.data, timeout = 180)
-    return paginated_response
+    return paginator.get_paginated_response(serializer.data)
+
+
+user_list_async = async_cached('users_list', user_list)
 
 @api_view(['GET'])
 def user_details(request,id):
-    cache_key = f"user_details:{id}"
-    cached_response = cache.get(cache_key)
-    if cached_response:
-        return Response(cached_response, status=status.HTTP_200_OK)
-    try:
-        user = CustomUser.objects.get(pk=id)
-    except CustomUser.DoesNotExist:
+    record = profile_cache.get(id)
+    if record is None:
         return Response({'error': 'Пользователь не найден'}, status=404)
-
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "displayName": user.displayName,
-        "email": user.email,
-        "avatar_url": user.avatar_url ,
-        "reputation": user.reputation,
-        "location": user.location,
-        "about": user.about,
-        "member_since": user.member_since,
-        "last_seen": user.last_login,
-        "visit_streak": "Add in the future",
-        "gold_badges": user.gold_badges,
-        "silver_badges": user.silver_badges,
-        "bronze_badges": user.bronze_badges,
-    }
-    cache.set(cache_key, user_data, timeout = 180)
-    return Response(user_data,status = status.HTTP_200_OK)
-
-
-@authentication_classes([TokenAuthentication])
+    etag = profile_cache.etag(record)
+    if http.etag_matches(request, etag):
+        return http.not_modified(request, etag)
+    return http.add_validators(request, Response(profile_cache.public(record), status=status.HTTP_200_OK), etag)
+
+
+@csrf_exempt
+async def user_details_async(request, id):
+    """ASGI front of user_details: a cached profile is served without leaving the event loop."""
+    user = await acached_user(request)
+    record = None
+    if request.method == 'GET' and user is not None and http.wants_json(request):
+        record = await profile_cache.aget(id)
+    if record is None:
+        return await sync_to_async(user_details)(request, id=id)
+    request.user = user
+    etag = profile_cache.etag(record)
+    if http.etag_matches(request, etag):
+        return http.not_modified(request, etag)
+    body = FastJSONRenderer().render(profile_cache.public(record))
+    return http.add_validators(request, HttpResponse(body, content_type='application/json'), etag)
+
+
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 @api_view(['PATCH','GET'])
 def user_edit_get(request):
@@ -176,14 +182,13 @@ def user_edit_get(request):
         new_displayName = request.data.get('displayName')
         new_location = request.data.get('location')
         new_about = request.data.get('about')
+        avatar_file = request.FILES.get('avatar')
+        if avatar_file and not avatars.is_image(avatar_file):
+            return Response({"detail": "Avatar is not a valid image."}, status=status.HTTP_400_BAD_REQUEST)
         try:
             request_user = CustomUser.objects.get(id=request.user.id)
         except CustomUser.DoesNotExist:
             return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
-        avatar_file = request.FILES.get('avatar')
-        if avatar_file:
-            request_user.save_avatar(avatar_file,avatar_file.name)
-
         if new_displayName is not None and new_displayName != '' and new_displayName:
             request_user.displayName = new_displayName
         if new_location is not None and new_location != '' and new_location:
@@ -191,13 +196,11 @@ def user_edit_get(request):
         if new_about is not None and new_about != '' and new_about:
             request_user.about = new_about
         request_user.save()
-        user_id = request.user.id
-        print("user changed data, updating users_list cache")
-        update_users_list_cache.delay()
-        print("user changed data, updating user_details cache ", user_id, type(user_id))
-        update_users_details_cache.delay(user_id)
-        print("user changed data, updating user_me cache ", user_id, type(user_id))
-        update_users_me_cache.delay(user_id)
+        if avatar_file:
+            # staged after the save above, so that it cannot overwrite the avatar_url
+            # the media worker sets once the image is processed
+            avatars.stage(request_user, avatar_file)
+        debounce.schedule(update_users_list_cache)
 
         return Response({
             "id": request_user.id,
@@ -212,34 +215,19 @@ def user_edit_get(request):
             "visit_streak": "Add in the future",
         }, status=status.HTTP_200_OK)
     elif request.method == 'GET':
-        user_id = request.user.id
-        cache_key = f"user_profile:{user_id}"
-        cached_profile = cache.get(cache_key)
-        if cached_profile:
-            return JsonResponse(cached_profile, status=status.HTTP_200_OK)
-        try:
-            request_user = CustomUser.objects.get(id=user_id)
-        except CustomUser.DoesNotExist:
+        record = profile_cache.get(request.user.id)
+        if record is None:
             return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
-
-        user_data = {
-            "id": request_user.id,
-            "username": request_user.username,
-            "displayName": request_user.displayName,
-            "email": request_user.email,
-            "avatar_url": request_user.avatar_url,
-            "reputation": request_user.reputation,
-            "location": request_user.location,
-            "about": request_user.about,
-            "member_since": request_user.member_since,
-            "last_seen": request_user.last_login,
-            "visit_streak": "Add in the future",
-        }
-        cache.set(cache_key, user_data, timeout = 180)
-        return Response(user_data, status=status.HTTP_200_OK)
+        etag = profile_cache.etag(record)
+        if http.etag_matches(request, etag):
+            return http.not_modified(request, etag)
+        return http.add_validators(request, Response(profile_cache.private(record), status=status.HTTP_200_OK), etag)
 
 
 @api_view(['GET'])
+@cache_response('user_questions', [cache_ns.QUESTIONS], params={
+    'page': '1', 'page_size': '12', 'cursor': None, 'with_count': None, 'sort_by': 'views',
+})
 def user_questions(request,id):
     """
     ** Query
@@ -249,37 +237,25 @@ def user_questions(request,id):
     - `page_size`: integer(default: 10)
     - `sort_by`: string(options: 'newest', 'votes', 'views')
     """
-    query_params = request.query_params.dict()
-    key_raw = json.dumps(query_params,sort_keys=True)
-    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
-    cache_key = f"user_questions:{id}{key_hash}"
-    cached_response = cache.get(cache_key)
-    if cached_response:
-        return Response(cached_response, status=status.HTTP_200_OK)
     try:
         userr = CustomUser.objects.get(id=id)
     except CustomUser.DoesNotExist:
         return Response({"error":"User not found on this id"}, status=status.HTTP_404_NOT_FOUND)
-    queryset = Question.objects.filter(author=userr)
+    queryset = QuestionSerializer.setup_eager_loading(Question.objects.filter(author=userr))
     sort_by = request.query_params.get('sort_by')
-    if sort_by == 'votes':
-        queryset = queryset.order_by('-vote_count')
-    elif sort_by == 'views':
-        queryset = queryset.order_by('-view_count')
-    elif sort_by == 'newest':
-        queryset = queryset.order_by('-created_at')
-    else:
-        queryset = queryset.order_by('-view_count')
-
-    paginator = CustomPageNumberPagination()
+    ordering = USER_QUESTION_ORDERINGS.get(sort_by, USER_QUESTION_ORDERINGS['views'])
+    queryset = queryset.order_by(*ordering)
+
+    paginator = get_paginator(request, ordering, CustomPageNumberPagination, UserKeysetPagination)
     paginated_queryset = paginator.paginate_queryset(queryset, request)
     serializer = QuestionSerializer(paginated_queryset, many=True)
-    paginated_response = paginator.get_paginated_response(serializer.data)
-    cache.set(cache_key, paginated_response.data, timeout = 120)
-    return paginated_response
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
+@cache_response('user_answers', [cache_ns.ANSWERS], params={
+    'page': '1', 'page_size': '12', 'cursor': None, 'with_count': None, 'sort_by': 'votes',
+})
 def user_answers(request,id):
     """
     **Query Parameters**:
@@ -288,82 +264,66 @@ def user_answers(request,id):
         - `page_size`: integer (default: 10)
         - `sort_by`: string (options: 'newest', 'votes')
 """
-    query_params = request.query_params.dict()
-    key_raw = json.dumps(query_params,sort_keys=True)
-    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
-    cache_key = f"user_questions:{id}{key_hash}"
-    cached_response = cache.get(cache_key)
-    if cached_response:
-        return Response(cached_response, status=status.HTTP_200_OK)
-
     try:
         user = CustomUser.objects.get(id=id)
     except CustomUser.DoesNotExist:
         return Response({"error":"User not found on this id"}, status=status.HTTP_404_NOT_FOUND)
-    queryset = Answer.objects.filter(author=user)
+    queryset = AnswerSerializer.setup_eager_loading(Answer.objects.filter(author=user))
     sort_by = request.query_params.get('sort_by')
-    if sort_by == 'votes':
-        queryset = queryset.order_by('-vote_count')
-    elif sort_by == 'views':
-        queryset = queryset.order_by('-view_count')
-    elif sort_by == 'newest':
-        queryset = queryset.order_by('-created_at')
-    else:
-        queryset = queryset.order_by('-vote_count')
-
-    paginator = CustomPageNumberPagination()
+    ordering = USER_ANSWER_ORDERINGS.get(sort_by, USER_ANSWER_ORDERINGS['votes'])
+    queryset = queryset.order_by(*ordering)
+
+    paginator = get_paginator(request, ordering, CustomPageNumberPagination, UserKeysetPagination)
     paginated_queryset = paginator.paginate_queryset(queryset, request)
     serializer = AnswerSerializer(paginated_queryset, many=True)
-    paginated_response = paginator.get_paginated_response(serializer.data)
-    cache.set(cache_key, paginated_response.data, timeout = 120)
-    return paginated_response
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
+# votes on questions and answers move the scores and bump their namespace
+@cache_response('user_tags', [cache_ns.TAGS, cache_ns.QUESTIONS, cache_ns.ANSWERS])
 def user_tags(request,id):
-    query_params = request.query_params.dict()
-    key_raw = json.dumps(query_params, sort_keys=True)
-    key_hash = hashlib.md5(key_raw.encode()).hexdigest()
-    cache_key = f"user_questions:{id}{key_hash}"
-    cached_response = cache.get(cache_key)
-    if cached_response or cached_response == []:
-        return Response(cached_response, status=status.HTTP_200_OK)
+    """
+    The tags a user has posted in, best first. `posts` counts the user's questions and
+    answers carrying the tag and `score` is the sum of their votes (UserTagStats); before
+    UserTagStats, `posts` counted their questions only and `score` was the tag's
+    question count across the site.
+    """
     try:
         user = CustomUser.objects.get(id=id)
     except CustomUser.DoesNotExist:
         return Response({"message": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    tags_data = []
-    tags = Tag.objects.annotate(
-        total_count=Count('questions'),
-        user_count=Count('questions',filter=Q(questions__author__id=user.id))
-        ).filter(user_count__gt=0)
-    for tag in tags:
-        tags_data.append({
-            "id": tag.id,
-            "name": tag.name,
-            "score": tag.total_count,
-            "posts": tag.user_count
-        })
-    cache.set(cache_key, tags_data, timeout = 120)
+    # one indexed read of the rows Post.stats keeps up to date
+    tag_stats = (
+        UserTagStats.objects.filter(user=user, posts__gt=0)
+        .select_related('tag').order_by('-score', '-posts', '-tag')
+    )
+    tags_data = [
+        {
+            "id": stat.tag_id,
+            "name": stat.tag.name,
+            "score": stat.score,
+            "posts": stat.posts
+        }
+        for stat in tag_stats
+    ]
     return Response(tags_data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
+@cache_response('user_reputation_history', [cache_ns.USERS], params={
+    'page': '1', 'page_size': '12', 'cursor': None, 'with_count': None,
+})
 def user_reputation_history(request, id):
-    cache_key = f"user_reputation_history:{id}"
-    cached_response = cache.get(cache_key)
-    if cached_response:
-        return Response(cached_response, status=status.HTTP_200_OK)
     try:
         user = CustomUser.objects.get(id=id)
     except CustomUser.DoesNotExist:
         return Response({"message": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    queryset = Reputation.objects.filter(user=user).order_by('-date')
-    paginator = CustomPageNumberPagination()
+    ordering = ('-date', '-id')
+    queryset = Reputation.objects.filter(user=user).order_by(*ordering)
+    paginator = get_paginator(request, ordering, CustomPageNumberPagination, UserKeysetPagination)
     paginated_queryset = paginator.paginate_queryset(queryset, request)
     serializer = ReputationSerializer(paginated_queryset, many=True)
-    paginated_response = paginator.get_paginated_response(serializer.data)
-    cache.set(cache_key, paginated_response.data, timeout = 120)
-    return paginated_response
+    return paginator.get_paginated_response(serializer.data)